@@ -1,29 +1,253 @@
 # @Author : taojinmin
 # @Time : 2023/2/10 17:29
 from aiojobs import Scheduler
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterable, Union, Tuple
 import aiojobs
 import inspect
 import asyncio
 
+# 回调的执行方式: async 在事件循环中await, inline 在事件循环中直接调用, io 在线程池中执行, cpu 在进程池中执行
+callback_kinds = ("async", "inline", "io", "cpu")
+
+
+def cpu_bound(func: Callable) -> Callable:
+    """
+    标记为CPU密集型, 作为回调时在进程池中执行(必须是可以pickle的模块级函数)
+    """
+    func.callback_kind = "cpu"
+    return func
+
+
+def io_bound(func: Callable) -> Callable:
+    """
+    标记为阻塞IO型, 作为回调时在线程池中执行
+    """
+    func.callback_kind = "io"
+    return func
+
+
+class JobResult:
+    """
+    map/spawn_many 中单个任务的结果, 异常不会抛出而是记录在 exception 中
+    """
+    __slots__ = ("index", "item", "result", "exception")
+
+    def __init__(self, index: int, item: Any, result: Any = None, exception: BaseException = None):
+        self.index = index
+        self.item = item
+        self.result = result
+        self.exception = exception
+
+    @property
+    def ok(self) -> bool:
+        return self.exception is None
+
+    def __repr__(self):
+        return f"JobResult(index={self.index}, ok={self.ok}, result={self.result!r}, exception={self.exception!r})"
+
 
 class AsyncJobSchedular(Scheduler):
-    def __init__(self, limit: int = 100, pending_limit: int = 200):
+    def __init__(self, limit: int = 100, pending_limit: int = 200, max_errors: int = 1000,
+                 max_threads: int = None, max_processes: int = None):
+        """
+        :param limit: 同时运行的任务数
+        :param pending_limit: 等待运行的任务数, 超出后 start 会等待
+        :param max_errors: errors 中保留的最近异常数
+        :param max_threads: io 回调使用的线程池大小, 默认同 ThreadPoolExecutor
+        :param max_processes: cpu 回调使用的进程池大小, 默认为CPU核数
+        """
         super().__init__(limit=limit, pending_limit=pending_limit)
+        self.max_threads = max_threads
+        self.max_processes = max_processes
+        self._thread_pool: ThreadPoolExecutor = None
+        self._process_pool: ProcessPoolExecutor = None
+        # 没有任务时置位, join 据此等待而不是轮询
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.errors = deque(maxlen=max_errors)
+        self.failed_count = 0
+
+    def _executor(self, kind: str) -> Executor:
+        # 线程池/进程池在第一次用到时才创建, close 时关闭
+        if kind == "io":
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(self.max_threads)
+            return self._thread_pool
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(self.max_processes)
+        return self._process_pool
+
+    @staticmethod
+    def resolve_kind(func: Callable, kind: str = None, sync_default: str = "inline") -> str:
+        """
+        :param kind: 显式指定的执行方式, 优先于 cpu_bound/io_bound 的标记
+        :param sync_default: 未标记的普通函数的执行方式
+        """
+        kind = kind or getattr(func, "callback_kind", None)
+        if kind is None:
+            kind = "async" if inspect.iscoroutinefunction(func) else sync_default
+        if kind not in callback_kinds:
+            raise ValueError(f"callback kind must be one of {list(callback_kinds)}")
+        return kind
 
-    async def wrapper(self, coro, callback):
-        result = await coro
-        if inspect.iscoroutinefunction(callback):
-            result = await callback(result)
-        elif inspect.isfunction(callback):
-            result = callback(result)
-        elif inspect.ismethod(callback):
-            result = callback(result)
-        return result
+    async def _call(self, func: Callable, kind: str, arg: Any):
+        if kind == "async":
+            return await func(arg)
+        if kind == "inline":
+            return func(arg)
+        return await asyncio.get_event_loop().run_in_executor(self._executor(kind), func, arg)
 
-    async def start(self, coro, callback=None):
-        new_coro = self.wrapper(coro, callback)
-        await super().spawn(new_coro)
+    async def wrapper(self, coro, callback: Tuple[Callable, str] = None, timeout: float = None):
+        try:
+            if timeout is not None:
+                result = await asyncio.wait_for(coro, timeout)
+            else:
+                result = await coro
+            if callback is not None:
+                func, kind = callback
+                result = await self._call(func, kind, result)
+            return result
+        except Exception as e:
+            # 单个任务的异常(包括超时)记录下来, 不影响其他任务
+            self.failed_count += 1
+            self.errors.append(e)
+
+    async def spawn(self, coro) -> aiojobs.Job:
+        self._idle.clear()
+        try:
+            return await super().spawn(coro)
+        except BaseException:
+            if not len(self):
+                self._idle.set()
+            raise
+
+    def _done(self, job):
+        super()._done(job)
+        if not len(self):
+            self._idle.set()
+
+    async def start(self, coro, callback=None, timeout: float = None, callback_kind: str = None) -> aiojobs.Job:
+        """
+        :param callback: 以协程的结果为参数的回调, 其返回值作为任务的结果
+        :param timeout: 任务的超时秒数, 超时记为失败
+        :param callback_kind: 回调的执行方式(async/inline/io/cpu), 默认按 cpu_bound/io_bound 的标记,
+                              未标记的协程函数为async, 普通函数为inline
+        :return: aiojobs.Job, 可以 await job.wait() 获取结果(失败时为None)
+        """
+        # 回调的执行方式在提交时确定一次, 不在每个任务中重复判断
+        resolved = (callback, self.resolve_kind(callback, callback_kind)) if callback is not None else None
+        new_coro = self.wrapper(coro, resolved, timeout)
+        return await self.spawn(new_coro)
+
+    async def close(self):
+        await super().close()
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=False)
+        self._thread_pool = self._process_pool = None
+
+    async def join(self):
+        """
+        等待所有已提交的任务结束
+        """
+        await self._idle.wait()
 
     async def block_until_finish_all_jobs(self):
-        while self.pending_count or self.active_count:
-            await asyncio.sleep(0.005)
+        await self.join()
+
+    async def map(self, func: Callable = None, iterable: Union[Iterable, AsyncIterator] = (), concurrency: int = None,
+                  timeout: float = None, kind: str = None) -> AsyncIterator[JobResult]:
+        """
+        对 iterable 中的每一项执行 func, 按完成顺序产出 JobResult; 同时在途的任务不超过 concurrency,
+        iterable 按需惰性读取, 可以是很长的生成器或异步迭代器:
+            async for res in schedular.map(fetch, urls, concurrency=50):
+                if res.ok:
+                    ...
+        在途任务在生成器关闭时才会取消: 读完所有结果或出错时自动关闭, 但 async for 中 break 后生成器只是被挂起,
+        任务会继续运行直到生成器被垃圾回收. 需要提前退出时用 contextlib.aclosing(python3.10+) 包住, 或手动 aclose:
+            async with contextlib.aclosing(schedular.map(fetch, urls)) as results:
+                async for res in results:
+                    if res.ok:
+                        break
+        :param func: 协程函数或普通函数, 为None时 iterable 中的每一项本身就是协程
+        :param iterable: 可迭代对象或异步迭代对象
+        :param concurrency: 在途任务数上限, 默认为 limit
+        :param timeout: 每个任务的超时秒数
+        :param kind: func 的执行方式, 默认按标记, 未标记的普通函数在线程池中执行
+        """
+        kind = self.resolve_kind(func, kind, sync_default="io") if func is not None else None
+        concurrency = concurrency or self.limit or 100
+        slots = asyncio.Semaphore(concurrency)
+        results = asyncio.Queue()
+        # 在途任务, 收到结果后移除
+        jobs = dict()
+        feeder_done = object()
+
+        async def run(index: int, item: Any):
+            try:
+                aw = item if func is None else self._call(func, kind, item)
+                result = await (asyncio.wait_for(aw, timeout) if timeout is not None else aw)
+                results.put_nowait(JobResult(index, item, result=result))
+            except Exception as e:
+                results.put_nowait(JobResult(index, item, exception=e))
+            finally:
+                slots.release()
+
+        async def submit(index: int, item: Any):
+            try:
+                await slots.acquire()
+            except asyncio.CancelledError:
+                # 提前退出时已经取出但还没有运行的协程需要关闭, 避免 "never awaited" 警告
+                if func is None and asyncio.iscoroutine(item):
+                    item.close()
+                raise
+            jobs[index] = await self.spawn(run(index, item))
+
+        async def feed():
+            index = 0
+            try:
+                if hasattr(iterable, "__aiter__"):
+                    async for item in iterable:
+                        await submit(index, item)
+                        index += 1
+                else:
+                    for item in iterable:
+                        await submit(index, item)
+                        index += 1
+            finally:
+                results.put_nowait((feeder_done, index))
+
+        feeder = asyncio.ensure_future(feed())
+        total, received = None, 0
+        try:
+            while total is None or received < total:
+                item = await results.get()
+                if isinstance(item, tuple) and item[0] is feeder_done:
+                    total = item[1]
+                    # 迭代器本身出错时直接抛出
+                    feeder.result()
+                    continue
+                received += 1
+                jobs.pop(item.index, None)
+                yield item
+        finally:
+            # 调用方提前退出时取消尚未完成的任务
+            if not feeder.done():
+                feeder.cancel()
+            await asyncio.gather(feeder, return_exceptions=True)
+            await asyncio.gather(*[job.close() for job in jobs.values() if not job.closed], return_exceptions=True)
+
+    async def spawn_many(self, coros: Union[Iterable, AsyncIterator], concurrency: int = None,
+                         timeout: float = None) -> AsyncIterator[JobResult]:
+        """
+        并发运行一批协程, 按完成顺序产出 JobResult, 参数同 map; 提前退出时同样需要关闭生成器
+        """
+        results = self.map(None, coros, concurrency=concurrency, timeout=timeout)
+        try:
+            async for res in results:
+                yield res
+        finally:
+            # 本生成器被关闭时同时关闭 map, 立即取消在途任务
+            await results.aclose()
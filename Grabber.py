@@ -1,19 +1,39 @@
 # @Author : taojinmin
 # @Time : 2023/2/21 15:10
-from iotoolkit.util import LogKit, DefaultValue, FuncSet, SuccessRateCounter
+from iotoolkit.util import LogKit, DefaultValue, FuncSet, RequestStats, AIMDLimiter, TokenBucketLimiter, metrics
+from iotoolkit.util.RateLimiter import parse_retry_after, throttle_status
 from iotoolkit import ProxyProvider
+from iotoolkit.ProxyPool import ProxyPool
+from iotoolkit.ResponseCache import ResponseCache, CacheEntry, CachedResponse
 from itertools import cycle
+from urllib.parse import urlparse
 from faker import Factory
 
+import os
 import aiohttp
+from multidict import CIMultiDict
 import time
 import random
 import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
+
+
+# 带有这些请求头的请求不走响应缓存
+credential_headers = ("authorization", "cookie")
+# 合并请求中发起请求的一方被取消时交给等待者的标记
+_leader_cancelled = object()
 
 
 class StatusError(Exception):
-    def __init__(self, error_code):
+    def __init__(self, error_code, headers=None):
+        super().__init__(error_code)
         self.error_code = error_code
+        self.headers = headers or dict()
+
+    @property
+    def retry_after(self):
+        return parse_retry_after(self.headers.get("Retry-After"))
 
     def __str__(self):
         return repr(f"status code error:{self.error_code}")
@@ -25,20 +45,49 @@ class ResponseIsNoneError(Exception):
 
 
 class Grabber(LogKit):
-    session_pool = list()
     user_agent_factory = Factory.create(providers=["faker.providers.user_agent", "faker.providers.date_time"])
     proxy_provider: ProxyProvider = None
-    succ_counter = SuccessRateCounter(1000)
 
-    def __init__(self, session_count: int = 2):
+    def __init__(self, session_count: int = 2, limit: int = 100, limit_per_host: int = 10,
+                 ttl_dns_cache: int = 300, keepalive_timeout: float = 30.0,
+                 adaptive: bool = True, latency_threshold: float = None, cache: ResponseCache = None,
+                 rate_limiter: TokenBucketLimiter = None):
+        """
+        :param session_count: session数量, 所有session共用一个连接池
+        :param limit: 连接池的总连接数上限
+        :param limit_per_host: 每个host的连接数上限
+        :param ttl_dns_cache: DNS缓存的秒数
+        :param keepalive_timeout: 空闲keep-alive连接的保持秒数
+        :param adaptive: 是否按host使用AIMD自适应控制并发请求数(上限为 limit_per_host)
+        :param latency_threshold: 自适应控制中视为拥塞的延迟秒数, 默认只根据失败调整
+        :param cache: GET请求的响应缓存(MemoryResponseCache/DiskResponseCache), 开启后GET请求返回 CachedResponse
+        :param rate_limiter: 按host的令牌桶限速, 收到429/503时按 Retry-After 自动退避
+        """
         if session_count < 1:
             raise ValueError("session count must be greater than 0!")
         self.session_count = session_count
+        self.session_pool = list()
+        self.connector_kwargs = dict(limit=limit, limit_per_host=limit_per_host, use_dns_cache=True,
+                                     ttl_dns_cache=ttl_dns_cache, keepalive_timeout=keepalive_timeout)
+        # aiohttp 中 0 表示不限连接数, 自适应并发仍需要一个上限
+        max_concurrency = limit_per_host or limit or DefaultValue.grab_max_concurrency
+        self.limiter = AIMDLimiter(initial=max(1, min(8, max_concurrency)), max_limit=max_concurrency,
+                                   latency_threshold=latency_threshold) if adaptive else None
+        self.cache = cache
+        # 每个Grabber独立统计, 整体成功率沿用 succ_counter 的名字
+        self.stats = RequestStats(1000)
+        self.succ_counter = self.stats.total
+        self._last_log_ts = 0.0
+        self.rate_limiter = rate_limiter
+        # 进行中的GET请求, 相同请求只发一次, 其余调用等待同一个结果
+        self._inflight = dict()
+        self._metric_objs = dict()
         self._init_session_pool()
 
     def _init_session_pool(self):
+        self.connector = aiohttp.TCPConnector(**self.connector_kwargs)
         for i in range(self.session_count):
-            self.session_pool.append((aiohttp.ClientSession(), i))
+            self.session_pool.append((aiohttp.ClientSession(connector=self.connector, connector_owner=False), i))
         self.sess_cycle_iter = cycle(self.session_pool)
         self.logger.info(f"Grabber init success, create {self.session_count} sessions.")
 
@@ -46,46 +95,317 @@ class Grabber(LogKit):
         while self.session_pool:
             sess, _ = self.session_pool.pop()
             await sess.close()
+        await self.connector.close()
+
+    async def _send(self, sess: aiohttp.ClientSession, host: str,
+                    **kwargs) -> Tuple[Optional[aiohttp.ClientResponse], float, Optional[Exception]]:
+        """
+        :return: (响应, 耗时, 异常), 耗时从拿到并发名额后开始计算, 不包含排队等待的时间
+        """
+        if self.limiter is None:
+            return await self._timed_request(sess, **kwargs)
+        # 并发名额只覆盖到收到响应头为止, 响应体由调用方读取
+        async with self.limiter.slot(host):
+            return await self._timed_request(sess, **kwargs)
+
+    @staticmethod
+    async def _timed_request(sess: aiohttp.ClientSession, **kwargs):
+        start_ts = time.time()
+        try:
+            return await sess.request(**kwargs), time.time() - start_ts, None
+        except Exception as e:
+            return None, time.time() - start_ts, e
+
+    @staticmethod
+    def _is_congested(e: Exception) -> bool:
+        # 普通4xx是请求本身的问题, 不代表对端过载
+        if isinstance(e, StatusError):
+            return e.error_code == 429 or e.error_code >= 500
+        return True
+
+    def _record_metrics(self, host: str, outcome: str, cost_time: float, content_length: int = None):
+        # 指标对象按 (host, outcome) 缓存, 每个请求不再查找注册表
+        key = (host, outcome)
+        entry = self._metric_objs.get(key)
+        if entry is None:
+            entry = self._metric_objs[key] = (
+                metrics.counter("iotoolkit_http_requests_total", "http requests by outcome", host=host, outcome=outcome),
+                metrics.histogram("iotoolkit_http_request_seconds", "seconds until response headers", host=host),
+                metrics.counter("iotoolkit_http_response_bytes_total", "declared response body bytes", host=host),
+            )
+        requests_total, request_seconds, response_bytes = entry
+        requests_total.inc()
+        request_seconds.observe(cost_time)
+        if content_length:
+            response_bytes.inc(content_length)
+
+    @staticmethod
+    def _is_proxy_failure(e: Exception) -> bool:
+        # 连接失败/超时, 以及代理鉴权失败或被目标站点封禁/限流时算作代理的问题
+        if isinstance(e, StatusError):
+            return e.error_code in (403, 407, 429)
+        return True
 
     async def request(self, method: str = "GET", url: str = None, headers: dict = None,
                       body=None, timeout=None, use_proxy=False, allow_redirects=True,
-                      retry_times: int = 3, interval_tup: tuple = (1.0, 1.0), ssl=None):
+                      retry_times: int = 3, interval_tup: tuple = (1.0, 1.0), ssl=None, use_cache: bool = True):
+        """
+        :param use_cache: 设置了 cache 时, GET请求是否走缓存; 带 Authorization/Cookie 请求头的请求不走缓存
+        """
+        kwargs = dict(url=url, headers=headers, body=body, timeout=timeout, use_proxy=use_proxy,
+                      allow_redirects=allow_redirects, retry_times=retry_times, interval_tup=interval_tup, ssl=ssl)
+        if self.cache is None or not use_cache or method.upper() != "GET" or body is not None \
+                or self._has_credentials(headers):
+            return await self._request(method=method, **kwargs)
+        return await self._cached_get(**kwargs)
+
+    @staticmethod
+    def _has_credentials(headers: dict) -> bool:
+        # 带身份信息的响应可能因人而异, 不能共享缓存
+        return any(name.lower() in credential_headers for name in headers or ())
+
+    @staticmethod
+    def _cache_key(url: str, headers: dict = None, vary: Tuple[str, ...] = ()) -> str:
+        key = f"GET {url}"
+        if vary:
+            headers = CIMultiDict(headers or {})
+            key += "".join(f"\n{name}: {headers.get(name, '')}" for name in vary)
+        return key
+
+    def _cache_lookup(self, url: str, headers: dict = None) -> Tuple[str, Optional[CacheEntry]]:
+        key = self._cache_key(url)
+        entry = self.cache.get(key)
+        if entry is not None and entry.is_vary_marker:
+            # url对应的键上只记录了 Vary 的请求头名, 按这些请求头的值取对应的变体
+            key = self._cache_key(url, headers, entry.vary)
+            entry = self.cache.get(key)
+        return key, entry
+
+    async def _cached_get(self, url: str, headers: dict = None, **kwargs):
+        # 相同url且请求头相同的请求才合并为一次
+        flight_key = (url, tuple(sorted((headers or {}).items())))
+        while True:
+            key, entry = self._cache_lookup(url, headers)
+            if entry is not None and entry.is_fresh():
+                return CachedResponse(entry, from_cache=True)
+            fut = self._inflight.get(flight_key)
+            if fut is None:
+                break
+            # shield: 某个等待者被取消不影响正在进行的请求
+            result = await asyncio.shield(fut)
+            if result is not _leader_cancelled:
+                return result
+            # 发起请求的一方被取消, 由等待者重新查缓存并发起请求
+        fut = self._inflight[flight_key] = asyncio.get_event_loop().create_future()
+        try:
+            result = await self._revalidate(key, url, entry, headers=headers, **kwargs)
+        except asyncio.CancelledError:
+            fut.set_result(_leader_cancelled)
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved"
+            fut.exception()
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(flight_key, None)
+
+    async def _revalidate(self, key: str, url: str, entry: CacheEntry, headers: dict = None, **kwargs):
+        request_headers = headers
+        headers = dict(headers or {"User-Agent": self.user_agent_factory.user_agent()})
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        resp = await self._request(method="GET", url=url, headers=headers, **kwargs)
+        if resp is None:
+            return None
+        try:
+            if resp.status == 304 and entry is not None:
+                entry.refresh(resp.headers, self.cache.default_ttl)
+                self.cache.set(key, entry)
+                return CachedResponse(entry, from_cache=True)
+            body = await resp.read()
+        finally:
+            resp.release()
+        new_entry = CacheEntry.from_response(url, resp.status, resp.headers, body, self.cache.default_ttl)
+        if new_entry is not None:
+            new_key = self._cache_key(url, request_headers, new_entry.vary)
+            if new_entry.vary:
+                self.cache.set(self._cache_key(url), CacheEntry.vary_marker(url, new_entry.vary))
+            if new_key != key and entry is not None:
+                self.cache.delete(key)
+            self.cache.set(new_key, new_entry)
+        elif entry is not None:
+            self.cache.delete(key)
+        return CachedResponse(new_entry or CacheEntry(url, resp.status, CIMultiDict(resp.headers), body, 0, 0))
+
+    async def _request(self, method: str = "GET", url: str = None, headers: dict = None,
+                       body=None, timeout=None, use_proxy=False, allow_redirects=True,
+                       retry_times: int = 3, interval_tup: tuple = (1.0, 1.0), ssl=None, accept_status: tuple = ()):
         _timeout = timeout or DefaultValue.grab_time_out
+        host = urlparse(url).hostname or ""
         sess, sess_id = next(self.sess_cycle_iter)
         for t in range(retry_times):
             if use_proxy and self.proxy_provider:
-                proxy = await self.proxy_provider.get_proxy()
+                if isinstance(self.proxy_provider, ProxyPool):
+                    # 同一个session固定使用同一个代理, 复用到代理的keep-alive连接
+                    proxy = await self.proxy_provider.get_proxy(pin=sess_id)
+                else:
+                    proxy = await self.proxy_provider.get_proxy()
             else:
                 proxy = None
+            if self.rate_limiter:
+                await self.rate_limiter.acquire(host)
             start_ts = time.time()
+            resp = None
+            cost_time = 0.0
             try:
                 if not headers:
                     headers = {"User-Agent": self.user_agent_factory.user_agent()}
-                resp = await sess.request(url=url, method=method, headers=headers,
-                                          data=body, proxy=proxy, allow_redirects=allow_redirects,
-                                          timeout=_timeout,
-                                          ssl=ssl or False
-                                          )
-                if str(resp.status)[0] not in "23":
-                    raise StatusError(resp.status)
+                resp, cost_time, error = await self._send(sess, host, url=url, method=method, headers=headers,
+                                                          data=body, proxy=proxy, allow_redirects=allow_redirects,
+                                                          timeout=_timeout,
+                                                          ssl=ssl or False
+                                                          )
+                if error is not None:
+                    raise error
                 if resp is None:
                     raise ResponseIsNoneError()
-                self.succ_counter.success()
-                msg = self.grabber_succ_msg_tmpl.format(sess_id, method, url, resp.status,
-                                                        FuncSet.x2humansTime(time.time() - start_ts), self.succ_counter.rate())
-                self.logger.info(msg)
+                if str(resp.status)[0] not in "23" and resp.status not in accept_status:
+                    raise StatusError(resp.status, resp.headers)
+                if self.rate_limiter:
+                    self.rate_limiter.feedback(host, status=resp.status)
+                if proxy:
+                    self.proxy_provider.report(proxy, ok=True, latency=cost_time)
+                if self.limiter:
+                    self.limiter.feedback(host, cost_time, ok=True)
+                self.stats.record(host, ok=True, latency=cost_time)
+                self._record_metrics(host, "success", cost_time, resp.content_length)
+                # 成功日志最多每 progress_log_interval 秒输出一次, 失败日志照常输出
+                if start_ts - self._last_log_ts >= DefaultValue.progress_log_interval:
+                    self._last_log_ts = start_ts
+                    msg = self.grabber_succ_msg_tmpl.format(sess_id, method, url, resp.status,
+                                                            FuncSet.x2humansTime(cost_time), self.succ_counter.rate())
+                    self.logger.info(msg)
                 return resp
             except Exception as e:
-                self.succ_counter.fail()
+                if resp is not None:
+                    # 失败的响应不会返回给调用方, 需要在这里把连接还给连接池
+                    resp.release()
+                if self.limiter:
+                    self.limiter.feedback(host, cost_time, ok=not self._is_congested(e))
+                if proxy:
+                    self.proxy_provider.report(proxy, ok=not self._is_proxy_failure(e), latency=cost_time)
+                throttled = isinstance(e, StatusError) and e.error_code in throttle_status
+                if self.rate_limiter:
+                    self.rate_limiter.feedback(host, status=getattr(e, "error_code", None),
+                                               retry_after=e.retry_after if throttled else None, ok=False)
+                self.stats.record(host, ok=False, latency=cost_time)
+                self._record_metrics(host, "fail", cost_time)
                 msg = self.grabber_fail_msg_tmpl.format(sess_id, t + 1, method, url, e.__repr__(),
-                                                        FuncSet.x2humansTime(time.time() - start_ts), self.succ_counter.rate())
+                                                        FuncSet.x2humansTime(cost_time), self.succ_counter.rate())
                 self.logger.error(msg)
-                await asyncio.sleep(random.uniform(*interval_tup))
+                if not (throttled and self.rate_limiter):
+                    # 被限流时由 rate_limiter 负责等待
+                    await asyncio.sleep(random.uniform(*interval_tup))
                 sess, sess_id = next(self.sess_cycle_iter)
         else:
             msg = self.grabber_give_up_msg_tmpl.format(sess_id, method, url)
             self.logger.error(msg)
             
+    @staticmethod
+    def _stream_timeout(timeout) -> aiohttp.ClientTimeout:
+        if isinstance(timeout, aiohttp.ClientTimeout):
+            return timeout
+        # 大文件不限制总耗时, 只限制建连和两次读取之间的间隔
+        timeout = timeout or DefaultValue.grab_time_out
+        return aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+
+    @asynccontextmanager
+    async def stream(self, url: str, method: str = "GET", chunk_size: int = 64 * 1024, timeout=None, **kwargs):
+        """
+        流式读取响应体, 内存占用与 chunk_size 相当, 退出 async with 时归还连接:
+            async with grabber.stream(url) as chunks:
+                async for chunk in chunks:
+                    ...
+        :param chunk_size: 每个块的字节数(最后一块可能更小)
+        :param timeout: 秒数时表示建连和每次读取的超时, 也可以传入 aiohttp.ClientTimeout
+        :param kwargs: 其余参数同 request
+        """
+        resp = await self._request(method=method, url=url, timeout=self._stream_timeout(timeout), **kwargs)
+        if resp is None:
+            raise ResponseIsNoneError()
+        try:
+            yield resp.content.iter_chunked(chunk_size)
+        finally:
+            resp.release()
+
+    async def download(self, url: str, path: str, chunk_size: int = 64 * 1024, headers: dict = None,
+                       timeout=None, retry_times: int = 3, interval_tup: tuple = (1.0, 1.0), **kwargs) -> int:
+        """
+        边下载边写入 path + ".part", 完成后改名为 path. 中断后再次调用(或读取中途失败重试时)用 Range 请求从已下载的位置继续,
+        服务端不支持 Range 时从头下载. 续传需要响应的 ETag/Last-Modified(保存在 path + ".part.validator")作为 If-Range,
+        没有时从头下载, 避免文件在两次请求之间变化后拼接出错误的文件.
+        :param retry_times: 请求的总次数上限(至少为1), 建立连接失败/状态码错误和读取中途断开都计入, 每次失败后等待 interval_tup
+        :param kwargs: 其余参数同 request
+        :return: 文件的字节数
+        """
+        if retry_times < 1:
+            raise ValueError("retry times must be greater than 0!")
+        part_path = path + ".part"
+        validator_path = part_path + ".validator"
+        last_error = None
+        for t in range(retry_times):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            validator = None
+            if os.path.exists(validator_path):
+                with open(validator_path) as f:
+                    validator = f.read().strip()
+            req_headers = dict(headers or {"User-Agent": self.user_agent_factory.user_agent()})
+            if offset and validator:
+                req_headers["Range"] = f"bytes={offset}-"
+                # 文件在两次请求之间变化时服务端会返回完整的200响应, 不会拼接出错误的文件
+                req_headers["If-Range"] = validator
+            resp = await self._request(method="GET", url=url, headers=req_headers, timeout=self._stream_timeout(timeout),
+                                       retry_times=1, interval_tup=interval_tup, accept_status=(416,), **kwargs)
+            if resp is None:
+                # 请求失败, _request 已经记录日志并等待过 interval_tup, 由本循环统一重试
+                last_error = ResponseIsNoneError()
+                continue
+            try:
+                if resp.status == 416:
+                    # 请求的起点已超过文件末尾: .part 已经是完整的文件
+                    if resp.headers.get("Content-Range", "") != f"bytes */{offset}":
+                        raise StatusError(resp.status)
+                    break
+                validator = resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+                if validator:
+                    with open(validator_path, "w") as f:
+                        f.write(validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+                with open(part_path, "ab" if resp.status == 206 else "wb") as f:
+                    async for chunk in resp.content.iter_chunked(chunk_size):
+                        f.write(chunk)
+                break
+            except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                last_error = e
+                self.logger.error(f"download {url} interrupted({t + 1}): {e.__repr__()}")
+                await asyncio.sleep(random.uniform(*interval_tup))
+            finally:
+                resp.release()
+        else:
+            raise last_error
+        os.replace(part_path, path)
+        if os.path.exists(validator_path):
+            os.remove(validator_path)
+        return os.path.getsize(path)
+
     def set_proxy_provider(self, provider: ProxyProvider):
         self.proxy_provider = provider
 
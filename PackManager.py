@@ -30,14 +30,35 @@ class PackManager(LogKit):
             if pack_instance.origin_conn_obj.cli:
                 await pack_instance.origin_conn_obj.cli.close()
                 pack_instance.origin_conn_obj.pool.reset()
+            if pack_instance.origin_conn_obj.raw_cli:
+                await pack_instance.origin_conn_obj.raw_cli.close()
+                pack_instance.origin_conn_obj.raw_pool.reset()
 
         elif pack_instance.scheme == "mysql":
             pack_instance.origin_conn_obj.pool.close()
+
+        elif pack_instance.scheme == "file":
+            self.close_file_pack(pack_instance)
+            return
+        self.logger.info(f"close connection of {pack_instance.scheme}")
+
+    def close_file_pack(self, pack_instance: "BasePack"):
+        for writer in pack_instance.origin_conn_obj.writers or []:
+            if not writer.closed:
+                writer.close_sync()
         self.logger.info(f"close connection of {pack_instance.scheme}")
 
     def close_all(self):
+        packs = list(self._running_packs.values())
+        # 文件的关闭不需要事件循环, asyncio.run 结束后也能执行, 先于其他连接关闭
+        for pack_instance in packs:
+            if pack_instance.scheme == "file":
+                self.close_file_pack(pack_instance)
+        packs = [pack_instance for pack_instance in packs if pack_instance.scheme != "file"]
+        if not packs:
+            return
         loop = asyncio.get_event_loop()
-        for _, pack_instance in self._running_packs.items():
+        for pack_instance in packs:
             loop.run_until_complete(self.close_pack_conn_obj(pack_instance))
 
 
@@ -2,11 +2,11 @@
 # @Time : 2023/2/6 18:32
 import asyncio
 from abc import ABC, abstractmethod, abstractproperty
-from typing import List, Any
+from typing import List, Any, AsyncIterator
 from types import MappingProxyType, FunctionType
 from iotoolkit.PackManager import pack_manager
 from urllib.parse import urlparse
-from iotoolkit.util import LogKit, FuncSet
+from iotoolkit.util import LogKit, FuncSet, CheckpointStore, DefaultValue, metrics
 from time import time
 
 
@@ -116,6 +116,11 @@ class BaseGetter(ABC, LogKit):
         self.first_fetch_ts = None
         self.last_fetch_ts = None
         self.batch_size = batch_size
+        # 断点续传时恢复的断点及已读取数量, 已恢复的数量不参与速度的计算
+        self.resumed_from = None
+        self.resumed_cnt = 0
+        self._metrics = None
+        self._last_log_ts = 0.0
     
     def __aiter__(self):
         """
@@ -147,21 +152,48 @@ class BaseGetter(ABC, LogKit):
         # fetch stats
         # 已读取数量
         self.done_cnt += len(next_lst)
-        # 读取完成率
-        self.finish_rate = self.done_cnt / self.total_cnt
-        finish_rate_str = "%.2f" % (self.finish_rate * 100)
-        # 每一秒的获取数量
-        fetch_cnt_per_sec = self.done_cnt / (time() - self.first_fetch_ts)
-        # 剩余时间的计算
-        left_time = (self.total_cnt - self.done_cnt) / fetch_cnt_per_sec
-        
-        msg = self.getter_batch_msg_tmpl.format(self.src_name, len(next_lst), self.done_cnt, self.total_cnt,
-                                                finish_rate_str,
-                                                FuncSet.x2humansTime(cost_time), FuncSet.x2humansTime(left_time))
-        self.logger.info(msg)
+        rows_metric, batch_metric, progress_metric, eta_metric = self._get_metrics()
+        rows_metric.inc(len(next_lst))
+        batch_metric.observe(cost_time)
+        left_time = None
+        if self.total_cnt > 0:
+            # 读取完成率
+            self.finish_rate = self.done_cnt / self.total_cnt
+            # 每一秒的获取数量
+            fetch_cnt_per_sec = (self.done_cnt - self.resumed_cnt) / max(curr_ts - self.first_fetch_ts, 1e-6)
+            # 剩余时间的计算
+            left_time = max(self.total_cnt - self.done_cnt, 0) / max(fetch_cnt_per_sec, 1e-6)
+            progress_metric.set(self.finish_rate)
+            eta_metric.set(left_time)
+
+        # 进度日志最多每 progress_log_interval 秒输出一次, 不输出时也不格式化
+        if curr_ts - self._last_log_ts >= DefaultValue.progress_log_interval:
+            self._last_log_ts = curr_ts
+            if left_time is not None:
+                finish_rate_str = "%.2f" % (self.finish_rate * 100)
+                left_time_str = FuncSet.x2humansTime(left_time)
+                total_cnt_str = self.total_cnt
+            else:
+                # 总数未知(例如流式读取时跳过了计数), 不计算进度与剩余时间
+                finish_rate_str, left_time_str, total_cnt_str = "-", "unknown", "?"
+            msg = self.getter_batch_msg_tmpl.format(self.src_name, len(next_lst), self.done_cnt, total_cnt_str,
+                                                    finish_rate_str,
+                                                    FuncSet.x2humansTime(cost_time), left_time_str)
+            self.logger.info(msg)
 
         return next_lst
     
+    def _get_metrics(self) -> tuple:
+        # src_name 可能在子类的 __init__ 中才确定, 第一次读取时再创建指标
+        if self._metrics is None:
+            self._metrics = (
+                metrics.counter("iotoolkit_rows_read_total", "rows read by getters", src=self.src_name),
+                metrics.histogram("iotoolkit_read_batch_seconds", "seconds per fetched batch", src=self.src_name),
+                metrics.gauge("iotoolkit_read_progress_ratio", "read progress, 0-1", src=self.src_name),
+                metrics.gauge("iotoolkit_read_eta_seconds", "estimated seconds left", src=self.src_name),
+            )
+        return self._metrics
+
     @abstractmethod
     async def _get_total_count(self):
         ...
@@ -170,6 +202,59 @@ class BaseGetter(ABC, LogKit):
     async def _get_next_lst(self):
         ...
 
+    def _get_position(self) -> Any:
+        """
+        当前读取位置(已经产出的最后一个批次之后), 需可json序列化; 默认为已读取数量
+        """
+        return self.done_cnt
+
+    def _set_position(self, position: Any):
+        """
+        在开始读取之前恢复读取位置
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} does not support resume.")
+
+    async def get_total_count(self) -> int:
+        """
+        统计并返回数据总数(total_cnt), 不开始读取
+        """
+        await self._get_total_count()
+        return self.total_cnt
+
+    def checkpoint_state(self) -> dict:
+        """
+        当前位置的断点快照
+        """
+        return {"done_cnt": self.done_cnt, "position": self._get_position()}
+
+    def restore(self, state: dict):
+        """
+        从断点恢复, 必须在第一次读取之前调用
+        :param state: checkpoint_state() 的结果, 通常来自 CheckpointStore.load
+        """
+        if self.first_fetch_ts:
+            raise RuntimeError("getter has already started, can not restore.")
+        self._set_position(state["position"])
+        self.done_cnt = self.resumed_cnt = state["done_cnt"]
+        self.resumed_from = state
+        self.logger.info(f"resume {self.src_name} from {self.done_cnt}")
+
+    def push_down_projection(self, fields: List[str]) -> bool:
+        """
+        把下游需要的字段下推到数据源, 只读取这些字段, 必须在第一次读取之前调用
+        :return: 数据源是否支持下推, 不支持时数据保持不变
+        """
+        return False
+
+    def commit(self, store: CheckpointStore, key: str, **extra):
+        """
+        写入方确认当前批次写入成功后, 把当前位置保存到断点存储中, 例如:
+            async for lst in getter:
+                await writer.write(lst)
+                getter.commit(store, "job", written=writer.written)
+        """
+        store.save(key, dict(self.checkpoint_state(), **extra))
+
    
 class BaseWriter(ABC, LogKit):
     # dst_name: 用于输出日志时指示写入源的名称
@@ -177,18 +262,175 @@ class BaseWriter(ABC, LogKit):
 
     def __init__(self):
         self.written = 0
+        self.failed = 0
+        self._metrics = None
+        self._last_log_ts = 0.0
+
+    def _get_metrics(self) -> tuple:
+        if self._metrics is None:
+            self._metrics = (
+                metrics.counter("iotoolkit_rows_written_total", "rows written by writers", dst=self.dst_name),
+                metrics.counter("iotoolkit_rows_failed_total", "rows rejected by writers", dst=self.dst_name),
+                metrics.histogram("iotoolkit_write_batch_seconds", "seconds per written batch", dst=self.dst_name),
+            )
+        return self._metrics
 
     async def write(self, lst: List[Any], *args, **kwargs):
+        """
+        :return: _handle_lst 报告的写入失败的数据, 没有失败时为空列表
+        """
         try:
             before_write_ts = time()
-            await self._handle_lst(lst, *args, **kwargs)
+            failures = await self._handle_lst(lst, *args, **kwargs) or []
             cost_time = time() - before_write_ts
-            self.written += len(lst)
-            self.logger.info(self.writer_batch_msg_tmpl.format(self.dst_name, len(lst), self.written,
-                                                               FuncSet.x2humansTime(cost_time)))
+            self.written += len(lst) - len(failures)
+            self.failed += len(failures)
+            written_metric, failed_metric, batch_metric = self._get_metrics()
+            written_metric.inc(len(lst) - len(failures))
+            failed_metric.inc(len(failures))
+            batch_metric.observe(cost_time)
+            curr_ts = time()
+            if curr_ts - self._last_log_ts >= DefaultValue.progress_log_interval:
+                self._last_log_ts = curr_ts
+                self.logger.info(self.writer_batch_msg_tmpl.format(self.dst_name, len(lst), self.written,
+                                                                   FuncSet.x2humansTime(cost_time)))
+            return failures
         except Exception as e:
             self.logger.error(e)
 
     @abstractmethod
     async def _handle_lst(self, lst: List[Any], *args, **kwargs):
+        """
+        写入一个批次, 可以返回写入失败的数据列表(逐条报告失败而不是抛出异常)
+        """
         ...
+
+
+class BaseParallelGetter(BaseGetter):
+    """
+    多分区并行读取: 每个分区是一个产出批次的异步生成器, 各自在独立的协程中读取,
+    结果汇入同一个有界队列, 对外仍表现为单个 getter, 进度统计沿用 BaseGetter.
+    分区的划分和每个分区已产出的位置都会记录在断点中, 续传时沿用原来的划分.
+    """
+
+    def __init__(self, src_name: str = "", batch_size: int = None, max_size: int = 0, prefetch: int = 0):
+        """
+        :param prefetch: 队列容量, 默认为分区数的2倍
+        """
+        super().__init__(src_name=src_name, batch_size=batch_size, max_size=max_size)
+        self.prefetch = prefetch
+        self._queue: asyncio.Queue = None
+        self._tasks = list()
+        self._alive = 0
+        self._specs: List[Any] = None
+        self._positions: List[Any] = None
+        self._finished: List[bool] = None
+
+    @abstractmethod
+    async def _build_partitions(self) -> List[Any]:
+        """
+        划分分区, 返回每个分区的描述(需可json序列化)
+        """
+        ...
+
+    @abstractmethod
+    def _read_partition(self, spec: Any, position: Any) -> AsyncIterator[List[Any]]:
+        """
+        读取一个分区的异步生成器
+        :param spec: 分区描述
+        :param position: 分区内的位置, None 表示从头读取, 否则从该位置之后继续读取
+        """
+        ...
+
+    def _advance(self, spec: Any, position: Any, lst: List[Any]) -> Any:
+        """
+        分区产出 lst 之后的位置, 默认为分区内已读取的数量
+        """
+        return (position or 0) + len(lst)
+
+    async def _drain_partition(self, idx: int, partition: AsyncIterator[List[Any]]):
+        try:
+            async for lst in partition:
+                if lst:
+                    await self._queue.put((idx, lst))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 异常作为该分区的结束标记交给消费端抛出
+            await self._queue.put((idx, e))
+            return
+        finally:
+            # 确保分区内的游标/链接在任务结束或被取消时立刻回收
+            await partition.aclose()
+        await self._queue.put((idx, None))
+
+    async def _start_partitions(self):
+        if self._specs is None:
+            self._specs = await self._build_partitions()
+            self._positions = [None] * len(self._specs)
+            self._finished = [False] * len(self._specs)
+        pending = [idx for idx, finished in enumerate(self._finished) if not finished]
+        self._queue = asyncio.Queue(maxsize=self.prefetch or len(pending) * 2 or 1)
+        self._alive = len(pending)
+        self._tasks = [asyncio.ensure_future(
+            self._drain_partition(idx, self._read_partition(self._specs[idx], self._positions[idx])))
+            for idx in pending]
+
+    async def _get_next_lst(self) -> List[Any]:
+        if self._queue is None:
+            await self._start_partitions()
+        while self._alive:
+            idx, item = await self._queue.get()
+            if item is None:
+                self._alive -= 1
+                self._finished[idx] = True
+                continue
+            if isinstance(item, Exception):
+                await self.close()
+                raise item
+            # 出队时才推进分区位置, 断点只包含已经交给调用方的数据
+            self._positions[idx] = self._advance(self._specs[idx], self._positions[idx], item)
+            return item
+        return []
+
+    def _get_position(self) -> Any:
+        if self._specs is None:
+            return None
+        return {"specs": list(self._specs), "positions": list(self._positions), "finished": list(self._finished)}
+
+    async def plan_partitions(self, groups: int = 1) -> List[Any]:
+        """
+        划分分区但不开始读取, 把分区轮流分成至多 groups 组, 供 ShardedTransfer 等把分区分配到多个进程
+        :return: 每组只包含本组分区的断点位置, 可以作为 restore 的 position
+        """
+        specs = await self._build_partitions()
+        groups = min(groups, len(specs))
+        saved = self._specs, self._positions, self._finished
+        plans = list()
+        try:
+            for idx in range(groups):
+                # 借用断点格式(如 Mongo 的扩展json)序列化分区描述
+                self._specs = specs[idx::groups]
+                self._positions = [None] * len(self._specs)
+                self._finished = [False] * len(self._specs)
+                plans.append(self._get_position())
+        finally:
+            self._specs, self._positions, self._finished = saved
+        return plans
+
+    def _set_position(self, position: Any):
+        if position:
+            self._specs = position["specs"]
+            self._positions = position["positions"]
+            self._finished = position["finished"]
+
+    async def close(self):
+        """
+        取消所有分区的读取任务
+        """
+        self._alive = 0
+        for task in self._tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = list()
@@ -4,25 +4,74 @@
 import aioredis
 import redis
 import json
+import asyncio
 
-from iotoolkit.Packs.Base import BasePack, BaseGetter, BaseWriter, OriginConnObj
-from iotoolkit.util import LogKit, DefaultValue, FuncSet
+from iotoolkit.Packs.Base import BasePack, BaseGetter, BaseWriter, BaseParallelGetter, OriginConnObj
+from iotoolkit.util import LogKit, DefaultValue, FuncSet, Codec, get_codec, to_bytes
 from iotoolkit.PackManager import pack_manager
 from elasticsearch import AsyncElasticsearch
 from elasticsearch.helpers import async_scan, async_bulk
+from elasticsearch.exceptions import TransportError, SerializationError
+from elasticsearch.serializer import JSONSerializer
 from types import FunctionType
-from typing import List, Any
+from typing import List, Any, Tuple
 from time import time
 
+# 默认只保留搬运需要的字段, 去掉 _score/_type 等, 减小响应体积
+DEFAULT_FILTER_PATH = ["_scroll_id", "hits.hits._id", "hits.hits._index", "hits.hits._routing", "hits.hits._source"]
+
+
+async def _count_docs(cli: AsyncElasticsearch, index_name: str, query: dict = None, doc_type: str = None) -> int:
+    query_copy = query.copy() if query else None
+    if query_copy:
+        # count接口不接受分页及排序参数
+        for key in ("size", "sort", "slice", "_source"):
+            query_copy.pop(key, None)
+    res = await cli.count(index=index_name, body=query_copy, doc_type=doc_type)
+    return res["count"]
+
+
+def _get_hits(resp: dict) -> List:
+    # filter_path 过滤后没有命中时 hits 字段整个不存在
+    return resp.get("hits", {}).get("hits", [])
+
+
+class CodecSerializer(JSONSerializer):
+    """
+    用 Codec 编码请求、解码响应的序列化器, 如 orjson 可以明显加快大批量 scroll 响应的解析
+    """
+
+    def __init__(self, codec: Codec):
+        self.codec = codec
+
+    def loads(self, s):
+        try:
+            return self.codec.decode(s)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        # 已经序列化好的请求体(如bulk)原样发送
+        if isinstance(data, (str, bytes)):
+            return data
+        try:
+            return self.codec.encode(data)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(data, e)
+
 
 class ESPack(LogKit, BasePack):
 
-    def __init__(self,  hosts=None, **kwargs):
+    def __init__(self,  hosts=None, codec=None, **kwargs):
         """
         注意ESPack的构造方法和其他数据库不一样
+        :param codec: 请求/响应的序列化方式(json/orjson 或 Codec 实例), 同时作为 ESWriter 的默认序列化方式
         """
         self.scheme = "es"
         self.hosts = hosts
+        self.codec: Codec = get_codec(codec, text_only=True) if codec is not None else None
+        if self.codec is not None:
+            kwargs.setdefault("serializer", CodecSerializer(self.codec))
         self.kwargs = kwargs
         self.origin_conn_obj = OriginConnObj()
         pack_manager.register_pack(self)
@@ -37,19 +86,60 @@ class ESPack(LogKit, BasePack):
         self.origin_conn_obj.cli = AsyncElasticsearch(hosts=self.hosts, **self.kwargs)
 
     @FuncSet.ensure_connected
-    async def new_getter(self, index_name: str, doc_type: str = "", query: dict = None, batch_size: int = 100, max_size: int = 0):
-        return ESGetter(cli=self.origin_conn_obj.cli, index_name=index_name, query = query, batch_size=batch_size, max_size=max_size)
+    async def new_getter(self, index_name: str, doc_type: str = "", query: dict = None, batch_size: int = 100, max_size: int = 0,
+                         slices: int = 1, scroll: str = "5m", source_includes: List[str] = None, filter_path: List[str] = None,
+                         resume_from: dict = None):
+        """
+        :param index_name: index name
+        :param doc_type: doc type
+        :param query: query body
+        :param batch_size: size of batch data
+        :param max_size: return-data's max size
+        :param slices: 切片数, 大于1时使用 sliced scroll 并行读取所有切片并合并为一个流
+        :param scroll: scroll上下文的保持时间
+        :param source_includes: 只返回 _source 中的这些字段
+        :param filter_path: 响应过滤字段, 默认不过滤; 可以传入 DEFAULT_FILTER_PATH 只保留读取需要的字段
+        :param resume_from: 断点(CheckpointStore.load 的结果), 从断点处继续读取并恢复进度
+        :return: async iter
+        """
+        kwargs = dict(cli=self.origin_conn_obj.cli, index_name=index_name, query=query, doc_type=doc_type or None,
+                      batch_size=batch_size, max_size=max_size, scroll=scroll,
+                      source_includes=source_includes, filter_path=filter_path)
+        getter = ESSlicedGetter(slices=slices, **kwargs) if slices > 1 else ESGetter(**kwargs)
+        if resume_from:
+            getter.restore(resume_from)
+        return getter
 
     @FuncSet.ensure_connected
-    async def new_writer(self, index_name: str):
-        return ESWriter(cli=self.origin_conn_obj.cli, index_name=index_name)
+    async def new_writer(self, index_name: str, op_type: str = "index", id_field=None, routing_field=None,
+                         chunk_size: int = 500, max_chunk_bytes: int = 10 * 1024 * 1024, max_inflight: int = 4,
+                         max_retries: int = 3, initial_backoff: float = 1.0, max_backoff: float = 60.0, codec=None):
+        """
+        :param index_name: index name
+        :param op_type: index, create 或 update(doc_as_upsert)
+        :param id_field: 文档中作为 _id 的字段名, 或接收文档返回 _id 的函数; 指定后重试不会产生重复文档
+        :param routing_field: 文档中作为 routing 的字段名, 或接收文档返回 routing 的函数
+        :param chunk_size: 每个bulk请求的最大文档数
+        :param max_chunk_bytes: 每个bulk请求的最大字节数
+        :param max_inflight: 同时进行中的bulk请求数
+        :param max_retries: 遇到 429/es_rejected_execution_exception 时的最大重试次数
+        :param initial_backoff: 首次重试前的等待秒数, 之后每次翻倍
+        :param max_backoff: 重试等待的上限秒数
+        :param codec: bulk 请求中文档的序列化方式(json/orjson 或 Codec 实例), 默认为 ESPack 的 codec 或 json
+        """
+        return ESWriter(cli=self.origin_conn_obj.cli, index_name=index_name, op_type=op_type,
+                        id_field=id_field, routing_field=routing_field, chunk_size=chunk_size,
+                        max_chunk_bytes=max_chunk_bytes, max_inflight=max_inflight, max_retries=max_retries,
+                        initial_backoff=initial_backoff, max_backoff=max_backoff,
+                        codec=codec if codec is not None else self.codec or "json")
 
 
 class ESGetter(BaseGetter):
     src_name: str
     scroll_id: str
     
-    def __init__(self, cli: AsyncElasticsearch, index_name: str, query: dict = None, doc_type: str = None, batch_size: int = None, max_size: int = 0):
+    def __init__(self, cli: AsyncElasticsearch, index_name: str, query: dict = None, doc_type: str = None, batch_size: int = None, max_size: int = 0,
+                 scroll: str = "5m", source_includes: List[str] = None, filter_path: List[str] = None):
         super().__init__(batch_size=batch_size, max_size=max_size)
         self.index_name = index_name
         self.src_name = index_name
@@ -57,24 +147,39 @@ class ESGetter(BaseGetter):
         self.cli: AsyncElasticsearch = cli
         self.query = query
         self.scroll_id = ""
+        self.scroll = scroll
+        self.search_params = {k: v for k, v in dict(_source_includes=source_includes, filter_path=filter_path).items() if v}
+        # 断点续传时需要丢弃的数量
+        self._skip = 0
 
     async def _get_total_count(self):
         if not self.total_cnt:
             if self.max_size:
                 self.total_cnt = self.max_size
             else:
-                query_copy = self.query.copy() if self.query else None
-                if query_copy and query_copy.get("size"):
-                    query_copy.pop("size")
-                res = await self.cli.count(index=self.index_name, body=query_copy, doc_type=self.doc_type)
-                self.total_cnt = res["count"]
+                self.total_cnt = await _count_docs(self.cli, self.index_name, self.query, self.doc_type)
+
+    def _set_position(self, position):
+        self._skip = position
 
     async def _get_next_lst(self) -> List:
+        next_lst = await self._fetch_page()
+        # scroll上下文无法从中间位置重建, 续传时重新scroll并丢弃断点之前已经写入过的数据
+        while self._skip and next_lst:
+            dropped = min(self._skip, len(next_lst))
+            next_lst = next_lst[dropped:]
+            self._skip -= dropped
+            if not next_lst:
+                next_lst = await self._fetch_page()
+        return next_lst
+
+    async def _fetch_page(self) -> List:
         next_lst = []
         if not self.scroll_id:
-            resp = await self.cli.search(index=self.index_name, body=self.query, scroll="5m", size=self.batch_size)
+            resp = await self.cli.search(index=self.index_name, body=self.query, scroll=self.scroll, size=self.batch_size,
+                                         **self.search_params)
             self.scroll_id = resp["_scroll_id"]
-            hits = resp["hits"]["hits"]
+            hits = _get_hits(resp)
             for hit in hits:
                 next_lst.append(hit)
             if not next_lst:
@@ -83,32 +188,196 @@ class ESGetter(BaseGetter):
             return next_lst
 
         if self.done_cnt < self.total_cnt:
-            resp = await self.cli.scroll(scroll_id=self.scroll_id, scroll="5m")
+            resp = await self.cli.scroll(scroll_id=self.scroll_id, scroll=self.scroll,
+                                         filter_path=self.search_params.get("filter_path"))
             self.scroll_id = resp["_scroll_id"]
-            hits = resp["hits"]["hits"]
+            hits = _get_hits(resp)
             for hit in hits:
                 next_lst.append(hit)
 
         if not next_lst:
             # 没有数据，说明分页到底了
-            await self.cli.clear_scroll(scroll_id=self.scroll_id)
+            await self.close()
         return next_lst
-    
-    
+
+    async def close(self):
+        """
+        清理scroll上下文
+        """
+        if self.scroll_id:
+            scroll_id, self.scroll_id = self.scroll_id, ""
+            await self.cli.clear_scroll(scroll_id=scroll_id, ignore=(404,))
+
+
+class ESSlicedGetter(BaseParallelGetter):
+    """
+    sliced scroll: 将一次scroll拆成 slices 个互不相交的切片, 每个切片各自维护scroll上下文并行读取,
+    合并为一个异步流. 所有scroll上下文在读完、出错或close时都会被清理.
+    指定 max_size 时读够后截断最后一个批次并停止所有切片.
+    """
+    src_name: str
+
+    def __init__(self, cli: AsyncElasticsearch, index_name: str, query: dict = None, doc_type: str = None, batch_size: int = None, max_size: int = 0,
+                 slices: int = 2, scroll: str = "5m", source_includes: List[str] = None, filter_path: List[str] = None):
+        super().__init__(src_name=index_name, batch_size=batch_size, max_size=max_size)
+        self.index_name = index_name
+        self.doc_type = doc_type
+        self.cli: AsyncElasticsearch = cli
+        self.query = query
+        self.slices = slices
+        self.scroll = scroll
+        self.search_params = {k: v for k, v in dict(_source_includes=source_includes, filter_path=filter_path).items() if v}
+
+    async def _get_total_count(self):
+        if not self.total_cnt:
+            self.total_cnt = await _count_docs(self.cli, self.index_name, self.query, self.doc_type)
+            if self.max_size:
+                self.total_cnt = min(self.total_cnt, self.max_size)
+
+    async def _get_next_lst(self) -> List:
+        if self.max_size and self.done_cnt >= self.max_size:
+            # 读够后取消切片任务, 切片的 finally 中会清理scroll上下文
+            await self.close()
+            return []
+        lst = await super()._get_next_lst()
+        if self.max_size and self.done_cnt + len(lst) > self.max_size:
+            lst = lst[:self.max_size - self.done_cnt]
+        return lst
+
+    async def _build_partitions(self):
+        return list(range(self.slices))
+
+    async def _read_partition(self, slice_id: int, position):
+        body = dict(self.query or {})
+        body["slice"] = {"id": slice_id, "max": self.slices}
+        # 续传时丢弃该切片中断点之前的数据
+        skip = position or 0
+        scroll_id = ""
+        try:
+            resp = await self.cli.search(index=self.index_name, body=body, scroll=self.scroll, size=self.batch_size,
+                                         **self.search_params)
+            while True:
+                scroll_id = resp.get("_scroll_id") or scroll_id
+                hits = _get_hits(resp)
+                if not hits:
+                    break
+                if skip:
+                    dropped = min(skip, len(hits))
+                    skip -= dropped
+                    hits = hits[dropped:]
+                if hits:
+                    yield hits
+                resp = await self.cli.scroll(scroll_id=scroll_id, scroll=self.scroll,
+                                             filter_path=self.search_params.get("filter_path"))
+        finally:
+            if scroll_id:
+                await self.cli.clear_scroll(scroll_id=scroll_id, ignore=(404,))
+
+
 class ESWriter(BaseWriter):
+    """
+    按文档数和字节数切分bulk请求, 同时保持 max_inflight 个请求并发;
+    被集群拒绝(429)的文档按指数退避重试, 其余失败逐条返回而不是抛出异常.
+    """
     dst_name: str
-    
-    def __init__(self, cli: AsyncElasticsearch, index_name: str):
+    op_types = ("index", "create", "update")
+    retry_status = 429
+
+    def __init__(self, cli: AsyncElasticsearch, index_name: str, op_type: str = "index", id_field=None,
+                 routing_field=None, chunk_size: int = 500, max_chunk_bytes: int = 10 * 1024 * 1024,
+                 max_inflight: int = 4, max_retries: int = 3, initial_backoff: float = 1.0, max_backoff: float = 60.0,
+                 codec="json"):
         super().__init__()
+        if op_type not in self.op_types:
+            raise ValueError(f"op type must be one of {list(self.op_types)}")
+        if op_type == "update" and id_field is None:
+            raise ValueError("op type 'update' requires id_field.")
         self.index_name = index_name
         self.dst_name = index_name
         self.cli = cli
+        self.op_type = op_type
+        self.get_id = self._field_getter(id_field)
+        self.get_routing = self._field_getter(routing_field)
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.codec: Codec = get_codec(codec, text_only=True)
+        # writer级别的并发上限, 多个批次并发写入时共享
+        self._inflight = asyncio.Semaphore(max_inflight)
+
+    @staticmethod
+    def _field_getter(field):
+        if field is None or callable(field):
+            return field
+        return lambda doc: doc.get(field)
+
+    def _meta(self, doc: Any) -> dict:
+        meta = {"_index": self.index_name}
+        if self.get_id:
+            meta["_id"] = self.get_id(doc)
+        if self.get_routing:
+            meta["routing"] = self.get_routing(doc)
+        return {self.op_type: meta}
+
+    def _serialize_batch(self, docs: List[Any]) -> List[bytes]:
+        # 元数据行和文档行各自整批编码
+        metas = self.codec.encode_batch([self._meta(doc) for doc in docs])
+        sources = docs if self.op_type != "update" else [{"doc": doc, "doc_as_upsert": True} for doc in docs]
+        sources = self.codec.encode_batch(sources)
+        return [to_bytes(meta) + b"\n" + to_bytes(source) + b"\n" for meta, source in zip(metas, sources)]
+
+    def _chunks(self, actions: List[Tuple[Any, bytes]]):
+        chunk, chunk_bytes = list(), 0
+        for action in actions:
+            size = len(action[1])
+            if chunk and (len(chunk) >= self.chunk_size or chunk_bytes + size > self.max_chunk_bytes):
+                yield chunk
+                chunk, chunk_bytes = list(), 0
+            chunk.append(action)
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    async def _send_chunk(self, chunk: List[Tuple[Any, bytes]]) -> List[dict]:
+        failures = list()
+        backoff = self.initial_backoff
+        for attempt in range(self.max_retries + 1):
+            async with self._inflight:
+                try:
+                    resp = await self.cli.bulk(body=b"".join(line for _, line in chunk))
+                except TransportError as e:
+                    if e.status_code != self.retry_status:
+                        raise
+                    resp = None
+            if resp is None:
+                # 整个请求被拒绝
+                retry_chunk = chunk
+            else:
+                retry_chunk = list()
+                for action, item in zip(chunk, resp["items"]):
+                    result = item[self.op_type]
+                    if result.get("status", 200) < 300:
+                        continue
+                    if result["status"] == self.retry_status:
+                        retry_chunk.append(action)
+                    else:
+                        failures.append({"doc": action[0], "status": result["status"], "error": result.get("error")})
+            if not retry_chunk:
+                return failures
+            chunk = retry_chunk
+            if attempt < self.max_retries:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        failures += [{"doc": doc, "status": self.retry_status, "error": "retry times exceed"} for doc, _ in chunk]
+        return failures
 
-    async def _handle_lst(self, lst: List[Any]):
-        async def aiter_func():
-            for doc in lst:
-                yield {"_index": self.index_name,
-                       "_source": doc}
-        await async_bulk(self.cli, aiter_func())
-        
-        
+    async def _handle_lst(self, lst: List[Any]) -> List[dict]:
+        docs = list(lst)
+        actions = list(zip(docs, self._serialize_batch(docs)))
+        results = await asyncio.gather(*[self._send_chunk(chunk) for chunk in self._chunks(actions)])
+        failures = [failure for result in results for failure in result]
+        if failures:
+            self.logger.error(f"dst: {self.dst_name} | {len(failures)} docs failed, first error: {failures[0]['error']}")
+        return failures
@@ -0,0 +1,647 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 23:10
+import asyncio
+import csv
+import glob
+import gzip
+import io
+import mmap
+import os
+from bisect import bisect_right
+from types import MappingProxyType
+from typing import Any, List, Optional, Tuple
+
+from iotoolkit.Packs.Base import BasePack, BaseGetter, BaseWriter, BaseParallelGetter, OriginConnObj
+from iotoolkit.PackManager import pack_manager
+from iotoolkit.util import DefaultValue, LogKit, FuncSet, ColumnBatch, Codec, get_codec
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+file_formats = ("jsonl", "csv", "parquet")
+compressions = ("gzip", "zstd")
+# 文件后缀 -> 格式/压缩方式
+format_suffixes = {".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl", ".csv": "csv", ".parquet": "parquet"}
+compression_suffixes = {".gz": "gzip", ".zst": "zstd", ".zstd": "zstd"}
+
+
+def _split_suffixes(path: str) -> Tuple[str, str, Optional[str], Optional[str]]:
+    """
+    :return: (去掉后缀的路径, 后缀, 格式, 压缩方式), 如 a/b.jsonl.gz -> (a/b, .jsonl.gz, jsonl, gzip)
+    """
+    stem, ext = os.path.splitext(path)
+    compression = compression_suffixes.get(ext.lower())
+    suffix = ""
+    if compression:
+        suffix = ext
+        stem, ext = os.path.splitext(stem)
+    file_format = format_suffixes.get(ext.lower())
+    if file_format:
+        suffix = ext + suffix
+    else:
+        stem += ext
+    return stem, suffix, file_format, compression
+
+
+def _open_read(path: str, compression: Optional[str]):
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstandard is not installed.")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+    return open(path, "rb")
+
+
+def _open_write(path: str, compression: Optional[str]):
+    if compression == "gzip":
+        return gzip.open(path, "wb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstandard is not installed.")
+        return zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True)
+    return open(path, "wb")
+
+
+# 统计行数时每次读入的字节数
+count_chunk_bytes = 64 * 1024 * 1024
+
+
+def _count_lines(mm: mmap.mmap, start: int = 0) -> int:
+    """
+    分块统计换行符(C实现, 不逐行循环), 末尾没有换行的最后一行也计入; 空行同样计入, 只用于进度估算
+    """
+    size = len(mm)
+    count = 0
+    for pos in range(start, size, count_chunk_bytes):
+        count += mm[pos:min(pos + count_chunk_bytes, size)].count(b"\n")
+    if size > start and mm[size - 1] != 10:
+        count += 1
+    return count
+
+
+def _align_to_line(mm: mmap.mmap, pos: int, start: int = 0) -> int:
+    """
+    pos 所在行的下一个行首(pos 本身是行首时返回 pos)
+    """
+    if pos <= start or mm[pos - 1] == 10:
+        return pos
+    nl = mm.find(b"\n", pos)
+    return len(mm) if nl < 0 else nl + 1
+
+
+class FileReader:
+    """
+    按范围读取单个文件, 供 FileGetter/FilePartitionedGetter 共用:
+    未压缩的 jsonl/csv 通过 mmap 读取, 范围是按行首对齐的字节偏移, 范围内按行号定位(读取游标顺序前进, 不建立全文件索引),
+    压缩文件只能顺序解压(向前跳过或从头重读), parquet 按行组读取, 同一时刻只在内存中保留一个行组.
+    csv 按行切分, 字段值中不能包含换行; 值均为字符串, 类型转换可以用 Pipeline.cast.
+    """
+
+    def __init__(self, path: str, file_format: str = None, columnar: bool = False, encoding: str = None,
+                 codec: Codec = None):
+        _, _, suffix_format, compression = _split_suffixes(path)
+        file_format = file_format or suffix_format
+        if file_format not in file_formats:
+            raise ValueError(f"file format must be one of {list(file_formats)}")
+        if file_format == "parquet" and pyarrow is None:
+            raise ImportError("pyarrow is not installed.")
+        self.path = path
+        self.file_format = file_format
+        self.compression = compression
+        self.columnar = columnar
+        self.encoding = encoding or DefaultValue.encoding
+        # jsonl 每一行的序列化方式
+        self.codec = codec or get_codec("json")
+        # parquet 读取的列, 由字段下推设置
+        self.columns: Optional[List[str]] = None
+        self.header: List[str] = None
+        self._file = None
+        self._mm: mmap.mmap = None
+        # csv 数据部分(表头之后)的起始字节
+        self._data_start = 0
+        # 读取游标 [范围起点, 行号, 字节偏移], 顺序读取时从上次的位置继续
+        self._cursor: List[int] = None
+        # 压缩文件的流位置(下一行的行号)
+        self._stream_pos = 0
+        self._parquet = None
+        self._group_starts: List[int] = None
+        self._group: Tuple[int, Any] = None
+
+    @property
+    def indexed(self) -> bool:
+        return self.file_format != "parquet" and self.compression is None
+
+    def open(self):
+        if self._file is not None or self._parquet is not None:
+            return
+        if self.file_format == "parquet":
+            self._parquet = pyarrow.parquet.ParquetFile(self.path)
+            meta = self._parquet.metadata
+            self._group_starts, start = list(), 0
+            for idx in range(meta.num_row_groups):
+                self._group_starts.append(start)
+                start += meta.row_group(idx).num_rows
+            return
+        self._file = _open_read(self.path, self.compression)
+        if not self.indexed:
+            self._read_header()
+            return
+        if os.path.getsize(self.path) == 0:
+            self.header = []
+            return
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.file_format == "csv":
+            end = self._mm.find(b"\n")
+            self._data_start = len(self._mm) if end < 0 else end + 1
+            self.header = self._parse_csv([self._mm[:self._data_start]])[0]
+
+    def _read_header(self):
+        self._stream_pos = 0
+        if self.file_format == "csv":
+            line = self._file.readline()
+            self.header = self._parse_csv([line])[0] if line else []
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._parquet = None
+        self._group = None
+        self._cursor = None
+
+    def count(self) -> int:
+        """
+        需要扫描整个文件, 应在线程池中调用且每个文件只调用一次
+        :return: 数据行数, 压缩文件需要完整解压才能知道, 返回-1
+        """
+        self.open()
+        if self._parquet is not None:
+            return self._parquet.metadata.num_rows
+        if not self.indexed:
+            return -1
+        return _count_lines(self._mm, self._data_start) if self._mm is not None else 0
+
+    def split(self, parts: int) -> List[List[int]]:
+        """
+        切分为至多 parts 个范围 [起点, 终点): 未压缩文本为按行首对齐的字节偏移(只在切分点附近查找换行),
+        parquet 为按行组对齐的行号, 压缩文件不能切分, 返回 [[0, -1]]
+        """
+        self.open()
+        if self._parquet is not None:
+            count = self._parquet.metadata.num_rows
+            bounds = self._group_starts
+            step = max(len(bounds) // parts, 1)
+            bounds = bounds[::step] + [count]
+        elif self.indexed:
+            if self._mm is None:
+                return []
+            start, size = self._data_start, len(self._mm)
+            bounds = sorted({_align_to_line(self._mm, start + (size - start) * k // parts, start)
+                             for k in range(parts)} | {size})
+        else:
+            return [[0, -1]]
+        return [[lo, hi] for lo, hi in zip(bounds, bounds[1:]) if hi > lo]
+
+    def _parse_csv(self, lines: List[bytes]) -> List[list]:
+        return list(csv.reader(line.decode(self.encoding) for line in lines))
+
+    def _decode_lines(self, lines: List[bytes]):
+        if self.file_format == "jsonl":
+            docs = self.codec.decode_batch(lines)
+            return ColumnBatch.from_dicts(docs) if self.columnar else docs
+        header = self.header
+        width = len(header)
+        # 缺少的字段补None, 多出的字段丢弃
+        rows = [row[:width] if len(row) >= width else row + [None] * (width - len(row))
+                for row in self._parse_csv(lines) if row]
+        if self.columnar:
+            return ColumnBatch.from_rows(header, rows)
+        return [dict(zip(header, row)) for row in rows]
+
+    def _read_mapped(self, start: int, size: int, origin: int, limit: int) -> List[bytes]:
+        if self._mm is None:
+            return []
+        origin = max(origin, self._data_start)
+        end = len(self._mm) if limit < 0 else min(limit, len(self._mm))
+        cursor = self._cursor
+        if cursor is None or cursor[0] != origin or start < cursor[1]:
+            cursor = [origin, 0, origin]
+        _, row, pos = cursor
+        mm, find = self._mm, self._mm.find
+        lines = list()
+        while pos < end and len(lines) < size:
+            nl = find(b"\n", pos, end)
+            if nl < 0:
+                nl = end
+            line = mm[pos:nl]
+            pos = nl + 1
+            # 空行不编号
+            if not line or line == b"\r":
+                continue
+            if row >= start:
+                lines.append(line)
+            row += 1
+        self._cursor = [origin, row, min(pos, end)]
+        return lines
+
+    def _read_stream(self, start: int, size: int) -> List[bytes]:
+        if start < self._stream_pos:
+            # 压缩流不能回退, 从头重新解压
+            self._file.close()
+            self._file = _open_read(self.path, self.compression)
+            self._read_header()
+        lines = list()
+        for line in self._file:
+            # 与行偏移索引一致, 空行不编号
+            if not line.rstrip(b"\r\n"):
+                continue
+            if self._stream_pos >= start:
+                lines.append(line)
+            self._stream_pos += 1
+            if len(lines) >= size:
+                break
+        return lines
+
+    def _read_parquet(self, start: int, size: int, origin: int, limit: int):
+        start += origin
+        stop = self._parquet.metadata.num_rows if limit < 0 else min(limit, self._parquet.metadata.num_rows)
+        size = min(size, stop - start)
+        idx = bisect_right(self._group_starts, start) - 1
+        if idx < 0 or size <= 0:
+            return []
+        if self._group is None or self._group[0] != idx:
+            self._group = (idx, self._parquet.read_row_group(idx, columns=self.columns))
+        # 批次不跨越行组, 读到行组末尾时返回不足 size 的批次
+        table = self._group[1].slice(start - self._group_starts[idx], size)
+        if self.columnar:
+            return ColumnBatch.from_arrow(table)
+        return table.to_pylist()
+
+    def read(self, start: int, size: int, origin: int = 0, limit: int = -1):
+        """
+        读取范围 [origin, limit) 内从第 start 行开始的至多 size 行, 读完时返回空列表
+        :param origin: 范围起点, 见 split; 压缩文件只能整个读取
+        :param limit: 范围终点, -1 表示到文件末尾
+        """
+        self.open()
+        if self._parquet is not None:
+            return self._read_parquet(start, size, origin, limit)
+        lines = self._read_mapped(start, size, origin, limit) if self.indexed else self._read_stream(start, size)
+        if not lines:
+            return []
+        return self._decode_lines(lines)
+
+
+def _expand_paths(path: str) -> List[str]:
+    paths = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+    if not paths:
+        raise ValueError(f"no file matches {path}")
+    return paths
+
+
+class FilePack(LogKit, BasePack):
+    """
+    本地文件数据源, 路径相对于 root; 没有需要建立的连接, 不走 BasePack 的连接参数解析
+    """
+
+    def __init__(self, root: str = ".", codec=None):
+        """
+        :param codec: jsonl 的默认序列化方式(json/orjson 或 Codec 实例), 默认json
+        """
+        self.scheme = "file"
+        self.root = root
+        self.codec: Codec = get_codec(codec if codec is not None else "json", text_only=True)
+        self.origin_conn_obj = OriginConnObj()
+        self.conn_config = MappingProxyType({"db": root})
+        pack_manager.register_pack(self)
+
+    async def _build_connect(self) -> None:
+        if not os.path.isdir(self.root):
+            raise ConnectionError(f"{self.root} is not a directory")
+        # 记录创建的 writer, 退出时由 PackManager 关闭, 保证压缩流完整落盘
+        self.origin_conn_obj.writers = list()
+
+    def is_ready(self):
+        return self.origin_conn_obj.writers is not None
+
+    @FuncSet.ensure_connected
+    async def new_getter(self, path: str, file_format: str = None, batch_size: int = 100, max_size: int = 0,
+                         partitions: int = 1, columnar: bool = False, codec=None, resume_from: dict = None) -> BaseGetter:
+        """
+        :param path: 文件路径, 可以是通配符(如 dump/fakers-*.jsonl.gz), 匹配到多个文件时并行读取
+        :param file_format: jsonl, csv 或 parquet, 默认按后缀判断; .gz/.zst 后缀的文件按对应方式解压
+        :param batch_size: size of batch data
+        :param max_size: return-data's max size, 只对单文件顺序读取有效
+        :param partitions: 大于1时把未压缩文件按行号范围(parquet按行组)切分, 并行读取
+        :param columnar: 每个批次为 ColumnBatch 而不是 List[dict]
+        :param codec: jsonl 每一行的序列化方式, 默认为 FilePack 的 codec, 整批解码
+        :param resume_from: 断点(CheckpointStore.load 的结果), 从断点处继续读取并恢复进度
+        :return: async iter
+        """
+        if not os.path.isabs(path):
+            path = os.path.join(self.root, path)
+        paths = _expand_paths(path)
+        codec = get_codec(codec, text_only=True) if codec is not None else self.codec
+        if len(paths) > 1 or partitions > 1:
+            if max_size:
+                raise ValueError("max_size is not supported in partitioned mode.")
+            getter = FilePartitionedGetter(paths, file_format=file_format, batch_size=batch_size,
+                                           partitions=partitions, columnar=columnar, codec=codec)
+        else:
+            getter = FileGetter(paths[0], file_format=file_format, batch_size=batch_size, max_size=max_size,
+                                columnar=columnar, codec=codec)
+        if resume_from:
+            getter.restore(resume_from)
+        return getter
+
+    @FuncSet.ensure_connected
+    async def new_writer(self, path: str, file_format: str = None, compression: str = None, rotate_bytes: int = 0,
+                         columns: List[str] = None, codec=None) -> BaseWriter:
+        """
+        :param path: 文件路径, 目录不存在时自动创建
+        :param file_format: jsonl, csv 或 parquet, 默认按后缀判断
+        :param compression: gzip 或 zstd, 默认按后缀判断; parquet 的压缩在文件内部按列完成
+        :param rotate_bytes: 大于0时单个文件写入约这么多字节(未压缩)后切换到下一个文件,
+                             文件名为 <名称>-00000<后缀>, <名称>-00001<后缀> ...
+        :param columns: csv/parquet 的列, 默认取第一批数据的字段
+        :param codec: jsonl 每一行的序列化方式, 默认为 FilePack 的 codec, 整批编码
+        """
+        if not os.path.isabs(path):
+            path = os.path.join(self.root, path)
+        writer = FileWriter(path, file_format=file_format, compression=compression, rotate_bytes=rotate_bytes,
+                            columns=columns, codec=get_codec(codec, text_only=True) if codec is not None else self.codec)
+        self.origin_conn_obj.writers.append(writer)
+        return writer
+
+
+class FileGetter(BaseGetter):
+    """
+    单文件顺序读取, 断点为已读取的行号
+    """
+    src_name: str
+
+    def __init__(self, path: str, file_format: str = None, batch_size: int = None, max_size: int = 0,
+                 columnar: bool = False, codec: Codec = None):
+        super().__init__(src_name=os.path.basename(path), batch_size=batch_size, max_size=max_size)
+        self.reader = FileReader(path, file_format=file_format, columnar=columnar, codec=codec)
+        self.pos = 0
+
+    async def _get_total_count(self):
+        if not self.total_cnt:
+            # 统计行数需要扫描整个文件, 放到线程池中
+            count = await asyncio.get_event_loop().run_in_executor(None, self.reader.count)
+            if count >= 0 and self.max_size:
+                count = min(count, self.max_size)
+            self.total_cnt = count
+
+    async def _get_next_lst(self):
+        size = self.batch_size
+        if self.max_size:
+            size = min(size, self.max_size - self.pos)
+            if size <= 0:
+                self.reader.close()
+                return []
+        lst = self.reader.read(self.pos, size)
+        if not lst:
+            self.reader.close()
+        self.pos += len(lst)
+        return lst
+
+    def _get_position(self):
+        return self.pos
+
+    def _set_position(self, position):
+        self.pos = position
+
+    def push_down_projection(self, fields: List[str]) -> bool:
+        if self.reader.file_format != "parquet":
+            return False
+        self.reader.columns = list(fields)
+        return True
+
+
+class FilePartitionedGetter(BaseParallelGetter):
+    """
+    多文件/单文件分区并行读取, 分区为 [路径, 起点, 终点], 见 FileReader.split:
+    未压缩的 jsonl/csv 按字节等分并对齐到行首, parquet 按行组切分, 压缩文件整个作为一个分区.
+    分区内的位置为已读取的行数.
+    分区可以交给 ShardedTransfer 分到多个进程, 在多核上并行解析.
+    """
+    src_name: str
+
+    def __init__(self, paths: List[str], file_format: str = None, batch_size: int = None, partitions: int = 1,
+                 columnar: bool = False, codec: Codec = None):
+        if partitions < 1:
+            raise ValueError("partitions must be greater than 0!")
+        src_name = os.path.basename(paths[0]) if len(paths) == 1 else f"{os.path.dirname(paths[0]) or '.'}/*"
+        super().__init__(src_name=src_name, batch_size=batch_size)
+        self.paths = paths
+        self.file_format = file_format
+        self.partitions = partitions
+        self.columnar = columnar
+        self.codec = codec
+        self.columns: Optional[List[str]] = None
+
+    def _reader(self, path: str) -> FileReader:
+        reader = FileReader(path, file_format=self.file_format, columnar=self.columnar, codec=self.codec)
+        reader.columns = self.columns
+        return reader
+
+    def _reader_call(self, path: str, method: str, *args):
+        reader = self._reader(path)
+        try:
+            return getattr(reader, method)(*args)
+        finally:
+            reader.close()
+
+    async def _get_total_count(self):
+        if not self.total_cnt:
+            loop = asyncio.get_event_loop()
+            total = 0
+            for path in self.paths:
+                # 每个文件只扫描一次, 在线程池中执行
+                count = await loop.run_in_executor(None, self._reader_call, path, "count")
+                if count < 0:
+                    # 存在压缩文件时总数未知
+                    total = -1
+                    break
+                total += count
+            self.total_cnt = total
+
+    async def _build_partitions(self):
+        parts = max(self.partitions // len(self.paths), 1)
+        loop = asyncio.get_event_loop()
+        specs = list()
+        for path in self.paths:
+            ranges = await loop.run_in_executor(None, self._reader_call, path, "split", parts)
+            specs += [[path, lo, hi] for lo, hi in ranges]
+        self.logger.info(f"split {self.src_name} into {len(specs)} partitions")
+        return specs
+
+    def push_down_projection(self, fields: List[str]) -> bool:
+        if self._queue is not None:
+            raise RuntimeError("getter has already started, can not push down projection.")
+        if not all(_split_suffixes(p)[2] == "parquet" or self.file_format == "parquet" for p in self.paths):
+            return False
+        self.columns = list(fields)
+        return True
+
+    async def _read_partition(self, spec, position):
+        path, origin, limit = spec
+        reader = self._reader(path)
+        pos = position or 0
+        try:
+            while True:
+                lst = reader.read(pos, self.batch_size, origin, limit)
+                if not lst:
+                    break
+                pos += len(lst)
+                yield lst
+                # 解析是同步的, 让出事件循环给其他分区和写入方
+                await asyncio.sleep(0)
+        finally:
+            reader.close()
+
+    async def release(self):
+        await self.close()
+
+
+class FileWriter(BaseWriter):
+    """
+    流式写入: 每个批次编码后追加到当前文件, 写满 rotate_bytes 后切换到新文件; 编码和写盘在线程池中执行.
+    使用完必须在事件循环内 await writer.close() 写入压缩流/parquet 的结尾并关闭文件;
+    PackManager 在退出时会同步关闭遗漏的 writer 作为兜底, 此时最后一个批次可能仍在线程池中写入, 不应依赖.
+    """
+    dst_name: str
+
+    def __init__(self, path: str, file_format: str = None, compression: str = None, rotate_bytes: int = 0,
+                 columns: List[str] = None, encoding: str = None, codec: Codec = None):
+        super().__init__()
+        stem, suffix, suffix_format, suffix_compression = _split_suffixes(path)
+        self.file_format = file_format or suffix_format
+        if self.file_format not in file_formats:
+            raise ValueError(f"file format must be one of {list(file_formats)}")
+        if self.file_format == "parquet" and pyarrow is None:
+            raise ImportError("pyarrow is not installed.")
+        self.compression = compression or suffix_compression
+        if self.compression is not None and self.compression not in compressions:
+            raise ValueError(f"compression must be one of {list(compressions)}")
+        if self.compression == "zstd" and zstandard is None:
+            raise ImportError("zstandard is not installed.")
+        self.path = path
+        self._stem, self._suffix = stem, suffix
+        self.dst_name = os.path.basename(path)
+        self.rotate_bytes = rotate_bytes
+        self.columns: Optional[List[str]] = list(columns) if columns else None
+        self.encoding = encoding or DefaultValue.encoding
+        self.codec = codec or get_codec("json")
+        # 已经写过的文件
+        self.files: List[str] = list()
+        self._file = None
+        self._parquet_writer = None
+        self._file_bytes = 0
+        self._lock = asyncio.Lock()
+        self.closed = False
+
+    def _next_path(self) -> str:
+        if not self.rotate_bytes:
+            return self.path
+        return f"{self._stem}-{len(self.files):05d}{self._suffix}"
+
+    def _open_next(self, schema=None):
+        path = self._next_path()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if self.file_format == "parquet":
+            self._parquet_writer = pyarrow.parquet.ParquetWriter(path, schema, compression=self.compression or "snappy")
+        else:
+            self._file = _open_write(path, self.compression)
+        self.files.append(path)
+        self._file_bytes = 0
+        self.logger.info(f"open {path}")
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+    def _encode(self, lst, with_header: bool) -> bytes:
+        if self.file_format == "jsonl":
+            lines = self.codec.encode_batch(list(lst))
+            if lines and isinstance(lines[0], bytes):
+                return b"\n".join(lines) + b"\n"
+            return ("\n".join(lines) + "\n").encode(self.encoding)
+        buffer = io.StringIO()
+        csv_writer = csv.writer(buffer, lineterminator="\n")
+        if with_header:
+            csv_writer.writerow(self.columns)
+        if isinstance(lst, ColumnBatch):
+            csv_writer.writerows(lst.rows(self.columns))
+        else:
+            csv_writer.writerows([doc.get(col) for col in self.columns] for doc in lst)
+        return buffer.getvalue().encode(self.encoding)
+
+    def _write_parquet(self, lst):
+        if isinstance(lst, ColumnBatch):
+            table = lst.select(self.columns).to_arrow()
+        else:
+            table = pyarrow.Table.from_pylist([{col: doc.get(col) for col in self.columns} for doc in lst])
+        if self._parquet_writer is None:
+            self._open_next(table.schema)
+        else:
+            table = table.cast(self._parquet_writer.schema)
+        # 每个批次写成一个行组, 读取时按行组流式读取
+        self._parquet_writer.write_table(table)
+        self._file_bytes += table.nbytes
+
+    def _write_batch(self, lst):
+        if self.closed:
+            raise RuntimeError("writer is closed.")
+        if self.columns is None:
+            self.columns = list(lst.fields) if isinstance(lst, ColumnBatch) else list(lst[0].keys())
+        if self.file_format == "parquet":
+            self._write_parquet(lst)
+        else:
+            new_file = self._file is None
+            if new_file:
+                self._open_next()
+            data = self._encode(lst, with_header=new_file and self.file_format == "csv")
+            self._file.write(data)
+            self._file_bytes += len(data)
+        # 批次不会被拆到两个文件中, 单个文件会略大于 rotate_bytes
+        if self.rotate_bytes and self._file_bytes >= self.rotate_bytes:
+            self._close_file()
+
+    async def _handle_lst(self, lst: List[Any]):
+        if not lst:
+            return
+        loop = asyncio.get_event_loop()
+        # 多个写入协程共享同一个文件句柄, 批次之间需要串行
+        async with self._lock:
+            await loop.run_in_executor(None, self._write_batch, lst)
+
+    async def close(self):
+        async with self._lock:
+            self._close_file()
+            self.closed = True
+
+    def close_sync(self):
+        """
+        不依赖事件循环的关闭, 供退出时兜底
+        """
+        self._close_file()
+        self.closed = True
@@ -1,15 +1,20 @@
 # @Author : taojinmin
 # @Time : 2023/2/6 16:59
 import inspect
+import json
 import traceback
 from time import time
-from hashlib import md5
+from datetime import datetime, timezone
+from concurrent.futures import Executor
 from logging import Logger
 
 from motor.motor_asyncio import AsyncIOMotorCursor, AsyncIOMotorCollection, AsyncIOMotorDatabase, AsyncIOMotorClient
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+from bson import ObjectId, json_util
 
-from iotoolkit.Packs.Base import BasePack, BaseGetter, BaseWriter, OriginConnObj
-from iotoolkit.util import DefaultValue, LogKit, FuncSet
+from iotoolkit.Packs.Base import BasePack, BaseGetter, BaseWriter, BaseParallelGetter, OriginConnObj
+from iotoolkit.util import DefaultValue, LogKit, FuncSet, DocIdStrategy, get_id_strategy, ColumnBatch
 from typing import List, Any
 from types import MappingProxyType, DynamicClassAttribute
 
@@ -33,7 +38,8 @@ class MongoPack(LogKit, BasePack):
 
     @FuncSet.ensure_connected
     async def new_getter(self, col: str, query: dict = None, return_fields: list = None, batch_size: int = 100,
-                         max_size: int = None, reverse: bool = False, *args, **kwargs) -> BaseGetter:
+                         max_size: int = None, reverse: bool = False, partitions: int = 1, split_method: str = "sample",
+                         resume_from: dict = None, *args, **kwargs) -> BaseGetter:
         """
         :param col: collection's name
         :param query: query body
@@ -41,6 +47,10 @@ class MongoPack(LogKit, BasePack):
         :param max_size: return-data's max size
         :param batch_size: size of batch data
         :param reverse: whether read in reverse order
+        :param partitions: 大于1时按 _id 范围切分集合, 用 partitions 个游标并行读取
+        :param split_method: 分区边界的计算方式: sample($sample 抽样), bucketAuto($bucketAuto 精确但需扫描全部_id),
+                             time(按 ObjectId 的时间戳等分, 只适用于 ObjectId 类型的 _id)
+        :param resume_from: 断点(CheckpointStore.load 的结果), 从断点处继续读取并恢复进度
         :return: async iter
         """
         if return_fields is None:
@@ -48,43 +58,73 @@ class MongoPack(LogKit, BasePack):
 
         col_obj = self.origin_conn_obj.cli.get_collection(col)
         return_fields_dic = {field: 1 for field in return_fields}
-        kwargs = dict(
-            filter=query,
-            projection=return_fields_dic,
-            limit=max_size
-        )
-        kwargs = {k: v for k, v in kwargs.items() if v}
-
-        if kwargs:
-            cursor = col_obj.find(**kwargs)
-        else:
-            cursor = col_obj.find()
-        if reverse:
-            cursor = cursor.sort([("$natural", -1)])
-        getter = MongoGetter(col_obj, cursor, query=query, batch_size=batch_size, max_size=max_size)
+        if partitions > 1:
+            if max_size or reverse:
+                raise ValueError("max_size/reverse is not supported in partitioned mode.")
+            getter = MongoPartitionedGetter(col_obj, query=query, projection=return_fields_dic, batch_size=batch_size,
+                                            partitions=partitions, split_method=split_method)
+            if resume_from:
+                getter.restore(resume_from)
+            return getter
+        getter = MongoGetter(col_obj, query=query, projection=return_fields_dic, batch_size=batch_size,
+                             max_size=max_size, reverse=reverse)
+        if resume_from:
+            getter.restore(resume_from)
         return getter
 
     @FuncSet.ensure_connected
-    async def new_writer(self, col: str, write_method: str = None) -> BaseWriter:
+    async def new_writer(self, col: str, write_method: str = None, id_strategy=None,
+                         id_executor: Executor = None, offload_threshold: int = 5000) -> BaseWriter:
         """
         create a writer object
         :param col: collection's name
         :param write_method: insert, upsert or insertButNotUpdate
+        :param id_strategy: 没有 _id 的文档如何生成 _id: md5_str(默认, 与历史数据一致), canonical, fast 或 DocIdStrategy 实例
+        :param id_executor: 批量计算 _id 时使用的线程池/进程池
+        :param offload_threshold: 批次大小达到该值时才交给 id_executor 计算
         """
         col_obj = self.origin_conn_obj.cli.get_collection(col)
-        writer = MongoWriter(col_obj, write_method or DefaultValue.mongo_writer_method)
+        writer = MongoWriter(col_obj, write_method or DefaultValue.mongo_writer_method,
+                             id_strategy=id_strategy or DefaultValue.mongo_id_strategy,
+                             id_executor=id_executor, offload_threshold=offload_threshold)
         return writer
 
 
+def _narrow_projection(projection: dict, fields: List[str]) -> dict:
+    # 已有的包含式投影只能收窄, 不能扩大; _id 默认总会返回
+    if projection:
+        return {f: 1 for f in projection if f in fields} or projection
+    return {f: 1 for f in fields}
+
+
 class MongoGetter(BaseGetter):
     src_name: str
     
-    def __init__(self, col_obj, cursor: AsyncIOMotorCursor, query, batch_size: int = None, max_size: int = 0):
+    def __init__(self, col_obj, cursor: AsyncIOMotorCursor = None, query=None, batch_size: int = None, max_size: int = 0,
+                 projection: dict = None, reverse: bool = False):
+        """
+        :param cursor: 已经建好的游标; 默认在第一次读取时按 query/projection/max_size/reverse 创建,
+                       创建之前可以调整 projection(字段下推)和跳过的数量(断点续传)
+        """
         super().__init__(batch_size=batch_size, max_size=max_size)
         self.col_obj = col_obj
         self.cursor = cursor
         self.query = query
+        self.projection = projection or None
+        self.reverse = reverse
         self.src_name = self.col_obj.name
+        self._skip = 0
+
+    def _build_cursor(self) -> AsyncIOMotorCursor:
+        cursor = self.col_obj.find(self.query or {}, self.projection)
+        if self._skip:
+            cursor = cursor.skip(self._skip)
+        if self.max_size and self.max_size > self._skip:
+            cursor = cursor.limit(self.max_size - self._skip)
+        if self.reverse:
+            cursor = cursor.sort([("$natural", -1)])
+        # 与 to_list 的长度保持一致, 避免每个批次背后发生多次 getMore 往返
+        return cursor.batch_size(self.batch_size)
 
     async def _get_total_count(self):
         if not self.total_cnt:
@@ -93,40 +133,198 @@ class MongoGetter(BaseGetter):
             elif not self.query:
                 self.total_cnt = await self.col_obj.estimated_document_count()
             else:
-                self.total_cnt = await col_obj.count_documents(query)
+                self.total_cnt = await self.col_obj.count_documents(self.query)
 
     async def _get_next_lst(self) -> List:
+        if self.max_size and self.done_cnt >= self.max_size:
+            return []
+        if self.cursor is None:
+            self.cursor = self._build_cursor()
         return await self.cursor.to_list(length=self.batch_size)
 
+    def _set_position(self, position):
+        # 未排序的游标只能按已读数量跳过, 需要严格续传时请使用分区读取(按 _id 续传)
+        if self.cursor is not None:
+            self.cursor.skip(position)
+            if self.max_size and self.max_size > position:
+                self.cursor.limit(self.max_size - position)
+        else:
+            self._skip = position
+
+    def push_down_projection(self, fields: List[str]) -> bool:
+        if self.cursor is not None:
+            return False
+        self.projection = _narrow_projection(self.projection, fields)
+        return True
+
+
+class MongoPartitionedGetter(BaseParallelGetter):
+    """
+    按 _id 范围把集合切成若干分区, 每个分区一个按 _id 升序、走 _id 索引的游标, 并行读取后合并为一个流.
+    同一批次内按 _id 有序, 批次之间不保证有序.
+    """
+    src_name: str
+    split_methods = ("sample", "bucketAuto", "time")
+    # sample 方式每个分区的抽样数
+    samples_per_partition = 20
+
+    def __init__(self, col_obj: AsyncIOMotorCollection, query: dict = None, projection: dict = None,
+                 batch_size: int = None, partitions: int = 2, split_method: str = "sample"):
+        if split_method not in self.split_methods:
+            raise ValueError(f"split method must be one of {list(self.split_methods)}")
+        super().__init__(src_name=col_obj.name, batch_size=batch_size)
+        self.col_obj = col_obj
+        self.query = query
+        self.projection = projection or None
+        self.partitions = partitions
+        self.split_method = split_method
+
+    async def _get_total_count(self):
+        if not self.total_cnt:
+            if not self.query:
+                self.total_cnt = await self.col_obj.estimated_document_count()
+            else:
+                self.total_cnt = await self.col_obj.count_documents(self.query)
+
+    def _match_stage(self) -> List[dict]:
+        return [{"$match": self.query}] if self.query else []
+
+    async def _split_by_sample(self) -> List[Any]:
+        pipeline = self._match_stage() + [
+            {"$sample": {"size": self.partitions * self.samples_per_partition}},
+            {"$project": {"_id": 1}},
+            {"$sort": {"_id": 1}},
+        ]
+        ids = [doc["_id"] async for doc in self.col_obj.aggregate(pipeline, allowDiskUse=True)]
+        step = len(ids) / self.partitions
+        return [ids[int(step * i)] for i in range(1, self.partitions)] if ids else []
+
+    async def _split_by_bucket_auto(self) -> List[Any]:
+        pipeline = self._match_stage() + [{"$bucketAuto": {"groupBy": "$_id", "buckets": self.partitions}}]
+        buckets = [doc async for doc in self.col_obj.aggregate(pipeline, allowDiskUse=True)]
+        return [bucket["_id"]["min"] for bucket in buckets[1:]]
+
+    async def _split_by_time(self) -> List[Any]:
+        edge_docs = list()
+        for direction in (ASCENDING, DESCENDING):
+            docs = await self.col_obj.find(self.query, {"_id": 1}).sort("_id", direction).limit(1).to_list(length=1)
+            edge_docs += docs
+        if len(edge_docs) != 2 or not all(isinstance(doc["_id"], ObjectId) for doc in edge_docs):
+            raise ValueError("split method 'time' requires ObjectId _id.")
+        start_ts = edge_docs[0]["_id"].generation_time.timestamp()
+        end_ts = edge_docs[1]["_id"].generation_time.timestamp()
+        step = (end_ts - start_ts) / self.partitions
+        return [ObjectId.from_datetime(datetime.fromtimestamp(start_ts + step * i, tz=timezone.utc))
+                for i in range(1, self.partitions)]
+
+    async def _build_partitions(self):
+        splitter = {
+            "sample": self._split_by_sample,
+            "bucketAuto": self._split_by_bucket_auto,
+            "time": self._split_by_time,
+        }[self.split_method]
+        bounds = list()
+        for bound in await splitter():
+            # 抽样可能得到重复的边界, 去重后保证分区互不相交
+            if not bounds or bound != bounds[-1]:
+                bounds.append(bound)
+        edges = [None] + bounds + [None]
+        ranges = list(zip(edges[:-1], edges[1:]))
+        self.logger.info(f"split {self.src_name} by _id into {len(ranges)} partitions")
+        return [list(r) for r in ranges]
+
+    def _advance(self, spec, position, lst):
+        # 分区内的位置为已产出的最大 _id
+        return lst[-1]["_id"]
+
+    def _get_position(self):
+        # ObjectId 等类型用扩展json表示, 保证断点可以json序列化且还原后类型不变
+        return json.loads(json_util.dumps(super()._get_position()))
+
+    def _set_position(self, position):
+        super()._set_position(json_util.loads(json.dumps(position)))
+
+    def push_down_projection(self, fields: List[str]) -> bool:
+        if self._queue is not None:
+            raise RuntimeError("getter has already started, can not push down projection.")
+        self.projection = _narrow_projection(self.projection, fields)
+        return True
+
+    async def _read_partition(self, spec, position):
+        lower, upper = spec
+        id_range = dict()
+        if position is not None:
+            id_range["$gt"] = position
+        elif lower is not None:
+            id_range["$gte"] = lower
+        if upper is not None:
+            id_range["$lt"] = upper
+        conditions = [cond for cond in (self.query, {"_id": id_range} if id_range else None) if cond]
+        query = {"$and": conditions} if len(conditions) > 1 else (conditions[0] if conditions else {})
+        cursor = self.col_obj.find(query, self.projection).sort("_id", ASCENDING).batch_size(self.batch_size)
+        try:
+            while True:
+                lst = await cursor.to_list(length=self.batch_size)
+                if not lst:
+                    break
+                yield lst
+        finally:
+            await cursor.close()
+
 
 class MongoWriter(BaseWriter):
+    """
+    无序批量写入(ordered=False): 单条失败不会中断批次中其余文档的写入, 失败的文档逐条返回而不是抛出异常;
+    _id 由 id_strategy 根据文档内容生成时, 重复键(11000)说明同一文档已经写入过(例如断点续传重放的批次), 视为成功;
+    调用方自带 _id 的文档发生重复键时内容可能不同, 仍按失败返回.
+    连接等其他异常直接抛出, 该批次不会被确认.
+    """
     dst_name: str
-    
-    def __init__(self, col_obj: AsyncIOMotorCollection, write_method: str = "insert"):
+    duplicate_key_code = 11000
+
+    def __init__(self, col_obj: AsyncIOMotorCollection, write_method: str = "insert", id_strategy="md5_str",
+                 id_executor: Executor = None, offload_threshold: int = 5000):
         super().__init__()
         if write_method not in ["insert", "insertButNotUpdate", "upsert"]:
             raise ValueError("write method must be one of ['insert', 'insertButNotUpdate', 'upsert']")
         self.col_obj = col_obj
         self.write_method = write_method
         self.dst_name = self.col_obj.name
+        self.id_strategy: DocIdStrategy = get_id_strategy(id_strategy)
+        self.id_executor = id_executor
+        self.offload_threshold = offload_threshold
 
     async def _handle_lst(self, lst: List[Any]):
+        if isinstance(lst, ColumnBatch):
+            # insert_many 需要可修改的文档(补上_id), 按列批次在这里一次性生成
+            lst = lst.to_pylist()
+        # 只有由 id_strategy 生成的 _id 重复时才能确定是同一文档
+        generated = ["_id" not in doc for doc in lst]
+        # 整批计算 _id, 必须在写入前完成: insert_many 会给文档补上 ObjectId
+        ids = await self.id_strategy.ids_for_async(lst, executor=self.id_executor,
+                                                   offload_threshold=self.offload_threshold)
         try:
             if self.write_method == "insert":
-                for doc in lst:
-                    if "_id" not in doc:
-                        doc["_id"] = md5(str(doc).encode()).hexdigest()
-                await self.col_obj.insert_many(lst)
-            elif self.write_method in ["insertButNotUpdate", "upsert"]:
+                for doc, _id in zip(lst, ids):
+                    doc["_id"] = _id
+                await self.col_obj.insert_many(lst, ordered=False)
+            else:
                 set_op = "$set" if self.write_method == "upsert" else "$setOnInsert"
-                ops = list()
-                for doc in lst:
-                    if "_id" not in doc:
-                        _id = md5(str(doc).encode()).hexdigest()
-                    else:
-                        _id = doc["_id"]
-                    ops.append(UpdateOne({"_id": _id}, {set_op: doc}, upsert=True))
-                await self.col_obj.bulk_write(ops)
-        except Exception as e:
-            self.logger.error(e)
-            
+                ops = [UpdateOne({"_id": _id}, {set_op: doc}, upsert=True) for doc, _id in zip(lst, ids)]
+                await self.col_obj.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            return self._failures(lst, e.details, generated)
+        return []
+
+    def _failures(self, lst: List[Any], details: dict, generated: List[bool]) -> List[dict]:
+        if details.get("writeConcernErrors"):
+            # 写关注失败无法对应到具体文档, 整批不确认
+            raise RuntimeError(f"write concern error: {details['writeConcernErrors'][0].get('errmsg')}")
+        skip_duplicates = self.id_strategy.deterministic
+        failures = [{"doc": lst[err["index"]], "status": err["code"], "error": err.get("errmsg")}
+                    for err in details.get("writeErrors", [])
+                    if not (skip_duplicates and err["code"] == self.duplicate_key_code and generated[err["index"]])]
+        if failures:
+            self.logger.error(f"dst: {self.dst_name} | {len(failures)} docs failed, first error: {failures[0]['error']}")
+        return failures
+
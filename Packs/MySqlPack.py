@@ -3,25 +3,32 @@
 # aiomysql doc: https://aiomysql.readthedocs.io/
 import asyncio
 import inspect
+import io
+import os
+import tempfile
 from functools import wraps
 from logging import Logger
 from time import time
 
 import aiomysql
 import pymysql
-from typing import List, Dict
+from typing import List, Dict, Tuple, Union
 import traceback
 
-from iotoolkit.Packs.Base import BasePack, BaseGetter, BaseWriter
-from iotoolkit.util import DefaultValue, LogKit, FuncSet
+from iotoolkit.Packs.Base import BasePack, BaseGetter, BaseWriter, BaseParallelGetter
+from iotoolkit.util import DefaultValue, LogKit, FuncSet, ColumnBatch
 from sql_metadata import Parser
 from collections import OrderedDict
 
 
 class MySqlPack(LogKit, BasePack):
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, local_infile: bool = False, **kwargs):
+        """
+        :param local_infile: 允许 LOAD DATA LOCAL INFILE, MySqlWriter 的 load 写入方式需要开启(服务端也需开启local_infile)
+        """
         self.scheme = "mysql"
+        self.local_infile = local_infile
         BasePack.__init__(self, *args, **kwargs)
 
     async def _build_connect(self):
@@ -29,13 +36,17 @@ class MySqlPack(LogKit, BasePack):
         conn_config_copy["user"] = conn_config_copy.pop("username")
         self.origin_conn_obj.pool = await aiomysql.create_pool(cursorclass=pymysql.cursors.DictCursor,
                                                                   autocommit=False,
+                                                                  local_infile=self.local_infile,
                                                                   **conn_config_copy)
 
     def is_ready(self):
         return self.origin_conn_obj.pool is not None
 
     @FuncSet.ensure_connected
-    async def new_getter(self, select_sql: str = "", table: str = "", return_fields: List[str] = None, where: str = "", offset: int = 0, limit: int = 0, batch_size: int = 100) -> BaseGetter:
+    async def new_getter(self, select_sql: str = "", table: str = "", return_fields: List[str] = None, where: str = "", offset: int = 0, limit: int = 0, batch_size: int = 100,
+                         split_column: str = "", partitions: int = 1,
+                         stream: bool = False, count_mode: str = "exact", columnar: bool = False,
+                         resume_from: dict = None) -> BaseGetter:
         """
         :param select_sql: raw sql
         :param table: table name
@@ -44,19 +55,42 @@ class MySqlPack(LogKit, BasePack):
         :param offset: skip size
         :param limit: limit size
         :param batch_size: batch size
+        :param split_column: 分区列(需有索引), 指定该列或 partitions > 1 时使用分区+keyset分页读取, 默认取主键;
+            不唯一时以单列主键作为第二排序键, 表没有单列主键时不能使用不唯一的分区列
+        :param partitions: 按分区列的取值范围切分的分区数, 每个分区使用连接池中的独立连接并行读取
+        :param stream: 使用服务端流式游标(SSDictCursor)逐批拉取, 客户端内存占用恒定
+        :param count_mode: 流式读取时总数的获取方式: exact(COUNT(*)), estimate(information_schema估算), none(不计数)
+        :param columnar: 使用元组游标读取, 每个批次为 ColumnBatch 而不是 List[dict]
+        :param resume_from: 断点(CheckpointStore.load 的结果), 从断点处继续读取并恢复进度
         :return: async iter
         """
-        getter = MySqlGetter(pool=self.origin_conn_obj.pool,
-                             select_sql=select_sql, table=table,
-                             return_fields=return_fields, where=where,
-                             offset=offset, limit=limit, batch_size=batch_size)
+        if split_column or partitions > 1:
+            if select_sql or offset or limit:
+                raise ValueError("select_sql/offset/limit is not supported in partitioned mode.")
+            getter = MySqlPartitionedGetter(pool=self.origin_conn_obj.pool, table=table,
+                                            return_fields=return_fields, where=where,
+                                            split_column=split_column, partitions=partitions,
+                                            batch_size=batch_size, columnar=columnar)
+        else:
+            getter = MySqlGetter(pool=self.origin_conn_obj.pool,
+                                 select_sql=select_sql, table=table,
+                                 return_fields=return_fields, where=where,
+                                 offset=offset, limit=limit, batch_size=batch_size,
+                                 stream=stream, count_mode=count_mode, columnar=columnar)
+        if resume_from:
+            getter.restore(resume_from)
         return getter
 
     @FuncSet.ensure_connected
-    async def new_writer(self, table: str = "") -> BaseWriter:
+    async def new_writer(self, table: str = "", write_method: str = "insert", columns: List[str] = None,
+                         update_fields: List[str] = None) -> BaseWriter:
         """
         create a writer object
         :param table: 表名，写入前必须把表建好
+        :param write_method: insert, ignore(INSERT IGNORE), upsert(ON DUPLICATE KEY UPDATE) 或
+                             load(LOAD DATA LOCAL INFILE, 需要 MySqlPack(local_infile=True))
+        :param columns: 写入的列, 默认取第一批数据第一行的键
+        :param update_fields: upsert 时冲突后更新的列, 默认为全部写入列
         """
         conn = await self.origin_conn_obj.pool.acquire()
         cursor = await conn.cursor(aiomysql.Cursor)
@@ -69,7 +103,10 @@ class MySqlPack(LogKit, BasePack):
         if table not in {t[0] for t in exists_tables}:
             raise ValueError("table is not exists.")
 
-        writer = MySqlWriter(pool=self.origin_conn_obj.pool, table=table)
+        if write_method == "load" and not self.local_infile:
+            raise ValueError("write method 'load' requires MySqlPack(local_infile=True).")
+        writer = MySqlWriter(pool=self.origin_conn_obj.pool, table=table, write_method=write_method,
+                             columns=columns, update_fields=update_fields)
         return writer
 
 
@@ -79,17 +116,27 @@ class MySqlGetter(BaseGetter):
     # 读取数据时需要保持cursor对象为同一个, 不使用async with方式实例化
     _cursor: aiomysql.DictCursor = None
     src_name: str
+    count_modes = ("exact", "estimate", "none")
 
     def __init__(self, pool: aiomysql.pool = None,
                  select_sql: str = "", table: str = "",
                  return_fields: List[str] = None,
                  where: str = "", offset: int = 0, limit: int = 0,
-                 batch_size: int = None):
+                 batch_size: int = None, stream: bool = False, count_mode: str = "exact", columnar: bool = False):
+        if count_mode not in self.count_modes:
+            raise ValueError(f"count mode must be one of {list(self.count_modes)}")
         self._pool = pool
+        # 缓冲游标在execute时会把整个结果集拉到客户端, 流式游标则边读边取
+        self.stream = stream
+        self.count_mode = count_mode
+        self.columnar = columnar
+        self._counted = False
 
         # select_sql's process
         if not select_sql and table != "":
             fields_desc = "*" if not return_fields else ", ".join(return_fields)
+            self.return_fields = return_fields
+            self._fields_desc = fields_desc
             select_sql = f"SELECT {fields_desc} FROM {table}"
         else:
             raise ValueError("Table name must be specified")
@@ -111,11 +158,17 @@ class MySqlGetter(BaseGetter):
         
         super().__init__(batch_size=batch_size, max_size=limit)
         self.has_execute = False
+        # 断点续传时跳过的行数
+        self._skip = 0
 
     async def _init_conn_coro(self):
         if not self._cursor:
             self._conn = await self._pool.acquire()
-            self._cursor = await self._conn.cursor(aiomysql.DictCursor)
+            if self.columnar:
+                cursor_cls = aiomysql.SSCursor if self.stream else aiomysql.Cursor
+            else:
+                cursor_cls = aiomysql.SSDictCursor if self.stream else aiomysql.DictCursor
+            self._cursor = await self._conn.cursor(cursor_cls)
 
     async def release(self):
         await self._cursor.close()
@@ -124,45 +177,335 @@ class MySqlGetter(BaseGetter):
     async def __anext__(self):
         await self._init_conn_coro()
         if not self.has_execute:
-            await self._cursor.execute(self.select_sql)
+            await self._cursor.execute(self._resumed_sql())
             self.has_execute = True
         await self._get_total_count()
         return await super().__anext__()
     
     async def _get_total_count(self):
-        if not self.total_cnt:
-            self.total_cnt = self._cursor.rowcount
+        if self._counted:
+            return
+        self._counted = True
+        if not self.stream:
+            # 缓冲游标execute后rowcount即为结果集大小
+            self.total_cnt = self._cursor.rowcount + self._skip
+        elif self.count_mode == "exact":
+            self.total_cnt = await self._fetch_count(
+                f"SELECT COUNT(*) FROM ({self.select_sql.rstrip(';')}) AS _count_t;")
+        elif self.count_mode == "estimate":
+            # 估算值来自表统计信息, 忽略where条件, 速度快但不精确
+            self.total_cnt = await self._fetch_count(
+                "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s;", (self.table,))
+            if self.max_size:
+                self.total_cnt = min(self.total_cnt, self.max_size)
+
+    def _resumed_sql(self) -> str:
+        if not self._skip:
+            return self.select_sql
+        # 没有ORDER BY时依赖服务端返回顺序的稳定性, 需要严格续传时请使用分区读取(keyset)
+        return f"SELECT * FROM ({self.select_sql.rstrip(';')}) AS _resume_t LIMIT 18446744073709551615 OFFSET {self._skip};"
+
+    def _set_position(self, position):
+        self._skip = position
+
+    def push_down_projection(self, fields: List[str]) -> bool:
+        if self.has_execute:
+            raise RuntimeError("getter has already started, can not push down projection.")
+        fields = [f for f in self.return_fields if f in fields] if self.return_fields else list(fields)
+        if not fields:
+            return False
+        fields_desc = ", ".join(fields)
+        prefix = f"SELECT {self._fields_desc} FROM "
+        self.select_sql = f"SELECT {fields_desc} FROM " + self.select_sql[len(prefix):]
+        self.return_fields, self._fields_desc = fields, fields_desc
+        return True
+
+    async def _fetch_count(self, sql: str, args=None) -> int:
+        # 流式游标在读完之前占用着当前连接, 计数需要另取一个连接
+        async with self._pool.acquire() as conn:
+            async with conn.cursor(aiomysql.Cursor) as cursor:
+                await cursor.execute(sql, args)
+                row = await cursor.fetchone()
+        return int(row[0] or 0) if row else 0
 
     async def _get_next_lst(self) -> List:
         next_lst = await self._cursor.fetchmany(self.batch_size)
+        if self.columnar and next_lst:
+            # 元组游标的结果直接转为列, 字段名取自游标的描述
+            return ColumnBatch.from_rows([desc[0] for desc in self._cursor.description], next_lst)
         return next_lst
-        
-        
+
+
+class MySqlPartitionedGetter(BaseParallelGetter):
+    """
+    按分区列(默认主键)的 MIN/MAX 将表切分为若干个键范围, 每个范围占用一个独立连接,
+    用 keyset 分页(WHERE col > last ORDER BY col LIMIT n)代替深度 OFFSET 扫描.
+    分区列不唯一时以主键作为第二排序键, 按 (col, pk) 分页和记录断点, 相同取值跨越批次边界时不会漏读.
+    仅整数分区列支持多分区, 其他类型退化为单分区 keyset 读取.
+    注意: 分区列总会出现在返回的数据中, 同一批次内按分区列有序, 批次之间不保证有序.
+    """
+    _pool: aiomysql.pool = None
+    src_name: str
+
+    def __init__(self, pool: aiomysql.pool = None, table: str = "", return_fields: List[str] = None,
+                 where: str = "", split_column: str = "", partitions: int = 1, batch_size: int = None,
+                 columnar: bool = False):
+        if not table:
+            raise ValueError("Table name must be specified")
+        if partitions < 1:
+            raise ValueError("partitions must be greater than 0!")
+        super().__init__(src_name=table, batch_size=batch_size)
+        self._pool = pool
+        self.table = table
+        self.return_fields = return_fields
+        self.where = where
+        self.split_column = split_column
+        # 分区列不唯一时的第二排序键(单列主键), 分区列唯一时为空
+        self.tie_column = ""
+        self.partitions = partitions
+        self.columnar = columnar
+
+    async def _fetchone(self, sql: str, args=None):
+        async with self._pool.acquire() as conn:
+            async with conn.cursor(aiomysql.Cursor) as cursor:
+                await cursor.execute(sql, args)
+                return await cursor.fetchone()
+
+    def _where_desc(self, prefix: str) -> str:
+        return f" {prefix} ({self.where})" if self.where else ""
+
+    async def _get_total_count(self):
+        if not self.total_cnt:
+            row = await self._fetchone(f"SELECT COUNT(*) FROM {self.table}{self._where_desc('WHERE')};")
+            self.total_cnt = row[0]
+
+    async def _unique_keys(self) -> Tuple[str, set]:
+        """
+        :return: 单列主键(没有时为空)及所有单列唯一索引的列
+        """
+        async with self._pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(f"SHOW KEYS FROM {self.table} WHERE Non_unique = 0;")
+                keys = await cursor.fetchall()
+        columns = dict()
+        for key in keys:
+            columns.setdefault(key["Key_name"], []).append(key["Column_name"])
+        primary = columns.get("PRIMARY", [])
+        return (primary[0] if len(primary) == 1 else ""), {cols[0] for cols in columns.values() if len(cols) == 1}
+
+    async def _resolve_columns(self):
+        primary, unique_columns = await self._unique_keys()
+        if not self.split_column:
+            if not primary:
+                raise ValueError("table has no single-column primary key, split_column must be specified.")
+            self.split_column = primary
+        if self.split_column not in unique_columns:
+            if not primary:
+                raise ValueError(f"split column {self.split_column} is not unique and table has no single-column "
+                                 f"primary key to break ties.")
+            self.tie_column = primary
+
+    async def _build_partitions(self):
+        await self._resolve_columns()
+        col = self.split_column
+        lo, hi = await self._fetchone(f"SELECT MIN({col}), MAX({col}) FROM {self.table}{self._where_desc('WHERE')};")
+        if lo is None:
+            return []
+        if isinstance(lo, int) and isinstance(hi, int) and self.partitions > 1:
+            step = (hi - lo) // self.partitions + 1
+            ranges = [[start, min(start + step - 1, hi)] for start in range(lo, hi + 1, step)]
+        else:
+            ranges = [[lo, hi]]
+        self.logger.info(f"split {self.table} by {col} into {len(ranges)} partitions: {ranges}")
+        return ranges
+
+    def _last_key(self, lst):
+        # 分区内的位置为已产出的最大键, 有第二排序键时为 [分区列, 主键]
+        last = {col: lst.column(col)[-1] for col in (self.split_column, self.tie_column) if col} \
+            if isinstance(lst, ColumnBatch) else lst[-1]
+        if self.tie_column:
+            return [last[self.split_column], last[self.tie_column]]
+        return last[self.split_column]
+
+    def _advance(self, spec, position, lst):
+        return self._last_key(lst)
+
+    def _get_position(self):
+        position = super()._get_position()
+        if position is not None:
+            position["split_column"] = self.split_column
+            position["tie_column"] = self.tie_column
+        return position
+
+    def _set_position(self, position):
+        super()._set_position(position)
+        if position:
+            self.split_column = position["split_column"]
+            self.tie_column = position.get("tie_column", "")
+
+    def push_down_projection(self, fields: List[str]) -> bool:
+        if self._queue is not None:
+            raise RuntimeError("getter has already started, can not push down projection.")
+        fields = [f for f in self.return_fields if f in fields] if self.return_fields else list(fields)
+        if not fields:
+            return False
+        # 分区列(及第二排序键)在读取时会自动补上
+        self.return_fields = fields
+        return True
+
+    async def _read_partition(self, spec, position):
+        start, end = spec
+        col, tie = self.split_column, self.tie_column
+        if not self.return_fields:
+            fields_desc = "*"
+        else:
+            fields = list(self.return_fields)
+            fields += [c for c in (col, tie) if c and c not in fields]
+            fields_desc = ", ".join(fields)
+        # where 会与参数一起经过 % 格式化, 需转义其中的 %
+        where_desc = self._where_desc("AND").replace("%", "%%")
+        order_desc = f" ORDER BY {col}, {tie}" if tie else f" ORDER BY {col}"
+        # 有第二排序键时按 (col, pk) 越过上一批的最后一行, 相同的 col 不会被跳过
+        after_desc = f"({col} > %s OR ({col} = %s AND {tie} > %s))" if tie else f"{col} > %s"
+        first_sql = f"SELECT {fields_desc} FROM {self.table} WHERE {col} >= %s AND {col} <= %s" + \
+            where_desc + order_desc + f" LIMIT {self.batch_size};"
+        next_sql = f"SELECT {fields_desc} FROM {self.table} WHERE {after_desc} AND {col} <= %s" + \
+            where_desc + order_desc + f" LIMIT {self.batch_size};"
+
+        def next_args(last_key):
+            return (last_key[0], last_key[0], last_key[1], end) if tie else (last_key, end)
+
+        conn = await self._pool.acquire()
+        try:
+            async with conn.cursor(aiomysql.Cursor if self.columnar else aiomysql.DictCursor) as cursor:
+                # 首批包含下界, 之后以上一批的最大键为游标; 续传时直接从断点的键之后开始
+                if position is None:
+                    await cursor.execute(first_sql, (start, end))
+                else:
+                    await cursor.execute(next_sql, next_args(position))
+                while True:
+                    rows = await cursor.fetchall()
+                    if not rows:
+                        break
+                    if self.columnar:
+                        batch = ColumnBatch.from_rows([desc[0] for desc in cursor.description], rows)
+                    else:
+                        batch = list(rows)
+                    last_key = self._last_key(batch)
+                    yield batch
+                    if len(rows) < self.batch_size:
+                        break
+                    await cursor.execute(next_sql, next_args(last_key))
+        finally:
+            self._pool.release(conn)
+
+    async def release(self):
+        await self.close()
+
+
 class MySqlWriter(BaseWriter):
+    """
+    列计划(列顺序及写入sql)在第一批数据到来时生成并缓存, 之后每行按列名取值, 缺失的列写入NULL.
+    批次为 ColumnBatch 时直接按列生成参数元组, 不经过dict.
+    多行INSERT的拆分由驱动的 executemany 完成, 单条语句的长度上限设置为服务端的 max_allowed_packet.
+    """
     _pool = None
     dst_name: str
+    write_methods = ("insert", "ignore", "upsert", "load")
+    # 语句之外协议包头等的预留字节
+    packet_reserved = 1024
+    load_data_escapes = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"})
 
-    def __init__(self, pool: aiomysql.pool, table: str = ""):
+    def __init__(self, pool: aiomysql.pool, table: str = "", write_method: str = "insert",
+                 columns: List[str] = None, update_fields: List[str] = None):
         super().__init__()
+        if write_method not in self.write_methods:
+            raise ValueError(f"write method must be one of {list(self.write_methods)}")
         self._pool = pool
         self.table = table
         self.dst_name = table
+        self.write_method = write_method
+        self.update_fields = update_fields
+        self.columns: Tuple[str] = tuple(columns) if columns else None
+        self.write_sql = ""
+        self.max_stmt_length = 0
 
-    async def write(self, lst: List[Dict]):
+    async def write(self, lst: Union[List[Dict], ColumnBatch]):
         async with self._pool.acquire() as conn:
             # 使用async with 方式 获取到链接以便自动回收，避免链接数过多 
-            await super().write(lst, conn)
-            
-    async def _handle_lst(self, lst, conn):
-        docs = list(map(OrderedDict, lst))
-        table_head = tuple(OrderedDict(docs[0]).keys())
-        values_desc = ", ".join(["%s"] * len(table_head))
-        table_head_desc = ", ".join(table_head)
-        values_list = list(map(tuple, [doc.values() for doc in docs]))
+            return await super().write(lst, conn)
 
-        write_sql = f"INSERT INTO {self.table} ({table_head_desc}) VALUES ({values_desc});"
+    def _build_plan(self, lst: List[Dict]):
+        if not self.columns:
+            self.columns = tuple(lst.fields) if isinstance(lst, ColumnBatch) else tuple(lst[0].keys())
+        columns_desc = ", ".join(f"`{col}`" for col in self.columns)
+        if self.write_method == "load":
+            # 文件名在写入时再填充
+            self.write_sql = f"INTO TABLE {self.table} CHARACTER SET utf8mb4 " \
+                             f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({columns_desc});"
+            return
+        values_desc = ", ".join(["%s"] * len(self.columns))
+        insert_desc = "INSERT IGNORE" if self.write_method == "ignore" else "INSERT"
+        self.write_sql = f"{insert_desc} INTO {self.table} ({columns_desc}) VALUES ({values_desc})"
+        if self.write_method == "upsert":
+            update_fields = self.update_fields or self.columns
+            self.write_sql += " ON DUPLICATE KEY UPDATE " + \
+                              ", ".join(f"`{col}` = VALUES(`{col}`)" for col in update_fields)
+        self.write_sql += ";"
 
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            await cursor.executemany(write_sql, values_list)
+    async def _get_max_stmt_length(self, conn) -> int:
+        if not self.max_stmt_length:
+            async with conn.cursor(aiomysql.Cursor) as cursor:
+                await cursor.execute("SELECT @@max_allowed_packet;")
+                (max_allowed_packet,) = await cursor.fetchone()
+            self.max_stmt_length = int(max_allowed_packet) - self.packet_reserved
+        return self.max_stmt_length
+
+    async def _handle_lst(self, lst, conn):
+        if not lst:
+            return
+        if not self.write_sql:
+            self._build_plan(lst)
+        columns = self.columns
+        if isinstance(lst, ColumnBatch):
+            values_list = list(lst.rows(columns))
+        else:
+            values_list = [tuple(map(doc.get, columns)) for doc in lst]
+        if self.write_method == "load":
+            await self._load_data(values_list, conn)
+            return
+
+        async with conn.cursor(aiomysql.Cursor) as cursor:
+            cursor.max_stmt_length = await self._get_max_stmt_length(conn)
+            await cursor.executemany(self.write_sql, values_list)
             await conn.commit()
 
+    def _load_data_field(self, value) -> str:
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            return "1" if value else "0"
+        if isinstance(value, bytes):
+            value = value.decode(DefaultValue.encoding)
+        return str(value).translate(self.load_data_escapes)
+
+    def _dump_load_data(self, values_list: List[tuple]) -> str:
+        # 先在内存中拼好整批数据, 再一次性落盘: 驱动只能按文件名读取 LOCAL INFILE
+        buffer = io.StringIO()
+        for values in values_list:
+            buffer.write("\t".join(map(self._load_data_field, values)))
+            buffer.write("\n")
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".tsv", delete=False) as f:
+            f.write(buffer.getvalue())
+        return f.name
+
+    async def _load_data(self, values_list: List[tuple], conn):
+        loop = asyncio.get_event_loop()
+        path = await loop.run_in_executor(None, self._dump_load_data, values_list)
+        try:
+            async with conn.cursor(aiomysql.Cursor) as cursor:
+                await cursor.execute(f"LOAD DATA LOCAL INFILE {conn.escape(path)} " + self.write_sql)
+                await conn.commit()
+        finally:
+            os.remove(path)
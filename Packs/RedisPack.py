@@ -5,16 +5,22 @@ import redis
 import json
 
 from iotoolkit.Packs.Base import BasePack, BaseGetter, BaseWriter
-from iotoolkit.util import LogKit, DefaultValue, FuncSet
+from iotoolkit.util import LogKit, DefaultValue, FuncSet, Codec, get_codec
+from abc import abstractmethod
 from types import FunctionType
-from typing import List, Any
+from typing import List, Any, Tuple
 from time import time
 
 
 class RedisPack(LogKit, BasePack):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, codec=None, **kwargs):
+        """
+        :param codec: 默认的序列化方式(raw/json/orjson/msgpack 或 Codec 实例), 可以在 new_getter/new_writer 中单独指定;
+                      不指定时写入沿用 json.dumps(dict)/str(其他), 读取时返回原始字符串
+        """
         self.scheme = "redis"
+        self.codec: Codec = get_codec(codec) if codec is not None else None
         BasePack.__init__(self, *args, **kwargs)
 
     def is_ready(self):
@@ -24,29 +30,97 @@ class RedisPack(LogKit, BasePack):
         """
         build connection for dbs
         """
-        self.origin_conn_obj.pool = aioredis.ConnectionPool(decode_responses=True, **self.conn_config)
+        # 二进制的序列化方式(如msgpack)不是合法的utf-8, 不能让客户端解码响应
+        decode_responses = not (self.codec is not None and self.codec.binary)
+        self.origin_conn_obj.pool = aioredis.ConnectionPool(decode_responses=decode_responses, **self.conn_config)
         self.origin_conn_obj.cli = aioredis.Redis(connection_pool=self.origin_conn_obj.pool)
 
+    def _resolve_codec(self, codec) -> Codec:
+        return get_codec(codec) if codec is not None else self.codec
+
+    def _client_for(self, codec: Codec) -> aioredis.Redis:
+        """
+        读取二进制序列化的数据时需要不解码响应的客户端, 与默认客户端不同时单独建立一个连接池
+        """
+        if codec is None or not codec.binary or not self.origin_conn_obj.pool.connection_kwargs.get("decode_responses"):
+            return self.origin_conn_obj.cli
+        if self.origin_conn_obj.raw_cli is None:
+            self.origin_conn_obj.raw_pool = aioredis.ConnectionPool(decode_responses=False, **self.conn_config)
+            self.origin_conn_obj.raw_cli = aioredis.Redis(connection_pool=self.origin_conn_obj.raw_pool)
+        return self.origin_conn_obj.raw_cli
+
     @FuncSet.ensure_connected
-    async def new_getter(self, key_name: str, key_type: str = "LIST", batch_size: int = 100, max_size: int = 0):
-        if key_type.upper() == "LIST":
-            return RedisListGetter(key_name=key_name, cli=self.origin_conn_obj.cli, batch_size=batch_size, max_size=max_size)
+    async def new_getter(self, key_name: str, key_type: str = "LIST", batch_size: int = 100, max_size: int = 0,
+                         codec=None, resume_from: dict = None):
+        """
+        :param key_name: key name, key_type 为 KEYS 时为 SCAN MATCH 的匹配模式
+        :param key_type: LIST, HASH(HSCAN), SET(SSCAN), ZSET(ZSCAN), STREAM(XRANGE) 或 KEYS(SCAN整个库)
+        :param batch_size: size of batch data, 对SCAN系列命令同时作为COUNT提示
+        :param max_size: return-data's max size
+        :param codec: 值的序列化方式, 默认为 RedisPack 的 codec; 指定后整批自动解码, KEYS 不支持
+        :param resume_from: 断点(CheckpointStore.load 的结果), 从断点处继续读取并恢复进度
+        :return: async iter
+        """
+        getter_cls = getter_classes.get(key_type.upper())
+        if getter_cls is None:
+            raise NotImplementedError(f"{key_type} key type getter is not implemented.")
+        if getter_cls is RedisKeysGetter:
+            if codec is not None:
+                raise ValueError("codec is not supported for KEYS.")
+            getter = getter_cls(key_name=key_name, cli=self.origin_conn_obj.cli, batch_size=batch_size,
+                                max_size=max_size)
         else:
-            raise NotImplementedError("other key type getter is not implemented.")
+            codec = self._resolve_codec(codec)
+            getter = getter_cls(key_name=key_name, cli=self._client_for(codec), batch_size=batch_size,
+                                max_size=max_size, codec=codec)
+        if resume_from:
+            getter.restore(resume_from)
+        return getter
 
     @FuncSet.ensure_connected
-    async def new_writer(self, key_name: str, ):
-        return RedisListWriter(key_name=key_name, cli=self.origin_conn_obj.cli)
+    async def new_writer(self, key_name: str, key_type: str = "LIST", chunk_size: int = 1000, preserve_order: bool = False,
+                         codec=None):
+        """
+        :param key_name: key name, key_type 为 KEYS 时无效
+        :param key_type: LIST, HASH, SET, ZSET, STREAM 或 KEYS, 接收对应getter产出的数据格式
+        :param chunk_size: 每条写入命令携带的元素个数, 一个批次的所有命令在同一个pipeline中发送
+        :param preserve_order: 仅对LIST有效, 为True时使用RPUSH追加到队尾, RedisListGetter读回的顺序与写入顺序一致;
+                               默认LPUSH, 读回的顺序与写入顺序相反
+        :param codec: 值的序列化方式, 默认为 RedisPack 的 codec, 整批编码; KEYS 不支持
+        """
+        writer_cls = writer_classes.get(key_type.upper())
+        if writer_cls is None:
+            raise NotImplementedError(f"{key_type} key type writer is not implemented.")
+        if writer_cls is RedisKeysWriter:
+            if codec is not None:
+                raise ValueError("codec is not supported for KEYS.")
+            return RedisKeysWriter(key_name=key_name, cli=self.origin_conn_obj.cli, chunk_size=chunk_size)
+        codec = self._resolve_codec(codec)
+        if writer_cls is RedisListWriter:
+            return RedisListWriter(key_name=key_name, cli=self.origin_conn_obj.cli,
+                                   chunk_size=chunk_size, preserve_order=preserve_order, codec=codec)
+        return writer_cls(key_name=key_name, cli=self.origin_conn_obj.cli, chunk_size=chunk_size, codec=codec)
+
+
+def _encode_value(each: Any) -> str:
+    return json.dumps(each) if isinstance(each, dict) else str(each)
+
+
+def _text(value) -> str:
+    # 不解码响应的客户端返回的key/字段名/id为bytes
+    return value.decode(DefaultValue.encoding) if isinstance(value, bytes) else value
 
 
 class RedisListGetter(BaseGetter):
     src_name: str
     
-    def __init__(self, key_name: str, cli: aioredis.Redis, batch_size: int = None, max_size: int = 0):
+    def __init__(self, key_name: str, cli: aioredis.Redis, batch_size: int = None, max_size: int = 0,
+                 codec: Codec = None):
         super().__init__(batch_size=batch_size, max_size=max_size)
         self.key_name = key_name
         self.src_name = key_name
         self.cli = cli
+        self.codec = codec
         self.page = 0
 
     async def _get_total_count(self):
@@ -56,26 +130,382 @@ class RedisListGetter(BaseGetter):
     async def _get_next_lst(self) -> List:
         start = self.page * self.batch_size
         end = min(self.total_cnt, (self.page + 1) * self.batch_size - 1)
+        if self.max_size:
+            end = min(end, self.max_size - 1)
+            if start > end:
+                return []
         next_lst = await self.cli.lrange(name=self.key_name, start=start, end=end)
         self.page += 1
+        if self.codec is not None:
+            next_lst = self.codec.decode_batch(next_lst)
         return next_lst
+
+    def _get_position(self):
+        return self.page
+
+    def _set_position(self, position):
+        self.page = position
     
     
-class RedisListWriter(BaseWriter):
+class RedisScanGetter(BaseGetter):
+    """
+    基于游标的 SCAN/HSCAN/SSCAN/ZSCAN 读取, 每次只取 COUNT 个元素, 不会用 HGETALL/SMEMBERS 一次拉取整个大key.
+    每个批次由若干次完整的SCAN调用组成, 条数约为 batch_size; SCAN 语义下元素可能重复返回.
+    指定 max_size 时读够后截断最后一个批次并结束遍历.
+    """
+    src_name: str
+
+    def __init__(self, key_name: str, cli: aioredis.Redis, batch_size: int = None, max_size: int = 0,
+                 codec: Codec = None):
+        super().__init__(batch_size=batch_size, max_size=max_size)
+        self.key_name = key_name
+        self.src_name = key_name
+        self.cli = cli
+        self.codec = codec
+        self.cursor = 0
+        self.finished = False
+
+    async def _get_total_count(self):
+        if not self.total_cnt:
+            self.total_cnt = await self._count()
+            if self.max_size:
+                self.total_cnt = min(self.total_cnt, self.max_size)
+
+    @abstractmethod
+    async def _count(self) -> int:
+        ...
+
+    @abstractmethod
+    async def _scan(self, cursor: int) -> Tuple[int, List]:
+        """
+        :return: 下一个游标及本次取到的元素
+        """
+        ...
+
+    def _decode(self, values: List) -> List:
+        return self.codec.decode_batch(values) if self.codec is not None else values
+
+    async def _get_next_lst(self) -> List:
+        size = self.batch_size
+        if self.max_size:
+            size = min(size, self.max_size - self.done_cnt)
+            if size <= 0:
+                self.finished = True
+                return []
+        next_lst = []
+        while not self.finished and len(next_lst) < size:
+            self.cursor, items = await self._scan(self.cursor)
+            next_lst.extend(items)
+            # 游标回到0表示遍历结束
+            if self.cursor == 0:
+                self.finished = True
+        if self.max_size and self.done_cnt + len(next_lst) >= self.max_size:
+            # 读够 max_size, 多出的元素丢弃后不再继续遍历
+            next_lst = next_lst[:self.max_size - self.done_cnt]
+            self.finished = True
+        return next_lst
+
+    def _get_position(self):
+        # 批次由完整的SCAN调用组成, 游标即可准确表示位置
+        return {"cursor": self.cursor, "finished": self.finished}
+
+    def _set_position(self, position):
+        self.cursor = position["cursor"]
+        self.finished = position["finished"]
+
+
+class RedisHashGetter(RedisScanGetter):
+    async def _count(self) -> int:
+        return await self.cli.hlen(self.key_name)
+
+    async def _scan(self, cursor: int) -> Tuple[int, List]:
+        cursor, data = await self.cli.hscan(self.key_name, cursor=cursor, count=self.batch_size)
+        values = self._decode(list(data.values()))
+        return cursor, [{"field": _text(field), "value": value} for field, value in zip(data, values)]
+
+
+class RedisSetGetter(RedisScanGetter):
+    async def _count(self) -> int:
+        return await self.cli.scard(self.key_name)
+
+    async def _scan(self, cursor: int) -> Tuple[int, List]:
+        cursor, members = await self.cli.sscan(self.key_name, cursor=cursor, count=self.batch_size)
+        return cursor, self._decode(members)
+
+
+class RedisZSetGetter(RedisScanGetter):
+    async def _count(self) -> int:
+        return await self.cli.zcard(self.key_name)
+
+    async def _scan(self, cursor: int) -> Tuple[int, List]:
+        cursor, data = await self.cli.zscan(self.key_name, cursor=cursor, count=self.batch_size)
+        members = self._decode([member for member, _ in data])
+        return cursor, [{"member": member, "score": score} for member, (_, score) in zip(members, data)]
+
+
+class RedisKeysGetter(RedisScanGetter):
+    """
+    SCAN MATCH 遍历整个库, 每批key先用一次pipeline取类型和ttl, 再用一次pipeline取值的第一块,
+    产出 {"key", "type", "ttl", "value"}. ttl为毫秒, -1表示不过期.
+    值用 HSCAN/SSCAN/ZSCAN/分段LRANGE/分页XRANGE 读取, 每次至多 value_chunk_size 个元素,
+    一块读不完的大key再单独分块读完, 不会用 HGETALL/SMEMBERS 一次拉取整个大key.
+    """
+    value_chunk_size = 1000
+    value_fetchers = {
+        "string": lambda pipe, key, n: pipe.get(key),
+        "hash": lambda pipe, key, n: pipe.hscan(key, cursor=0, count=n),
+        "list": lambda pipe, key, n: pipe.lrange(key, 0, n - 1),
+        "set": lambda pipe, key, n: pipe.sscan(key, cursor=0, count=n),
+        "zset": lambda pipe, key, n: pipe.zscan(key, cursor=0, count=n),
+        "stream": lambda pipe, key, n: pipe.xrange(key, count=n),
+    }
+
+    async def _count(self) -> int:
+        # DBSIZE 不考虑匹配模式, 只作为进度估算
+        return await self.cli.dbsize()
+
+    async def _scan(self, cursor: int) -> Tuple[int, List]:
+        cursor, keys = await self.cli.scan(cursor=cursor, match=self.key_name or None, count=self.batch_size)
+        if not keys:
+            return cursor, []
+        async with self.cli.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.type(key)
+                pipe.pttl(key)
+            meta = await pipe.execute()
+        key_types, ttls = meta[0::2], meta[1::2]
+        async with self.cli.pipeline(transaction=False) as pipe:
+            for key, key_type in zip(keys, key_types):
+                fetcher = self.value_fetchers.get(key_type)
+                if fetcher:
+                    fetcher(pipe, key, self.value_chunk_size)
+                else:
+                    # key 在两次往返之间过期或类型不支持时占位, 保持结果与key一一对应
+                    pipe.echo("")
+            values = await pipe.execute()
+        return cursor, [{"key": key, "type": key_type, "ttl": ttl, "value": await self._fetch_rest(key, key_type, value)}
+                        for key, key_type, ttl, value in zip(keys, key_types, ttls, values)
+                        if key_type in self.value_fetchers]
+
+    async def _fetch_rest(self, key, key_type: str, first):
+        """
+        在第一块的基础上读完整个值, 返回与 HGETALL/LRANGE/SMEMBERS/ZRANGE WITHSCORES/XRANGE 相同的结构
+        """
+        n = self.value_chunk_size
+        if key_type == "hash":
+            cursor, value = first[0], dict(first[1])
+            while cursor:
+                cursor, data = await self.cli.hscan(key, cursor=cursor, count=n)
+                value.update(data)
+            return value
+        if key_type == "set":
+            cursor, value = first[0], set(first[1])
+            while cursor:
+                cursor, members = await self.cli.sscan(key, cursor=cursor, count=n)
+                value.update(members)
+            return value
+        if key_type == "zset":
+            # ZSCAN 可能重复返回元素, 按成员去重后与 ZRANGE 一样按分数排序
+            cursor, value = first[0], dict(first[1])
+            while cursor:
+                cursor, data = await self.cli.zscan(key, cursor=cursor, count=n)
+                value.update(data)
+            return sorted(value.items(), key=lambda item: (item[1], item[0]))
+        if key_type == "list":
+            value, chunk = list(first), first
+            while len(chunk) == n:
+                chunk = await self.cli.lrange(key, len(value), len(value) + n - 1)
+                value.extend(chunk)
+            return value
+        if key_type == "stream":
+            value, chunk = list(first), first
+            while len(chunk) == n:
+                chunk = await self.cli.xrange(key, min=RedisStreamGetter._next_id(_text(chunk[-1][0])), max="+", count=n)
+                value.extend(chunk)
+            return value
+        return first
+
+
+class RedisStreamGetter(BaseGetter):
+    """
+    XRANGE 按id分页读取stream, 产出 {"id", "fields"}
+    """
+    src_name: str
+
+    def __init__(self, key_name: str, cli: aioredis.Redis, batch_size: int = None, max_size: int = 0,
+                 codec: Codec = None):
+        super().__init__(batch_size=batch_size, max_size=max_size)
+        self.key_name = key_name
+        self.src_name = key_name
+        self.cli = cli
+        self.codec = codec
+        self.last_id = None
+
+    async def _get_total_count(self):
+        if not self.total_cnt:
+            self.total_cnt = await self.cli.xlen(self.key_name)
+            if self.max_size:
+                self.total_cnt = min(self.total_cnt, self.max_size)
+
+    @staticmethod
+    def _next_id(entry_id: str) -> str:
+        # 兼容不支持排他区间"("的旧版本redis, 手动把序号加一
+        ms, seq = entry_id.split("-")
+        return f"{ms}-{int(seq) + 1}"
+
+    async def _get_next_lst(self) -> List:
+        size = self.batch_size
+        if self.max_size:
+            size = min(size, self.max_size - self.done_cnt)
+            if size <= 0:
+                return []
+        start = "-" if self.last_id is None else self._next_id(self.last_id)
+        entries = await self.cli.xrange(self.key_name, min=start, max="+", count=size)
+        entries = [(_text(entry_id), fields) for entry_id, fields in entries]
+        if entries:
+            self.last_id = entries[-1][0]
+        if self.codec is not None:
+            # 整批的字段值一次解码, 再按条目拆回
+            values = iter(self.codec.decode_batch([v for _, fields in entries for v in fields.values()]))
+            return [{"id": entry_id, "fields": {_text(k): next(values) for k in fields}} for entry_id, fields in entries]
+        return [{"id": entry_id, "fields": fields} for entry_id, fields in entries]
+
+    def _get_position(self):
+        return self.last_id
+
+    def _set_position(self, position):
+        self.last_id = position
+
+
+class RedisPipelineWriter(BaseWriter):
+    """
+    一个批次的所有写入命令按 chunk_size 拆分后在同一个非事务pipeline中发送, 只需一次往返
+    """
     dst_name: str
-    
-    def __init__(self, key_name: str, cli: aioredis.Redis):
+
+    def __init__(self, key_name: str, cli: aioredis.Redis, chunk_size: int = 1000, codec: Codec = None):
         super().__init__()
+        if chunk_size < 1:
+            raise ValueError("chunk size must be greater than 0!")
         self.key_name = key_name
         self.dst_name = key_name
         self.cli = cli
+        self.chunk_size = chunk_size
+        self.codec = codec
+
+    def _encode(self, values: List[Any]) -> List[Any]:
+        if self.codec is not None:
+            return self.codec.encode_batch(values)
+        return list(map(_encode_value, values))
+
+    def _chunks(self, lst: List[Any]):
+        for i in range(0, len(lst), self.chunk_size):
+            yield lst[i:i + self.chunk_size]
+
+    @abstractmethod
+    def _stage(self, pipe, lst: List[Any]):
+        """
+        把写入命令压入pipeline
+        """
+        ...
 
     async def _handle_lst(self, lst: List[Any]):
+        async with self.cli.pipeline(transaction=False) as pipe:
+            self._stage(pipe, lst)
+            await pipe.execute()
+
+
+class RedisListWriter(RedisPipelineWriter):
+    def __init__(self, key_name: str, cli: aioredis.Redis, chunk_size: int = 1000, preserve_order: bool = False,
+                 codec: Codec = None):
+        super().__init__(key_name=key_name, cli=cli, chunk_size=chunk_size, codec=codec)
+        self.preserve_order = preserve_order
+
+    def _stage(self, pipe, lst: List[Any]):
+        values = self._encode(lst)
+        push = pipe.rpush if self.preserve_order else pipe.lpush
+        for chunk in self._chunks(values):
+            push(self.key_name, *chunk)
+
+
+class RedisHashWriter(RedisPipelineWriter):
+    """
+    接收 {"field", "value"}
+    """
+    def _stage(self, pipe, lst: List[Any]):
+        for chunk in self._chunks(lst):
+            values = self._encode([each["value"] for each in chunk])
+            pipe.hset(self.key_name, mapping={each["field"]: value for each, value in zip(chunk, values)})
+
+
+class RedisSetWriter(RedisPipelineWriter):
+    def _stage(self, pipe, lst: List[Any]):
+        for chunk in self._chunks(lst):
+            pipe.sadd(self.key_name, *self._encode(chunk))
+
+
+class RedisZSetWriter(RedisPipelineWriter):
+    """
+    接收 {"member", "score"}
+    """
+    def _stage(self, pipe, lst: List[Any]):
+        for chunk in self._chunks(lst):
+            members = self._encode([each["member"] for each in chunk])
+            pipe.zadd(self.key_name, {member: each["score"] for member, each in zip(members, chunk)})
+
+
+class RedisStreamWriter(RedisPipelineWriter):
+    """
+    接收 {"id", "fields"}, 由redis重新生成id
+    """
+    def _stage(self, pipe, lst: List[Any]):
+        values = iter(self._encode([v for each in lst for v in each["fields"].values()]))
         for each in lst:
-            if isinstance(each, dict):
-                each_push = json.dumps(each)
-            else:
-                each_push = str(each)
-            await self.cli.lpush(self.key_name, each_push)
-        
-        
+            pipe.xadd(self.key_name, {k: next(values) for k in each["fields"]})
+
+
+class RedisKeysWriter(RedisPipelineWriter):
+    """
+    接收 RedisKeysGetter 产出的 {"key", "type", "ttl", "value"}, 按类型还原key(覆盖已存在的同名key)及过期时间
+    """
+    def _stage(self, pipe, lst: List[Any]):
+        for each in lst:
+            key, key_type, value = each["key"], each["type"], each["value"]
+            pipe.delete(key)
+            if key_type == "string":
+                pipe.set(key, value)
+            elif key_type == "hash" and value:
+                pipe.hset(key, mapping=value)
+            elif key_type == "list" and value:
+                for chunk in self._chunks(value):
+                    pipe.rpush(key, *chunk)
+            elif key_type == "set" and value:
+                for chunk in self._chunks(list(value)):
+                    pipe.sadd(key, *chunk)
+            elif key_type == "zset" and value:
+                for chunk in self._chunks(value):
+                    pipe.zadd(key, dict(chunk))
+            elif key_type == "stream":
+                for entry_id, fields in value or []:
+                    pipe.xadd(key, fields, id=entry_id)
+            if each.get("ttl", -1) > 0:
+                pipe.pexpire(key, each["ttl"])
+
+
+getter_classes = {
+    "LIST": RedisListGetter,
+    "HASH": RedisHashGetter,
+    "SET": RedisSetGetter,
+    "ZSET": RedisZSetGetter,
+    "STREAM": RedisStreamGetter,
+    "KEYS": RedisKeysGetter,
+}
+
+writer_classes = {
+    "LIST": RedisListWriter,
+    "HASH": RedisHashWriter,
+    "SET": RedisSetWriter,
+    "ZSET": RedisZSetWriter,
+    "STREAM": RedisStreamWriter,
+    "KEYS": RedisKeysWriter,
+}
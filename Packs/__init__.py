@@ -5,3 +5,4 @@ from .MongoPack import MongoPack
 from .RedisPack import RedisPack
 from .MySqlPack import MySqlPack
 from .ESPack import ESPack
+from .FilePack import FilePack
@@ -0,0 +1,221 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 20:05
+import asyncio
+import random
+from time import monotonic
+from typing import Dict, List, Optional
+
+from iotoolkit.ProxyProvider import ProxyProvider
+from iotoolkit.util import LogKit
+
+
+class _ProxyStat:
+    __slots__ = ("proxy", "succ", "fail", "consecutive_fails", "ewma_latency", "quarantined_until", "quarantined_times")
+
+    def __init__(self, proxy: str):
+        self.proxy = proxy
+        self.succ = 0
+        self.fail = 0
+        self.consecutive_fails = 0
+        self.ewma_latency = None
+        self.quarantined_until = 0.0
+        self.quarantined_times = 0
+
+    @property
+    def success_rate(self) -> float:
+        total = self.succ + self.fail
+        # 没有样本的新代理按成功处理, 让它有机会被选中
+        return self.succ / total if total else 1.0
+
+    def score(self, default_latency: float) -> float:
+        latency = self.ewma_latency if self.ewma_latency is not None else default_latency
+        return self.success_rate / (latency + 0.001)
+
+
+class ProxyPool(LogKit, ProxyProvider):
+    """
+    包装任意 ProxyProvider 的代理池:
+        后台预取代理放入就绪集合, get_proxy 从就绪集合中 O(1) 取出(随机两选一, 取成功率/延迟得分高的);
+        Grabber 通过 report 回报每次请求的结果, 连续失败或成功率过低的代理被隔离, 多次被隔离后淘汰;
+        指定 pin 时同一个 pin(如session编号)持续使用同一个代理, 便于复用keep-alive连接.
+    """
+
+    def __init__(self, provider: ProxyProvider, size: int = 20, prefetch_concurrency: int = 2,
+                 max_consecutive_fails: int = 3, min_success_rate: float = 0.5, min_samples: int = 10,
+                 quarantine_seconds: float = 60.0, max_quarantined_times: int = 2, latency_alpha: float = 0.3,
+                 refill_interval: float = 1.0, get_timeout: float = 30.0):
+        """
+        :param provider: 实际获取代理的 ProxyProvider
+        :param size: 就绪集合的目标大小
+        :param prefetch_concurrency: 后台并发调用 provider.get_proxy 的数量
+        :param max_consecutive_fails: 连续失败达到该次数时隔离
+        :param min_success_rate: 样本数不少于 min_samples 且成功率低于该值时隔离
+        :param min_samples: 按成功率判断前需要的最少样本数
+        :param quarantine_seconds: 隔离的秒数, 到期后重新放回就绪集合
+        :param max_quarantined_times: 被隔离达到该次数时淘汰
+        :param latency_alpha: 延迟EWMA的平滑系数
+        :param refill_interval: 后台检查补充的间隔秒数
+        :param get_timeout: get_proxy 等待可用代理的最长秒数, 超时抛出 TimeoutError, 0 表示一直等待
+        """
+        if size < 1:
+            raise ValueError("size must be greater than 0!")
+        self.provider = provider
+        self.size = size
+        self.prefetch_concurrency = prefetch_concurrency
+        self.max_consecutive_fails = max_consecutive_fails
+        self.min_success_rate = min_success_rate
+        self.min_samples = min_samples
+        self.quarantine_seconds = quarantine_seconds
+        self.max_quarantined_times = max_quarantined_times
+        self.latency_alpha = latency_alpha
+        self.refill_interval = refill_interval
+        self.get_timeout = get_timeout
+
+        self._stats: Dict[str, _ProxyStat] = dict()
+        # 就绪集合: 列表 + 下标索引, 删除时与末尾交换, 取出和删除都是 O(1)
+        self._ready: List[str] = list()
+        self._ready_idx: Dict[str, int] = dict()
+        self._quarantined: Dict[str, _ProxyStat] = dict()
+        self._evicted = set()
+        self._pins: Dict[object, str] = dict()
+        self._ready_event = asyncio.Event()
+        self._refill_task: Optional[asyncio.Task] = None
+        # provider 连续获取失败的次数及最后一次的异常, 用于超时时的报错信息
+        self._fetch_fails = 0
+        self._last_fetch_error: Optional[Exception] = None
+
+    def __len__(self):
+        return len(self._ready)
+
+    def _add_ready(self, proxy: str):
+        if proxy in self._ready_idx:
+            return
+        self._ready_idx[proxy] = len(self._ready)
+        self._ready.append(proxy)
+        self._ready_event.set()
+
+    def _remove_ready(self, proxy: str):
+        idx = self._ready_idx.pop(proxy, None)
+        if idx is None:
+            return
+        last = self._ready.pop()
+        if last != proxy:
+            self._ready[idx] = last
+            self._ready_idx[last] = idx
+        if not self._ready:
+            self._ready_event.clear()
+
+    def start(self):
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.ensure_future(self._refill_loop())
+
+    async def close(self):
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+
+    async def _fetch_one(self):
+        try:
+            proxy = await self.provider.get_proxy()
+        except Exception as e:
+            self._fetch_fails += 1
+            self._last_fetch_error = e
+            self.logger.error(f"fetch proxy failed: {e.__repr__()}")
+            return
+        self._fetch_fails = 0
+        if not proxy or proxy in self._evicted or proxy in self._quarantined:
+            return
+        if proxy not in self._stats:
+            self._stats[proxy] = _ProxyStat(proxy)
+        self._add_ready(proxy)
+
+    async def _refill_loop(self):
+        while True:
+            now = monotonic()
+            for proxy, stat in list(self._quarantined.items()):
+                if stat.quarantined_until <= now:
+                    del self._quarantined[proxy]
+                    stat.consecutive_fails = 0
+                    self._add_ready(proxy)
+            lack = self.size - len(self._ready)
+            if lack > 0:
+                await asyncio.gather(*[self._fetch_one() for _ in range(min(lack, self.prefetch_concurrency))])
+                if self.size > len(self._ready) > self.size - lack:
+                    # 有进展就继续补充, 否则(provider暂时给不出新代理)等下一轮
+                    continue
+            await asyncio.sleep(self.refill_interval)
+
+    def _pick(self) -> str:
+        # 随机两选一: O(1) 且大概率避开得分低的代理
+        first = random.choice(self._ready)
+        if len(self._ready) == 1:
+            return first
+        second = random.choice(self._ready)
+        latencies = [s.ewma_latency for s in (self._stats[first], self._stats[second]) if s.ewma_latency is not None]
+        default_latency = sum(latencies) / len(latencies) if latencies else 1.0
+        if self._stats[second].score(default_latency) > self._stats[first].score(default_latency):
+            return second
+        return first
+
+    async def get_proxy(self, pin=None) -> str:
+        """
+        :param pin: 相同的 pin 在代理可用期间总是得到同一个代理
+        """
+        if pin is not None:
+            proxy = self._pins.get(pin)
+            if proxy is not None and proxy in self._ready_idx:
+                return proxy
+        self.start()
+        deadline = monotonic() + self.get_timeout if self.get_timeout else None
+        while not self._ready:
+            if deadline is None:
+                await self._ready_event.wait()
+                continue
+            try:
+                await asyncio.wait_for(self._ready_event.wait(), max(deadline - monotonic(), 0))
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"no proxy available after {self.get_timeout}s: {len(self._quarantined)} quarantined, "
+                                   f"{len(self._evicted)} evicted, {self._fetch_fails} consecutive fetch failures, "
+                                   f"last error: {self._last_fetch_error!r}") from None
+        proxy = self._pick()
+        if pin is not None:
+            self._pins[pin] = proxy
+        return proxy
+
+    def report(self, proxy: str, ok: bool, latency: float = None):
+        stat = self._stats.get(proxy)
+        if stat is None:
+            return
+        if latency is not None:
+            if stat.ewma_latency is None:
+                stat.ewma_latency = latency
+            else:
+                stat.ewma_latency += self.latency_alpha * (latency - stat.ewma_latency)
+        if ok:
+            stat.succ += 1
+            stat.consecutive_fails = 0
+            return
+        stat.fail += 1
+        stat.consecutive_fails += 1
+        too_many_fails = stat.consecutive_fails >= self.max_consecutive_fails
+        low_rate = stat.succ + stat.fail >= self.min_samples and stat.success_rate < self.min_success_rate
+        if (too_many_fails or low_rate) and proxy in self._ready_idx:
+            self._quarantine(stat)
+
+    def _quarantine(self, stat: _ProxyStat):
+        self._remove_ready(stat.proxy)
+        stat.quarantined_times += 1
+        if stat.quarantined_times >= self.max_quarantined_times:
+            self._evicted.add(stat.proxy)
+            del self._stats[stat.proxy]
+            self.logger.info(f"evict proxy {stat.proxy}, success rate: {stat.success_rate:.2%}")
+            return
+        stat.quarantined_until = monotonic() + self.quarantine_seconds
+        # 隔离结束后按新代理重新统计成功率
+        stat.succ = stat.fail = 0
+        self._quarantined[stat.proxy] = stat
+        self.logger.info(f"quarantine proxy {stat.proxy} for {self.quarantine_seconds}s")
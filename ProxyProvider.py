@@ -11,3 +11,11 @@ class ProxyProvider(ABC):
         """
         ...
 
+    def report(self, proxy: str, ok: bool, latency: float = None):
+        """
+        Grabber 回报使用该代理的请求结果, 默认忽略
+        :param proxy: get_proxy 返回的代理
+        :param ok: 请求是否成功(目标站点返回的普通4xx/5xx不算代理的失败)
+        :param latency: 请求耗时(秒)
+        """
+        pass
@@ -0,0 +1,254 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 19:20
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from time import time
+from typing import Optional, Dict, Tuple
+
+from multidict import CIMultiDict
+
+# 可以缓存的状态码(RFC 7231 默认可缓存的状态码中的常用部分)
+cacheable_status = {200, 203, 300, 301, 308, 404, 410}
+
+
+def parse_cache_control(value: str) -> Dict[str, Optional[str]]:
+    directives = dict()
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+
+def parse_vary(value: str) -> Tuple[str, ...]:
+    return tuple(sorted({name.strip().lower() for name in (value or "").split(",") if name.strip()}))
+
+
+def _parse_http_date(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class CacheEntry:
+    """
+    缓存的一条响应; vary 为响应 Vary 头列出的请求头名(小写), 不为空时同一url按这些请求头的值分别缓存
+    """
+    __slots__ = ("url", "status", "headers", "body", "stored_at", "expires_at", "vary")
+
+    def __init__(self, url: str, status: int, headers: CIMultiDict, body: bytes, stored_at: float, expires_at: float,
+                 vary: Tuple[str, ...] = ()):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.vary = tuple(vary)
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(k) + len(v) for k, v in self.headers.items())
+
+    @property
+    def etag(self) -> Optional[str]:
+        return self.headers.get("ETag")
+
+    @property
+    def last_modified(self) -> Optional[str]:
+        return self.headers.get("Last-Modified")
+
+    def is_fresh(self) -> bool:
+        return time() < self.expires_at
+
+    def can_revalidate(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+    def refresh(self, headers, default_ttl: float = 0):
+        """
+        304后用新的响应头更新过期时间
+        """
+        self.headers.update(headers)
+        self.stored_at = time()
+        self.expires_at = freshness_deadline(self.headers, self.stored_at, default_ttl)
+
+    @property
+    def is_vary_marker(self) -> bool:
+        return self.status == 0
+
+    @classmethod
+    def vary_marker(cls, url: str, vary: Tuple[str, ...]) -> "CacheEntry":
+        """
+        存放在url对应的键上, 只记录 Vary 的请求头名, 各个变体存放在包含请求头值的键上
+        """
+        return cls(url, 0, CIMultiDict(), b"", 0, 0, vary)
+
+    @classmethod
+    def from_response(cls, url: str, status: int, headers, body: bytes, default_ttl: float = 0) -> Optional["CacheEntry"]:
+        """
+        :return: 响应不允许缓存时返回None
+        """
+        headers = CIMultiDict(headers)
+        if status not in cacheable_status or "no-store" in parse_cache_control(headers.get("Cache-Control")):
+            return None
+        vary = parse_vary(headers.get("Vary"))
+        if "*" in vary:
+            # 响应随请求的任意部分变化, 无法复用
+            return None
+        stored_at = time()
+        entry = cls(url, status, headers, body, stored_at, freshness_deadline(headers, stored_at, default_ttl), vary)
+        if not entry.is_fresh() and not entry.can_revalidate():
+            # 既不新鲜也无法条件请求, 缓存没有意义
+            return None
+        return entry
+
+
+def freshness_deadline(headers: CIMultiDict, stored_at: float, default_ttl: float = 0) -> float:
+    directives = parse_cache_control(headers.get("Cache-Control"))
+    if "no-cache" in directives:
+        return stored_at
+    for name in ("s-maxage", "max-age"):
+        if (directives.get(name) or "").isdigit():
+            return stored_at + int(directives[name])
+    if "Expires" in headers:
+        expires = _parse_http_date(headers["Expires"])
+        date = _parse_http_date(headers.get("Date", "")) or stored_at
+        return stored_at + max(expires - date, 0) if expires else stored_at
+    return stored_at + default_ttl
+
+
+class CachedResponse:
+    """
+    缓存模式下 Grabber 返回的响应, 响应体已经读入内存, 提供与 aiohttp.ClientResponse 相近的读取接口
+    """
+
+    def __init__(self, entry: CacheEntry, from_cache: bool = False):
+        self.url = entry.url
+        self.status = entry.status
+        self.headers = entry.headers
+        self.from_cache = from_cache
+        self._body = entry.body
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    @property
+    def charset(self) -> Optional[str]:
+        content_type = self.headers.get("Content-Type", "")
+        for part in content_type.split(";")[1:]:
+            name, _, value = part.strip().partition("=")
+            if name.lower() == "charset":
+                return value.strip('"')
+        return None
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def text(self, encoding: str = None, errors: str = "strict") -> str:
+        return self._body.decode(encoding or self.charset or "utf-8", errors)
+
+    async def json(self, encoding: str = None, loads=json.loads):
+        return loads(await self.text(encoding))
+
+    def release(self):
+        pass
+
+
+class ResponseCache(ABC):
+    """
+    响应缓存, key 由 Grabber 根据请求方法、url 和 Vary 列出的请求头的值生成
+    """
+    # 过期时间缺失时的默认保鲜秒数
+    default_ttl: float = 0
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[CacheEntry]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, entry: CacheEntry):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+
+class MemoryResponseCache(ResponseCache):
+    """
+    内存LRU缓存, 按字节数和条目数淘汰
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entries: int = 10000, default_ttl: float = 0):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.bytes = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        # 写入时的字节数, 条目被原地修改(如304后更新响应头)后仍按写入时的大小扣除
+        self._sizes: Dict[str, int] = dict()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, entry: CacheEntry):
+        self.delete(key)
+        size = entry.size
+        if size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._sizes[key] = size
+        self.bytes += size
+        while self.bytes > self.max_bytes or len(self._entries) > self.max_entries:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self.bytes -= self._sizes.pop(evicted_key)
+
+    def delete(self, key: str):
+        if self._entries.pop(key, None) is not None:
+            self.bytes -= self._sizes.pop(key)
+
+
+class DiskResponseCache(ResponseCache):
+    """
+    磁盘缓存, 每条响应一个文件, 写入临时文件后原子替换
+    """
+
+    def __init__(self, path: str, default_ttl: float = 0):
+        self.path = path
+        self.default_ttl = default_ttl
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        try:
+            with open(self._file(key), "rb") as f:
+                url, status, headers, body, stored_at, expires_at, vary = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+        return CacheEntry(url, status, headers, body, stored_at, expires_at, vary)
+
+    def set(self, key: str, entry: CacheEntry):
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((entry.url, entry.status, entry.headers, entry.body, entry.stored_at, entry.expires_at,
+                         entry.vary), f)
+        os.replace(tmp_path, self._file(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
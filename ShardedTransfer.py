@@ -0,0 +1,216 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 21:30
+import asyncio
+import multiprocessing
+import queue as queue_mod
+from time import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from iotoolkit.Packs.Base import BaseGetter, BaseParallelGetter, BaseWriter
+from iotoolkit.Transfer import Transfer
+from iotoolkit.util import LogKit, FuncSet, CheckpointStore
+
+# 在子进程中创建 getter/writer 的工厂: async def factory(resume_from: dict) -> (getter, writer),
+# 需要把 resume_from 传给 new_getter, 且必须是可以pickle的模块级函数(或其 functools.partial)
+JobFactory = Callable[[Optional[dict]], Awaitable[Tuple[BaseGetter, BaseWriter]]]
+
+
+class _QueueCheckpointStore(CheckpointStore):
+    """
+    子进程中的断点存储: 把每次提交的断点发给父进程, 由父进程汇总进度并在重试时使用
+    """
+
+    def __init__(self, queue, shard_id: int):
+        self.queue = queue
+        self.shard_id = shard_id
+
+    def load(self, key: str) -> Optional[dict]:
+        return None
+
+    def save(self, key: str, state: dict):
+        self.queue.put(("state", self.shard_id, state))
+
+    def clear(self, key: str):
+        pass
+
+
+async def _close_job(getter, writer):
+    if isinstance(getter, BaseParallelGetter):
+        await getter.close()
+    # 需要关闭的 writer(如 FileWriter) 提供 close
+    close = getattr(writer, "close", None)
+    if close is not None:
+        await close()
+
+
+async def _run_shard(factory: JobFactory, shard_id: int, state: dict, queue, prefetch: int, concurrency: int):
+    getter, writer = await factory(state)
+    # 总数由父进程统计, 子进程跳过计数, 进度日志中总数显示为"?"
+    getter.total_cnt = -1
+    store = _QueueCheckpointStore(queue, shard_id)
+    try:
+        written = await Transfer(getter, writer, prefetch=prefetch, concurrency=concurrency,
+                                 checkpoint_store=store, checkpoint_key=f"shard-{shard_id}").run()
+    finally:
+        await _close_job(getter, writer)
+    queue.put(("done", shard_id, written))
+
+
+def _shard_main(factory: JobFactory, shard_id: int, state: dict, queue, prefetch: int, concurrency: int):
+    asyncio.run(_run_shard(factory, shard_id, state, queue, prefetch, concurrency))
+
+
+class ShardedTransfer(LogKit):
+    """
+    多进程分片搬运: 父进程用工厂创建一次分区读取器(BaseParallelGetter, 如 MySQL 的 split_column、ES 的 slices、
+    Mongo 的 _id 范围)划分分区, 把分区轮流分给 shards 个子进程; 每个子进程用同一个工厂建立自己的连接,
+    以断点的形式只读取分到的分区, 用 Transfer 搬运.
+    子进程提交的断点汇总到父进程, 用于合并进度/剩余时间; 某个分片异常退出时只从它最近的断点重启该分片.
+    """
+
+    def __init__(self, factory: JobFactory, shards: int = None, max_retries: int = 2, prefetch: int = 4,
+                 concurrency: int = 2, checkpoint_store: CheckpointStore = None, checkpoint_key: str = "",
+                 report_interval: float = 5.0):
+        """
+        :param factory: async def factory(resume_from) -> (getter, writer), 见 JobFactory
+        :param shards: 子进程数, 默认为CPU核数
+        :param max_retries: 每个分片异常退出后的最多重试次数
+        :param prefetch: 子进程中 Transfer 的预读批次数
+        :param concurrency: 子进程中 Transfer 的并发写入数
+        :param checkpoint_store: 指定时保存所有分片的断点, 整个任务中断后可以从断点继续
+        :param checkpoint_key: 断点在存储中的key
+        :param report_interval: 汇总进度日志的间隔秒数
+        """
+        if checkpoint_store is not None and not checkpoint_key:
+            raise ValueError("checkpoint key must be specified.")
+        self.factory = factory
+        self.shards = shards or multiprocessing.cpu_count()
+        self.max_retries = max_retries
+        self.prefetch = prefetch
+        self.concurrency = concurrency
+        self.checkpoint_store = checkpoint_store
+        self.checkpoint_key = checkpoint_key
+        self.report_interval = report_interval
+        self.total_cnt = 0
+        self.src_name = ""
+        # 每个分片最近提交的断点
+        self.states: Dict[int, dict] = dict()
+        self.finished = set()
+        self.retries: Dict[int, int] = dict()
+        self._ctx = multiprocessing.get_context("spawn")
+
+    async def _plan(self) -> Dict[int, dict]:
+        getter, writer = await self.factory(None)
+        try:
+            if not isinstance(getter, BaseParallelGetter):
+                raise ValueError("factory must create a partitioned getter (BaseParallelGetter) for sharding.")
+            self.src_name = getter.src_name
+            self.total_cnt = await getter.get_total_count()
+            saved = self.checkpoint_store.load(self.checkpoint_key) if self.checkpoint_store else None
+            if saved:
+                self.finished = set(saved["finished"])
+                self.logger.info(f"resume {len(saved['shards'])} shards of {self.src_name}")
+                return {int(k): v for k, v in saved["shards"].items()}
+            plans = await getter.plan_partitions(self.shards)
+            self.logger.info(f"split {self.src_name} into {sum(len(p['specs']) for p in plans)} partitions "
+                             f"over {len(plans)} shards")
+            return {shard_id: {"done_cnt": 0, "written": 0, "position": position} for shard_id, position in enumerate(plans)}
+        finally:
+            # 父进程只用来划分分区, 用完立即释放连接/文件
+            await _close_job(getter, writer)
+
+    def _spawn(self, shard_id: int, queue) -> multiprocessing.Process:
+        proc = self._ctx.Process(target=_shard_main, name=f"shard-{shard_id}",
+                                 args=(self.factory, shard_id, self.states[shard_id], queue,
+                                       self.prefetch, self.concurrency))
+        proc.start()
+        return proc
+
+    def _save(self):
+        if self.checkpoint_store is not None:
+            self.checkpoint_store.save(self.checkpoint_key, {"shards": {str(k): v for k, v in self.states.items()},
+                                                             "finished": sorted(self.finished)})
+
+    def progress(self) -> Tuple[int, int]:
+        """
+        :return: 所有分片已确认的 (读取数, 写入数)
+        """
+        return (sum(s.get("done_cnt", 0) for s in self.states.values()),
+                sum(s.get("written", 0) for s in self.states.values()))
+
+    def _report(self, start_ts: float, start_done: int):
+        done, written = self.progress()
+        cost = time() - start_ts
+        speed = (done - start_done) / cost if cost > 0 else 0
+        if self.total_cnt > 0 and speed > 0:
+            rate_str = "%.2f" % (done * 100 / self.total_cnt)
+            left_str = FuncSet.x2humansTime(max(self.total_cnt - done, 0) / speed)
+        else:
+            rate_str, left_str = "-", "unknown"
+        self.logger.info(f"src: {self.src_name} | shards: {len(self.states) - len(self.finished)} running | "
+                         f"progress: {done}/{self.total_cnt or '?'}, {rate_str}% | written: {written} | left: {left_str}")
+
+    def _drain(self, queue, timeout: float) -> bool:
+        """
+        处理子进程发来的消息, 返回是否有分片完成
+        """
+        changed = False
+        try:
+            kind, shard_id, payload = queue.get(timeout=timeout)
+            while True:
+                if kind == "state":
+                    self.states[shard_id] = payload
+                    changed = True
+                elif kind == "done":
+                    self.finished.add(shard_id)
+                    self.states[shard_id]["written"] = payload
+                    changed = True
+                kind, shard_id, payload = queue.get_nowait()
+        except queue_mod.Empty:
+            pass
+        if changed:
+            self._save()
+        return changed
+
+    async def run(self) -> int:
+        """
+        :return: 写入总数
+        """
+        start_ts = time()
+        self.states = await self._plan()
+        start_done = self.progress()[0]
+        queue = self._ctx.Queue()
+        procs = {shard_id: self._spawn(shard_id, queue) for shard_id in self.states if shard_id not in self.finished}
+        loop = asyncio.get_event_loop()
+        last_report_ts = time()
+        try:
+            while procs:
+                await loop.run_in_executor(None, self._drain, queue, 0.5)
+                for shard_id, proc in list(procs.items()):
+                    if proc.is_alive():
+                        continue
+                    proc.join()
+                    # 退出前发出的消息可能还在队列中
+                    self._drain(queue, 0)
+                    del procs[shard_id]
+                    if shard_id in self.finished:
+                        continue
+                    retries = self.retries.get(shard_id, 0)
+                    if retries >= self.max_retries:
+                        raise RuntimeError(f"shard {shard_id} failed after {retries} retries, exitcode {proc.exitcode}")
+                    self.retries[shard_id] = retries + 1
+                    self.logger.error(f"shard {shard_id} exited with code {proc.exitcode}, "
+                                      f"retry({retries + 1}) from {self.states[shard_id].get('done_cnt', 0)}")
+                    procs[shard_id] = self._spawn(shard_id, queue)
+                if time() - last_report_ts >= self.report_interval:
+                    last_report_ts = time()
+                    self._report(start_ts, start_done)
+        finally:
+            for proc in procs.values():
+                proc.terminate()
+                proc.join()
+        self._report(start_ts, start_done)
+        done, written = self.progress()
+        self.logger.info(f"finished report | src: {self.src_name} | shards: {len(self.states)} | total: {done} | "
+                         f"written: {written} | cost: {FuncSet.x2humansTime(time() - start_ts)}")
+        return written
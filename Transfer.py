@@ -0,0 +1,158 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 10:12
+import asyncio
+from time import time
+
+from iotoolkit.Packs.Base import BaseGetter, BaseWriter
+from iotoolkit.Transform import Pipeline
+from iotoolkit.util import LogKit, FuncSet, CheckpointStore
+
+
+class Transfer(LogKit):
+    """
+    流水线式搬运: getter 预读 prefetch 个批次放入有界队列, 同时 concurrency 个写入协程并发消费,
+    使读与写相互重叠, 整体速度取决于较慢的一侧而不是两侧之和.
+    注意: concurrency > 1 时批次写入顺序不保证与读取顺序一致.
+    指定 checkpoint_store 时, 只有某个批次及其之前的所有批次都写入成功, 才会把该批次的断点保存下来;
+    保存在线程池中执行, 最多每 checkpoint_interval 秒一次, 结束时保存最后的断点.
+    某个批次写入出错(write 返回None)后断点停在它之前, 记录一次警告, 之后的批次照常写入但不再提交断点.
+    """
+    _stop = object()
+
+    def __init__(self, getter: BaseGetter, writer: BaseWriter, prefetch: int = 4, concurrency: int = 2,
+                 checkpoint_store: CheckpointStore = None, checkpoint_key: str = "", transform: Pipeline = None,
+                 push_down: bool = True, checkpoint_interval: float = 1.0):
+        """
+        :param getter: 数据读取器, 续传时使用 new_getter(..., resume_from=checkpoint_store.load(checkpoint_key)) 创建
+        :param writer: 数据写入器
+        :param prefetch: 预读批次数(队列容量)
+        :param concurrency: 并发写入协程数
+        :param checkpoint_store: 断点存储
+        :param checkpoint_key: 断点在存储中的key
+        :param transform: 写入前对每个批次执行的转换
+        :param push_down: 是否把 transform 需要的字段下推到 getter, 只读取这些字段
+        :param checkpoint_interval: 保存断点的最小间隔秒数, 0 表示每个批次都保存
+        """
+        if prefetch < 1 or concurrency < 1:
+            raise ValueError("prefetch and concurrency must be greater than 0!")
+        if checkpoint_store is not None and not checkpoint_key:
+            raise ValueError("checkpoint key must be specified.")
+        self.getter = getter
+        self.writer = writer
+        self.prefetch = prefetch
+        self.concurrency = concurrency
+        self.batches = 0
+        self.checkpoint_store = checkpoint_store
+        self.checkpoint_key = checkpoint_key
+        # 批次序号, 已提交断点的最大连续序号, 以及已写完但还不能提交的批次
+        self._seq = 0
+        self._committed_seq = 0
+        self._completed = dict()
+        # 第一个写入出错的批次序号, 断点无法越过它
+        self._stalled_seq = None
+        self.checkpoint_interval = checkpoint_interval
+        # 已确认但还没保存的断点, 以及正在保存的任务
+        self._pending_state = None
+        self._last_save_ts = 0.0
+        self._save_task: asyncio.Future = None
+        if getter.resumed_from:
+            writer.written = getter.resumed_from.get("written", writer.written)
+        self._committed_written = writer.written
+        self.transform = transform
+        if transform is not None and push_down:
+            fields = transform.required_fields()
+            if fields and getter.push_down_projection(fields):
+                self.logger.info(f"push down projection to {getter.src_name}: {fields}")
+
+    async def _produce(self, queue: asyncio.Queue):
+        try:
+            async for lst in self.getter:
+                self._seq += 1
+                state = self.getter.checkpoint_state() if self.checkpoint_store is not None else None
+                await queue.put((self._seq, lst, state))
+        finally:
+            for _ in range(self.concurrency):
+                await queue.put(self._stop)
+
+    async def _consume(self, queue: asyncio.Queue):
+        while True:
+            item = await queue.get()
+            if item is self._stop:
+                break
+            seq, lst, state = item
+            if self.transform is not None:
+                lst = self.transform(lst)
+            # 整批被过滤掉时不调用写入, 但仍要确认该批次, 断点才能继续前进
+            failures = await self.writer.write(lst) if lst else []
+            self.batches += 1
+            if self.checkpoint_store is None:
+                continue
+            if failures is None:
+                # write 出错时返回None, 该批次不确认, 断点停留在它之前
+                self._stall(seq)
+            elif self._stalled_seq is None or seq < self._stalled_seq:
+                self._completed[seq] = (state, len(lst) - len(failures))
+                self._commit()
+
+    def _stall(self, seq: int):
+        if self._stalled_seq is not None and seq > self._stalled_seq:
+            return
+        if self._stalled_seq is None:
+            self.logger.warning(f"batch {seq} of {self.getter.src_name} failed to write, checkpoint of "
+                                f"{self.checkpoint_key} stops before it and later batches will not be committed")
+        self._stalled_seq = seq
+        # 缺口之后的批次永远无法提交, 不再保留
+        for later in [s for s in self._completed if s > seq]:
+            del self._completed[later]
+
+    def _commit(self):
+        state = None
+        while self._committed_seq + 1 in self._completed:
+            self._committed_seq += 1
+            state, written = self._completed.pop(self._committed_seq)
+            self._committed_written += written
+        if state is None:
+            return
+        self._pending_state = dict(state, written=self._committed_written)
+        # 同一时刻只有一个保存任务, 保证断点按顺序落盘
+        if time() - self._last_save_ts >= self.checkpoint_interval and \
+                (self._save_task is None or self._save_task.done()):
+            self._save_task = asyncio.ensure_future(self._save())
+
+    async def _save(self):
+        state, self._pending_state = self._pending_state, None
+        self._last_save_ts = time()
+        # 文件存储会 fsync, 不能阻塞事件循环
+        await asyncio.get_event_loop().run_in_executor(None, self.checkpoint_store.save, self.checkpoint_key, state)
+
+    async def _flush_checkpoint(self):
+        if self._save_task is not None:
+            await self._save_task
+            self._save_task = None
+        if self._pending_state is not None:
+            await self._save()
+
+    async def run(self) -> int:
+        """
+        执行搬运直至 getter 耗尽
+        :return: 写入总数
+        """
+        start_ts = time()
+        queue = asyncio.Queue(maxsize=self.prefetch)
+        tasks = [asyncio.ensure_future(self._produce(queue))]
+        tasks += [asyncio.ensure_future(self._consume(queue)) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # 任一环节异常时取消其余协程, 避免悬挂
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # 异常退出时也保存已经确认的进度
+            if self.checkpoint_store is not None:
+                await self._flush_checkpoint()
+        self.logger.info("finished report | src: {} | dst: {} | batches: {} | written: {} | cost: {}".format(
+            self.getter.src_name, self.writer.dst_name, self.batches, self.writer.written,
+            FuncSet.x2humansTime(time() - start_ts)))
+        return self.writer.written
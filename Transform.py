@@ -0,0 +1,274 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 22:10
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Union
+
+from iotoolkit.util import ColumnBatch
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Cast 支持的类型名
+cast_types = {"int": int, "float": float, "str": str, "bool": bool}
+
+
+class Stage:
+    """
+    转换阶段: 每个批次调用一次, 输入输出都是 List[dict].
+    vectorized 为 True 的阶段接收按列组织的数据 {字段: 列}, 由 Pipeline 负责行列转换
+    """
+    vectorized = False
+
+    def __call__(self, lst: List[dict]) -> List[dict]:
+        raise NotImplementedError
+
+    def apply_columns(self, columns: Dict[str, Any], size: int) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def input_fields(self, output_fields: Optional[Set[str]]) -> Optional[Set[str]]:
+        """
+        下游需要 output_fields 时, 本阶段需要的输入字段; None 表示需要全部字段(无法下推)
+        """
+        return output_fields
+
+
+class Select(Stage):
+    """
+    只保留指定字段, 缺失的字段为None
+    """
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = tuple(fields)
+
+    def __call__(self, lst):
+        fields = self.fields
+        return [{k: row.get(k) for k in fields} for row in lst]
+
+    def input_fields(self, output_fields):
+        if output_fields is None:
+            return set(self.fields)
+        return set(self.fields) & output_fields
+
+
+class Rename(Stage):
+    """
+    字段改名 {旧名: 新名}
+    """
+
+    def __init__(self, mapping: Dict[str, str]):
+        self.mapping = dict(mapping)
+        self._reverse = {v: k for k, v in self.mapping.items()}
+
+    def __call__(self, lst):
+        mapping = self.mapping
+        return [{mapping.get(k, k): v for k, v in row.items()} for row in lst]
+
+    def input_fields(self, output_fields):
+        if output_fields is None:
+            return None
+        return {self._reverse.get(f, f) for f in output_fields if f not in self.mapping or f in self._reverse}
+
+
+class Cast(Stage):
+    """
+    字段类型转换 {字段: 类型名(int/float/str/bool) 或 可调用对象}, None 值保持不变
+    """
+
+    def __init__(self, mapping: Dict[str, Union[str, Callable]], errors: str = "raise"):
+        """
+        :param errors: 转换失败时 raise(抛出异常) 或 null(置为None)
+        """
+        if errors not in ("raise", "null"):
+            raise ValueError("errors must be one of ['raise', 'null']")
+        self.mapping = {k: cast_types[v] if isinstance(v, str) else v for k, v in mapping.items()}
+        self.errors = errors
+
+    def _convert(self, func: Callable, value: Any):
+        if value is None:
+            return None
+        try:
+            return func(value)
+        except (TypeError, ValueError):
+            if self.errors == "raise":
+                raise
+            return None
+
+    def __call__(self, lst):
+        items = [(k, func) for k, func in self.mapping.items()]
+        convert = self._convert
+        for row in lst:
+            for k, func in items:
+                if k in row:
+                    row[k] = convert(func, row[k])
+        return lst
+
+
+class Filter(Stage):
+    """
+    过滤行: predicate(row) -> bool; vectorized 时 predicate(columns) -> 与批次等长的布尔序列
+    """
+
+    def __init__(self, predicate: Callable, vectorized: bool = False, fields: Iterable[str] = None):
+        """
+        :param fields: predicate 用到的字段, 指定后才能做字段下推
+        """
+        self.predicate = predicate
+        self.vectorized = vectorized
+        self.fields = set(fields) if fields is not None else None
+
+    def __call__(self, lst):
+        predicate = self.predicate
+        return [row for row in lst if predicate(row)]
+
+    def apply_columns(self, columns, size):
+        mask = self.predicate(columns)
+        if numpy is not None and isinstance(mask, numpy.ndarray):
+            return {k: numpy.asarray(col)[mask] for k, col in columns.items()}
+        return {k: [v for v, keep in zip(col, mask) if keep] for k, col in columns.items()}
+
+    def input_fields(self, output_fields):
+        if output_fields is None or self.fields is None:
+            return None
+        return output_fields | self.fields
+
+
+class Derive(Stage):
+    """
+    新增/覆盖字段: func(row) -> 值; vectorized 时 func(columns) -> 与批次等长的列
+    """
+
+    def __init__(self, field: str, func: Callable, vectorized: bool = False, inputs: Iterable[str] = None):
+        """
+        :param inputs: func 用到的字段, 指定后才能做字段下推
+        """
+        self.field = field
+        self.func = func
+        self.vectorized = vectorized
+        self.inputs = set(inputs) if inputs is not None else None
+
+    def __call__(self, lst):
+        field, func = self.field, self.func
+        for row in lst:
+            row[field] = func(row)
+        return lst
+
+    def apply_columns(self, columns, size):
+        columns[self.field] = self.func(columns)
+        return columns
+
+    def input_fields(self, output_fields):
+        if output_fields is None or self.inputs is None:
+            return None
+        return (output_fields - {self.field}) | self.inputs
+
+
+class Map(Stage):
+    """
+    自定义的整批转换 func(lst) -> lst
+    """
+
+    def __init__(self, func: Callable[[List[dict]], List[dict]], fields: Iterable[str] = None):
+        """
+        :param fields: func 用到的字段, 指定后才能做字段下推
+        """
+        self.func = func
+        self.fields = set(fields) if fields is not None else None
+
+    def __call__(self, lst):
+        return self.func(lst)
+
+    def input_fields(self, output_fields):
+        if output_fields is None or self.fields is None:
+            return None
+        return output_fields | self.fields
+
+
+class Pipeline:
+    """
+    由多个阶段组成的批次转换, 可以链式构建:
+        pipeline = Pipeline().select(["id", "name", "age"]).cast({"age": "int"}).filter(lambda r: r["age"] >= 18)
+        lst = pipeline(lst)
+    backend 为 numpy 时, 连续的 vectorized 阶段共用一次行转列, 列为 numpy 数组, 否则为list.
+    输入为 ColumnBatch 时 vectorized 阶段直接使用其中的列, 以 vectorized 阶段结尾时输出也是 ColumnBatch.
+    """
+    backends = ("python", "numpy")
+
+    def __init__(self, stages: List[Stage] = None, backend: str = "python"):
+        if backend not in self.backends:
+            raise ValueError(f"backend must be one of {list(self.backends)}")
+        if backend == "numpy" and numpy is None:
+            raise ImportError("numpy is not installed.")
+        self.stages: List[Stage] = list(stages or [])
+        self.backend = backend
+
+    def add(self, stage: Stage) -> "Pipeline":
+        self.stages.append(stage)
+        return self
+
+    def select(self, fields: Iterable[str]) -> "Pipeline":
+        return self.add(Select(fields))
+
+    def rename(self, mapping: Dict[str, str]) -> "Pipeline":
+        return self.add(Rename(mapping))
+
+    def cast(self, mapping: Dict[str, Union[str, Callable]], errors: str = "raise") -> "Pipeline":
+        return self.add(Cast(mapping, errors=errors))
+
+    def filter(self, predicate: Callable, vectorized: bool = False, fields: Iterable[str] = None) -> "Pipeline":
+        return self.add(Filter(predicate, vectorized=vectorized, fields=fields))
+
+    def derive(self, field: str, func: Callable, vectorized: bool = False, inputs: Iterable[str] = None) -> "Pipeline":
+        return self.add(Derive(field, func, vectorized=vectorized, inputs=inputs))
+
+    def map(self, func: Callable[[List[dict]], List[dict]], fields: Iterable[str] = None) -> "Pipeline":
+        return self.add(Map(func, fields=fields))
+
+    def required_fields(self) -> Optional[List[str]]:
+        """
+        从最后一个阶段往前推导需要从数据源读取的字段, 无法确定时返回None
+        """
+        fields = None
+        for stage in reversed(self.stages):
+            fields = stage.input_fields(fields)
+        return sorted(fields) if fields is not None else None
+
+    def _to_columns(self, lst: Union[List[dict], ColumnBatch]) -> Dict[str, Any]:
+        if isinstance(lst, ColumnBatch):
+            columns = {k: list(col) for k, col in lst.to_columns().items()}
+        else:
+            keys = dict.fromkeys(k for row in lst for k in row)
+            columns = {k: [row.get(k) for row in lst] for k in keys}
+        if self.backend == "numpy":
+            columns = {k: numpy.asarray(col) for k, col in columns.items()}
+        return columns
+
+    @staticmethod
+    def _to_rows(columns: Dict[str, Any], columnar: bool = False) -> Union[List[dict], ColumnBatch]:
+        keys = list(columns)
+        values = [col.tolist() if numpy is not None and isinstance(col, numpy.ndarray) else col
+                  for col in columns.values()]
+        if columnar:
+            return ColumnBatch(keys, values)
+        return [dict(zip(keys, vals)) for vals in zip(*values)]
+
+    def __call__(self, lst: Union[List[dict], ColumnBatch]) -> Union[List[dict], ColumnBatch]:
+        columns = None
+        columnar = isinstance(lst, ColumnBatch)
+        for stage in self.stages:
+            if stage.vectorized:
+                if columns is None:
+                    columns = self._to_columns(lst)
+                columns = stage.apply_columns(columns, len(lst))
+                continue
+            if columns is not None:
+                lst, columns = self._to_rows(columns), None
+            if not lst:
+                return lst
+            if isinstance(lst, ColumnBatch):
+                # 逐行的阶段会修改行, 需要真正的dict
+                lst = lst.to_pylist()
+            lst = stage(lst)
+        if columns is not None:
+            lst = self._to_rows(columns, columnar)
+        return lst
@@ -1,6 +1,11 @@
 import asyncio
 
-from .AsyncJobSchedular import AsyncJobSchedular
+from .AsyncJobSchedular import AsyncJobSchedular, JobResult, cpu_bound, io_bound
 from .Grabber import Grabber
 from .ProxyProvider import ProxyProvider
+from .ProxyPool import ProxyPool
+from .Transform import Pipeline, Stage, Select, Rename, Cast, Filter, Derive, Map
+from .Transfer import Transfer
+from .ShardedTransfer import ShardedTransfer
+from .ResponseCache import ResponseCache, MemoryResponseCache, DiskResponseCache, CachedResponse
 
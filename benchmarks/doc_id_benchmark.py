@@ -0,0 +1,36 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 23:55
+"""
+文档id生成算法的吞吐对比, 不属于库的一部分:
+    python benchmarks/doc_id_benchmark.py
+"""
+from time import perf_counter
+
+from iotoolkit.util.DocId import DocIdStrategy, LegacyDocIdStrategy, orjson, xxhash
+
+
+def benchmark(n: int = 100000, fields: int = 10):
+    """
+    与旧的 md5(str(doc)) 算法对比每秒可处理的文档数
+    """
+    docs = [{f"field_{j}": (i * j if j % 2 else f"value-{i}-{j}") for j in range(fields)} for i in range(n)]
+    candidates = {
+        "md5_str": LegacyDocIdStrategy(),
+        "canonical/json/blake2b": DocIdStrategy(),
+        "canonical/json/md5": DocIdStrategy(algorithm="md5"),
+        "keys/json/blake2b": DocIdStrategy(keys=["field_0", "field_1"]),
+    }
+    if orjson is not None:
+        candidates["canonical/orjson/blake2b"] = DocIdStrategy(serializer="orjson")
+    if xxhash is not None:
+        candidates["canonical/orjson/xxh3_128" if orjson else "canonical/json/xxh3_128"] = \
+            DocIdStrategy(algorithm="xxh3_128", serializer="orjson" if orjson else "json")
+    for name, strategy in candidates.items():
+        start = perf_counter()
+        strategy.ids_for(docs)
+        cost = perf_counter() - start
+        print(f"{name:<28} {n / cost:>12.0f} docs/s")
+
+
+if __name__ == "__main__":
+    benchmark()
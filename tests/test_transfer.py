@@ -0,0 +1,110 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 23:58
+import asyncio
+from contextlib import asynccontextmanager
+
+from iotoolkit import Transfer
+from iotoolkit.Packs.Base import BaseGetter, BaseWriter
+from iotoolkit.Packs.MySqlPack import MySqlWriter
+from iotoolkit.util import FileCheckpointStore
+
+
+class ListGetter(BaseGetter):
+    def __init__(self, rows, batch_size=3):
+        super().__init__(src_name="rows", batch_size=batch_size)
+        self.rows = rows
+        self.pos = 0
+
+    async def _get_total_count(self):
+        self.total_cnt = len(self.rows)
+
+    async def _get_next_lst(self):
+        lst = self.rows[self.pos:self.pos + self.batch_size]
+        self.pos += len(lst)
+        return lst
+
+    def _get_position(self):
+        return self.pos
+
+    def _set_position(self, position):
+        self.pos = position
+
+
+class FakeCursor:
+    def __init__(self, executed):
+        self.executed = executed
+        self.max_stmt_length = 0
+
+    async def execute(self, sql, args=None):
+        pass
+
+    async def fetchone(self):
+        return (4 * 1024 * 1024,)
+
+    async def executemany(self, sql, values_list):
+        self.executed.extend(values_list)
+
+
+class FakeConn:
+    def __init__(self, executed):
+        self.executed = executed
+
+    @asynccontextmanager
+    async def cursor(self, cursor_cls=None):
+        yield FakeCursor(self.executed)
+
+    async def commit(self):
+        pass
+
+
+class FakePool:
+    def __init__(self):
+        self.executed = list()
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield FakeConn(self.executed)
+
+
+class FlakyWriter(BaseWriter):
+    dst_name = "flaky"
+
+    def __init__(self, fail_batch):
+        super().__init__()
+        self.fail_batch = fail_batch
+        self.batches = 0
+
+    async def _handle_lst(self, lst):
+        self.batches += 1
+        if self.batches == self.fail_batch:
+            raise ConnectionError("lost connection")
+
+
+def test_mysql_writer_advances_checkpoint(tmp_path):
+    rows = [{"id": i, "name": f"n{i}"} for i in range(7)]
+    store = FileCheckpointStore(str(tmp_path / "checkpoint.json"))
+    pool = FakePool()
+
+    async def run(resume_from=None):
+        getter = ListGetter(rows)
+        if resume_from:
+            getter.restore(resume_from)
+        writer = MySqlWriter(pool, table="fakers")
+        return await Transfer(getter, writer, concurrency=1, checkpoint_store=store, checkpoint_key="fakers").run()
+
+    assert asyncio.run(run()) == 7
+    state = store.load("fakers")
+    assert state["done_cnt"] == 7 and state["position"] == 7 and state["written"] == 7
+    # 从断点续传时不会重放已写入的数据
+    assert asyncio.run(run(store.load("fakers"))) == 7
+    assert len(pool.executed) == 7
+
+
+def test_failed_batch_stalls_checkpoint(tmp_path):
+    store = FileCheckpointStore(str(tmp_path / "checkpoint.json"))
+    getter = ListGetter(list(range(12)))
+    transfer = Transfer(getter, FlakyWriter(fail_batch=2), concurrency=1, checkpoint_store=store, checkpoint_key="k")
+    asyncio.run(transfer.run())
+    # 断点停在出错的第2个批次之前, 之后的批次不再保留
+    assert store.load("k")["position"] == 3
+    assert transfer._completed == {}
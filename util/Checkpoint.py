@@ -0,0 +1,100 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 16:20
+import json
+import os
+import sqlite3
+import tempfile
+from abc import ABC, abstractmethod
+from time import time
+from typing import Optional
+
+
+class CheckpointStore(ABC):
+    """
+    断点存储: 以 key 区分不同的搬运任务, 每次保存都是原子的, 进程在任意时刻崩溃都不会留下半写的断点
+    """
+
+    @abstractmethod
+    def load(self, key: str) -> Optional[dict]:
+        """
+        :return: 最近一次保存的断点, 不存在时返回None
+        """
+        ...
+
+    @abstractmethod
+    def save(self, key: str, state: dict):
+        ...
+
+    @abstractmethod
+    def clear(self, key: str):
+        ...
+
+
+class FileCheckpointStore(CheckpointStore):
+    """
+    所有断点保存在一个json文件中, 写入临时文件后用 os.replace 原子替换
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _load_all(self) -> dict:
+        if not os.path.exists(self.path):
+            return dict()
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _dump_all(self, states: dict):
+        dir_name = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix=".checkpoint-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(states, f, ensure_ascii=False, default=str)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def load(self, key: str) -> Optional[dict]:
+        return self._load_all().get(key)
+
+    def save(self, key: str, state: dict):
+        states = self._load_all()
+        states[key] = dict(state, updated_at=time())
+        self._dump_all(states)
+
+    def clear(self, key: str):
+        states = self._load_all()
+        if states.pop(key, None) is not None:
+            self._dump_all(states)
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    """
+    断点保存在sqlite中, 每次保存是一个事务
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS checkpoints "
+                               "(key TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)")
+
+    def load(self, key: str) -> Optional[dict]:
+        row = self._conn.execute("SELECT state FROM checkpoints WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, key: str, state: dict):
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO checkpoints (key, state, updated_at) VALUES (?, ?, ?)",
+                               (key, json.dumps(state, ensure_ascii=False, default=str), time()))
+
+    def clear(self, key: str):
+        with self._conn:
+            self._conn.execute("DELETE FROM checkpoints WHERE key = ?", (key,))
+
+    def close(self):
+        self._conn.close()
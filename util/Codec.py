@@ -0,0 +1,164 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 23:50
+import json
+from typing import Any, List, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def to_bytes(data: Union[str, bytes]) -> bytes:
+    return data if isinstance(data, bytes) else data.encode()
+
+
+class Codec:
+    """
+    序列化方式: 一批数据在一次调用中编码/解码, 避免调用方逐条 json.dumps/json.loads.
+    text 为 True 表示编码结果是 json 文本(可以放进 jsonl 文件/ES 的bulk请求),
+    binary 为 True 表示编码结果可能不是合法的 utf-8, redis 需要以 decode_responses=False 读取.
+    """
+    name = ""
+    text = True
+    binary = False
+
+    def encode(self, obj: Any) -> Union[str, bytes]:
+        raise NotImplementedError
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        raise NotImplementedError
+
+    def encode_batch(self, objs: List[Any]) -> List[Union[str, bytes]]:
+        return list(map(self.encode, objs))
+
+    def decode_batch(self, datas: List[Union[str, bytes]]) -> List[Any]:
+        return list(map(self.decode, datas))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}()"
+
+
+class RawCodec(Codec):
+    """
+    不做序列化: str/bytes 原样写入, 其他值写入 str(value); 读取时原样返回
+    """
+    name = "raw"
+    text = False
+
+    def encode(self, obj):
+        return obj if isinstance(obj, (str, bytes)) else str(obj)
+
+    def decode(self, data):
+        return data
+
+    def encode_batch(self, objs):
+        return [obj if isinstance(obj, (str, bytes)) else str(obj) for obj in objs]
+
+    def decode_batch(self, datas):
+        return list(datas)
+
+
+class JsonCodec(Codec):
+    """
+    标准库json, 紧凑分隔符, 非ascii字符不转义, 无法序列化的值写入 str(value)
+    """
+    name = "json"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=str)
+
+    def encode(self, obj):
+        return self._encoder.encode(obj)
+
+    def decode(self, data):
+        return json.loads(data)
+
+    def encode_batch(self, objs):
+        encode = self._encoder.encode
+        return [encode(obj) for obj in objs]
+
+    def decode_batch(self, datas):
+        loads = json.loads
+        return [loads(data) for data in datas]
+
+
+class OrjsonCodec(Codec):
+    """
+    orjson, 编码结果为 utf-8 的bytes, 比标准库json快数倍; 浮点数等格式与json略有不同
+    """
+    name = "orjson"
+    option = 0 if orjson is None else orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed.")
+
+    def encode(self, obj):
+        return orjson.dumps(obj, option=self.option, default=str)
+
+    def decode(self, data):
+        return orjson.loads(data)
+
+    def encode_batch(self, objs):
+        dumps, option = orjson.dumps, self.option
+        return [dumps(obj, option=option, default=str) for obj in objs]
+
+    def decode_batch(self, datas):
+        loads = orjson.loads
+        return [loads(data) for data in datas]
+
+
+class MsgpackCodec(Codec):
+    """
+    msgpack 二进制格式, 体积比json小, 不能用于文本场景
+    """
+    name = "msgpack"
+    text = False
+    binary = True
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("msgpack is not installed.")
+        self._packer = msgpack.Packer(use_bin_type=True, default=str)
+
+    def encode(self, obj):
+        return self._packer.pack(obj)
+
+    def decode(self, data):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+    def encode_batch(self, objs):
+        pack = self._packer.pack
+        return [pack(obj) for obj in objs]
+
+    def decode_batch(self, datas):
+        unpackb = msgpack.unpackb
+        return [unpackb(data, raw=False, strict_map_key=False) for data in datas]
+
+
+codecs = {
+    "raw": RawCodec,
+    "json": JsonCodec,
+    "orjson": OrjsonCodec,
+    "msgpack": MsgpackCodec,
+}
+
+
+def get_codec(codec, text_only: bool = False) -> Codec:
+    """
+    :param codec: Codec 实例, 或 raw/json/orjson/msgpack
+    :param text_only: 只接受编码结果为json文本的序列化方式(如 jsonl 文件, ES)
+    """
+    if not isinstance(codec, Codec):
+        if codec not in codecs:
+            raise ValueError(f"codec must be one of {list(codecs)} or a Codec instance")
+        codec = codecs[codec]()
+    if text_only and not codec.text:
+        raise ValueError(f"codec {codec.name} is not a text codec.")
+    return codec
@@ -0,0 +1,101 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 22:40
+from itertools import repeat
+from typing import Any, Dict, Iterator, List, Sequence
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class ColumnBatch:
+    """
+    按列存储的批次: 一份字段名加每个字段一列, 不再为每一行保存一份键和一个dict.
+    同时表现为只读的 Sequence[dict](迭代/下标时按需生成dict), 只认识 List[dict] 的代码可以照常处理;
+    MySqlWriter 等按列/按元组写入的一方直接使用列数据, 省去 dict -> tuple 的转换.
+    """
+    __slots__ = ("fields", "columns", "_index")
+
+    def __init__(self, fields: Sequence[str], columns: Sequence[Sequence[Any]]):
+        """
+        :param fields: 字段名
+        :param columns: 与 fields 一一对应的列, 各列长度必须相同
+        """
+        if len(fields) != len(columns):
+            raise ValueError("fields and columns must have the same length.")
+        if len({len(col) for col in columns}) > 1:
+            raise ValueError("all columns must have the same length.")
+        self.fields = tuple(fields)
+        self.columns = tuple(columns)
+        self._index = {name: idx for idx, name in enumerate(self.fields)}
+
+    @classmethod
+    def from_rows(cls, fields: Sequence[str], rows: Sequence[tuple]) -> "ColumnBatch":
+        """
+        由元组行构建, 如数据库游标 fetchmany 的结果
+        """
+        if not rows:
+            return cls(fields, [() for _ in fields])
+        return cls(fields, list(zip(*rows)))
+
+    @classmethod
+    def from_dicts(cls, lst: Sequence[dict], fields: Sequence[str] = None) -> "ColumnBatch":
+        """
+        :param fields: 字段名, 默认取所有行出现过的键, 缺失的值为None
+        """
+        if fields is None:
+            fields = list(dict.fromkeys(k for row in lst for k in row))
+        return cls(fields, [tuple(row.get(name) for row in lst) for name in fields])
+
+    @classmethod
+    def from_arrow(cls, table) -> "ColumnBatch":
+        """
+        :param table: pyarrow.Table 或 pyarrow.RecordBatch
+        """
+        return cls(table.schema.names, [col.to_pylist() for col in table.columns])
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def __iter__(self) -> Iterator[dict]:
+        fields = self.fields
+        for values in zip(*self.columns):
+            yield dict(zip(fields, values))
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return ColumnBatch(self.fields, [col[item] for col in self.columns])
+        return {name: col[item] for name, col in zip(self.fields, self.columns)}
+
+    def __repr__(self):
+        return f"ColumnBatch(fields={list(self.fields)}, rows={len(self)})"
+
+    def column(self, name: str) -> Sequence[Any]:
+        return self.columns[self._index[name]]
+
+    def rows(self, fields: Sequence[str] = None) -> Iterator[tuple]:
+        """
+        按 fields 的顺序产出元组行, 不存在的字段为None
+        """
+        if fields is None or tuple(fields) == self.fields:
+            return zip(*self.columns)
+        size = len(self)
+        cols = [self.columns[self._index[name]] if name in self._index else repeat(None, size) for name in fields]
+        return zip(*cols)
+
+    def select(self, fields: Sequence[str]) -> "ColumnBatch":
+        size = len(self)
+        return ColumnBatch(fields, [self.columns[self._index[name]] if name in self._index else (None,) * size
+                                    for name in fields])
+
+    def to_columns(self) -> Dict[str, Sequence[Any]]:
+        return dict(zip(self.fields, self.columns))
+
+    def to_pylist(self) -> List[dict]:
+        return list(self)
+
+    def to_arrow(self):
+        if pyarrow is None:
+            raise ImportError("pyarrow is not installed.")
+        return pyarrow.table({name: list(col) for name, col in zip(self.fields, self.columns)})
@@ -0,0 +1,111 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 19:05
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from time import time
+
+
+class _Window:
+    __slots__ = ("limit", "inflight", "waiters", "last_decrease_ts")
+
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.inflight = 0
+        self.waiters = deque()
+        self.last_decrease_ts = 0.0
+
+
+class AIMDLimiter:
+    """
+    按key(通常为host)的AIMD并发控制:
+        成功且延迟正常时并发上限加性增长(每个窗口约+increase),
+        失败或延迟超过阈值时乘性减小(乘以 decrease), 一个往返时间内最多减小一次, 避免同一波失败把窗口压到底
+    """
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 100, increase: float = 1.0,
+                 decrease: float = 0.5, latency_threshold: float = None):
+        """
+        :param initial: 每个key的初始并发上限
+        :param min_limit: 并发上限的下限
+        :param max_limit: 并发上限的上限
+        :param increase: 每个窗口的加性增量
+        :param decrease: 乘性减小的系数
+        :param latency_threshold: 延迟超过该秒数视为拥塞, 默认只根据失败调整
+        """
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1!")
+        if not 1 <= min_limit <= initial <= max_limit:
+            raise ValueError("limits must satisfy 1 <= min_limit <= initial <= max_limit!")
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_threshold = latency_threshold
+        self._windows = dict()
+
+    def _window(self, key: str) -> _Window:
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = _Window(self.initial)
+        return window
+
+    def limit(self, key: str) -> int:
+        return int(self._window(key).limit)
+
+    def inflight(self, key: str) -> int:
+        return self._window(key).inflight
+
+    async def acquire(self, key: str):
+        window = self._window(key)
+        if window.inflight < int(window.limit) and not window.waiters:
+            window.inflight += 1
+            return
+        fut = asyncio.get_event_loop().create_future()
+        window.waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 名额已经转交给了这个被取消的等待者, 需要归还
+                self.release(key)
+            raise
+
+    def release(self, key: str):
+        window = self._window(key)
+        window.inflight -= 1
+        self._wake(window)
+
+    @staticmethod
+    def _wake(window: _Window):
+        while window.waiters and window.inflight < int(window.limit):
+            fut = window.waiters.popleft()
+            if not fut.done():
+                window.inflight += 1
+                fut.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def feedback(self, key: str, latency: float, ok: bool):
+        """
+        :param key: key
+        :param latency: 本次请求的耗时(秒)
+        :param ok: 请求是否成功
+        """
+        window = self._window(key)
+        congested = not ok or (self.latency_threshold is not None and latency > self.latency_threshold)
+        if congested:
+            now = time()
+            if now - window.last_decrease_ts >= latency:
+                window.limit = max(self.min_limit, window.limit * self.decrease)
+                window.last_decrease_ts = now
+        else:
+            window.limit = min(self.max_limit, window.limit + self.increase / max(window.limit, 1))
+            self._wake(window)
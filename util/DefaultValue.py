@@ -4,7 +4,12 @@
 class DefaultValue:
     getter_batch_size = 10
     mongo_writer_method = "insert"
+    mongo_id_strategy = "md5_str"
     redis_port = 6379
     redis_db = 0
     encoding = "utf-8"
     grab_time_out = 5
+    # 连接数不限(limit=0)时自适应并发的上限
+    grab_max_concurrency = 100
+    # 进度日志的最小间隔秒数, 0 表示每个批次都输出
+    progress_log_interval = 5
@@ -0,0 +1,124 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 14:03
+import asyncio
+import hashlib
+import json
+from concurrent.futures import Executor
+from typing import List, Any, Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+def _json_dumps(doc: Any) -> bytes:
+    return json.dumps(doc, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str).encode()
+
+
+def _orjson_dumps(doc: Any) -> bytes:
+    return orjson.dumps(doc, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str)
+
+
+class DocIdStrategy:
+    """
+    根据文档内容生成稳定的 _id: 规范化序列化(键排序, 紧凑分隔符) + 可配置的哈希算法.
+    注意: 同一份数据要得到相同的 _id, 必须使用相同的 keys/serializer/algorithm.
+    """
+    serializers = {"json": _json_dumps, "orjson": _orjson_dumps}
+    # 同一文档总是得到相同的 _id, 写入方据此把重复键当作已写入
+    deterministic = True
+
+    def __init__(self, algorithm: str = "blake2b", keys: List[str] = None, serializer: str = "json"):
+        """
+        :param algorithm: hashlib 中的算法名, 或安装了 xxhash 时的 xxh64/xxh128/xxh3_64/xxh3_128
+        :param keys: 只用这些字段计算 _id, 默认使用整个文档
+        :param serializer: json 或 orjson(需要安装orjson, 浮点数等格式与json不同, 两者产生的_id不通用)
+        """
+        if serializer not in self.serializers:
+            raise ValueError(f"serializer must be one of {list(self.serializers)}")
+        if serializer == "orjson" and orjson is None:
+            raise ImportError("orjson is not installed.")
+        self.algorithm = algorithm
+        self.keys = keys
+        self.serializer = serializer
+        self._dumps = self.serializers[serializer]
+        self._hash = self._resolve_hash(algorithm)
+
+    @staticmethod
+    def _resolve_hash(algorithm: str) -> Callable[[bytes], str]:
+        if algorithm.startswith("xxh"):
+            if xxhash is None:
+                raise ImportError("xxhash is not installed.")
+            return getattr(xxhash, algorithm + "_hexdigest")
+        if algorithm == "blake2b":
+            # 128位摘要, 与md5的_id长度一致
+            return lambda data: hashlib.blake2b(data, digest_size=16).hexdigest()
+        hashlib.new(algorithm)
+        return lambda data: hashlib.new(algorithm, data).hexdigest()
+
+    def __getstate__(self):
+        # 哈希函数可能是lambda, 进程池传递时按参数重建
+        return dict(algorithm=self.algorithm, keys=self.keys, serializer=self.serializer)
+
+    def __setstate__(self, state):
+        DocIdStrategy.__init__(self, **state)
+
+    def serialize(self, doc: dict) -> bytes:
+        if self.keys:
+            doc = {k: doc.get(k) for k in self.keys}
+        return self._dumps(doc)
+
+    def doc_id(self, doc: dict) -> str:
+        return self._hash(self.serialize(doc))
+
+    def ids_for(self, docs: List[dict]) -> List[Any]:
+        """
+        整批计算 _id, 已有 _id 的文档保持不变
+        """
+        doc_id = self.doc_id
+        return [doc["_id"] if "_id" in doc else doc_id(doc) for doc in docs]
+
+    async def ids_for_async(self, docs: List[dict], executor: Executor = None, offload_threshold: int = 5000) -> List[Any]:
+        """
+        批量大于 offload_threshold 且指定了 executor 时在线程池/进程池中计算, 避免阻塞事件循环
+        """
+        if executor is None or len(docs) < offload_threshold:
+            return self.ids_for(docs)
+        return await asyncio.get_event_loop().run_in_executor(executor, self.ids_for, docs)
+
+
+class LegacyDocIdStrategy(DocIdStrategy):
+    """
+    旧版 md5(str(doc)) 算法, 结果依赖键顺序和repr格式, 仅用于与历史数据保持一致
+    """
+
+    def __init__(self):
+        super().__init__(algorithm="md5")
+
+    def serialize(self, doc: dict) -> bytes:
+        return str(doc).encode()
+
+
+id_strategies = {
+    "md5_str": LegacyDocIdStrategy,
+    "canonical": DocIdStrategy,
+    # 需要安装orjson, 比标准库json的规范化序列化快数倍
+    "fast": lambda: DocIdStrategy(serializer="orjson"),
+}
+
+
+def get_id_strategy(strategy) -> DocIdStrategy:
+    """
+    :param strategy: DocIdStrategy 实例, 或 md5_str/canonical/fast
+    """
+    if isinstance(strategy, DocIdStrategy):
+        return strategy
+    if strategy not in id_strategies:
+        raise ValueError(f"id strategy must be one of {list(id_strategies)} or a DocIdStrategy instance")
+    return id_strategies[strategy]()
@@ -40,4 +40,6 @@ class LogKit:
     def __init_subclass__(cls, **kwargs):
         cls.logger = logging.getLogger(cls.__name__)
         cls.logger.setLevel(cls.LevelNames.DEBUG)
-        cls.logger.addHandler(cls.stream_handler)
+        # 同名的类共用一个logger, 重复添加handler会让每条日志输出多次
+        if cls.stream_handler not in cls.logger.handlers:
+            cls.logger.addHandler(cls.stream_handler)
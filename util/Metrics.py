@@ -0,0 +1,251 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 20:40
+import asyncio
+import json
+from time import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from iotoolkit.util.SuccessRateCounter import LatencyHistogram
+
+
+class Metric:
+    type_name = ""
+
+    def __init__(self, name: str, labels: Dict[str, str], help_text: str = ""):
+        self.name = name
+        self.labels = labels
+        self.help_text = help_text
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """
+        :return: [(样本名, 标签, 值)]
+        """
+        raise NotImplementedError
+
+    def value_of(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    只增不减的计数
+    """
+    type_name = "counter"
+
+    def __init__(self, name: str, labels: Dict[str, str], help_text: str = ""):
+        super().__init__(name, labels, help_text)
+        self.value = 0
+
+    def inc(self, n: float = 1):
+        self.value += n
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+    def value_of(self):
+        return self.value
+
+
+class Gauge(Metric):
+    """
+    可以任意设置的当前值
+    """
+    type_name = "gauge"
+
+    def __init__(self, name: str, labels: Dict[str, str], help_text: str = ""):
+        super().__init__(name, labels, help_text)
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, n: float = 1):
+        self.value += n
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+    def value_of(self):
+        return self.value
+
+
+class Histogram(Metric):
+    """
+    流式分布, 以 summary(p50/p95/p99) 的形式导出
+    """
+    type_name = "summary"
+    quantiles = (0.5, 0.95, 0.99)
+
+    def __init__(self, name: str, labels: Dict[str, str], help_text: str = ""):
+        super().__init__(name, labels, help_text)
+        self.histogram = LatencyHistogram()
+
+    def observe(self, value: float):
+        self.histogram.observe(value)
+
+    def samples(self):
+        result = [(self.name, dict(self.labels, quantile=str(q)), self.histogram.percentile(q * 100))
+                  for q in self.quantiles]
+        result.append((self.name + "_sum", self.labels, self.histogram.sum))
+        result.append((self.name + "_count", self.labels, self.histogram.count))
+        return result
+
+    def value_of(self):
+        return self.histogram.summary()
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                     for k, v in labels.items())
+    return "{" + pairs + "}"
+
+
+class MetricsRegistry:
+    """
+    指标注册表: 同名同标签的指标只创建一次, 更新只是内存中的加法, 导出由 sink 在后台定期完成
+    """
+
+    def __init__(self):
+        self._metrics: Dict[Tuple[str, tuple], Metric] = dict()
+        self._sinks: List[Callable[[dict], None]] = list()
+        self._report_task: Optional[asyncio.Task] = None
+
+    def _get(self, cls, name: str, help_text: str, labels: Dict[str, str]) -> Metric:
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            metric = self._metrics[key] = cls(name, labels, help_text)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"metric {name} is already registered as {metric.type_name}")
+        return metric
+
+    def counter(self, name: str, help_text: str = "", **labels) -> Counter:
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name: str, help_text: str = "", **labels) -> Gauge:
+        return self._get(Gauge, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str = "", **labels) -> Histogram:
+        return self._get(Histogram, name, help_text, labels)
+
+    def snapshot(self) -> dict:
+        """
+        :return: {"ts": 时间戳, "metrics": [{"name", "type", "labels", "value"}]}
+        """
+        return {"ts": time(), "metrics": [
+            {"name": m.name, "type": m.type_name, "labels": m.labels, "value": m.value_of()}
+            for m in self._metrics.values()
+        ]}
+
+    def to_prometheus(self) -> str:
+        """
+        Prometheus 文本格式
+        """
+        lines = list()
+        described = set()
+        # 同名指标的样本必须连续输出
+        for metric in sorted(self._metrics.values(), key=lambda m: m.name):
+            if metric.name not in described:
+                described.add(metric.name)
+                if metric.help_text:
+                    lines.append(f"# HELP {metric.name} {metric.help_text}")
+                lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def add_sink(self, sink: Callable[[dict], None]):
+        """
+        :param sink: 接收 snapshot() 结果的可调用对象, 如 CallbackSink, JsonLinesSink
+        """
+        self._sinks.append(sink)
+
+    def flush(self):
+        if not self._sinks:
+            return
+        snapshot = self.snapshot()
+        for sink in self._sinks:
+            sink(snapshot)
+
+    def start_reporting(self, interval: float = 10.0):
+        """
+        在后台每 interval 秒把快照推送给所有 sink
+        """
+        async def report():
+            while True:
+                await asyncio.sleep(interval)
+                self.flush()
+
+        if self._report_task is None or self._report_task.done():
+            self._report_task = asyncio.ensure_future(report())
+
+    async def stop_reporting(self):
+        if self._report_task is not None:
+            self._report_task.cancel()
+            try:
+                await self._report_task
+            except asyncio.CancelledError:
+                pass
+            self._report_task = None
+        self.flush()
+
+
+class CallbackSink:
+    def __init__(self, callback: Callable[[dict], None]):
+        self.callback = callback
+
+    def __call__(self, snapshot: dict):
+        self.callback(snapshot)
+
+
+class JsonLinesSink:
+    """
+    每次推送追加一行json
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __call__(self, snapshot: dict):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(snapshot, ensure_ascii=False, default=str) + "\n")
+
+
+class PrometheusServer:
+    """
+    提供 Prometheus 拉取的极简http服务, 任意路径都返回 registry 的文本格式
+    """
+
+    def __init__(self, registry: "MetricsRegistry" = None, host: str = "0.0.0.0", port: int = 9464):
+        self.registry = registry or metrics
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            # 只需读完请求头, 不关心请求的路径和方法
+            await reader.readuntil(b"\r\n\r\n")
+            body = self.registry.to_prometheus().encode()
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         b"Content-Length: " + str(len(body)).encode() + b"\r\nConnection: close\r\n\r\n" + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+# 默认的全局注册表, getter/writer/Grabber 的指标都记录在这里
+metrics = MetricsRegistry()
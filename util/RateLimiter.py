@@ -0,0 +1,150 @@
+# @Author : taojinmin
+# @Time : 2026/10/18 19:40
+import asyncio
+from email.utils import parsedate_to_datetime
+from time import monotonic, time
+from typing import Dict, Optional
+
+from iotoolkit.util.SuccessRateCounter import SuccessRateCounter
+
+# 视为被限流的状态码
+throttle_status = (429, 503)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    :param value: Retry-After 响应头, 秒数或HTTP日期
+    :return: 需要等待的秒数, 无法解析时返回None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time(), 0.0)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class _Bucket:
+    __slots__ = ("qps", "burst", "tokens", "last_ts", "factor", "blocked_until", "throttled_times", "counter")
+
+    def __init__(self, qps: float, burst: float, capacity: int):
+        self.qps = qps
+        self.burst = burst
+        self.tokens = burst
+        self.last_ts = monotonic()
+        # 当前速率 = qps * factor, 被限流时减半, 成功时逐步恢复
+        self.factor = 1.0
+        self.blocked_until = 0.0
+        self.throttled_times = 0
+        self.counter = SuccessRateCounter(capacity)
+
+    @property
+    def rate(self) -> float:
+        return self.qps * self.factor
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_ts) * self.rate)
+        self.last_ts = now
+
+
+class TokenBucketLimiter:
+    """
+    按key(通常为host)的令牌桶限速:
+        每个key以 qps 的速率生成令牌, 最多积攒 burst 个, 每个请求消耗一个;
+        收到429/503时按 Retry-After(没有时按指数退避)暂停该key的请求, 并把速率减半,
+        之后该key的成功率(SuccessRateCounter)回到 recover_ratio 以上时, 每次成功逐步恢复.
+    每个key的状态相互独立, 一个被限流的host不会阻塞其他host的请求.
+    """
+
+    def __init__(self, qps: float = 10.0, burst: float = None, rates: Dict[str, float] = None,
+                 backoff_base: float = 1.0, max_backoff: float = 60.0, min_factor: float = 0.05,
+                 recover_step: float = 0.05, recover_ratio: float = 0.9, counter_capacity: int = 100):
+        """
+        :param qps: 每个key默认的每秒请求数
+        :param burst: 令牌桶容量, 默认等于 qps(至少为1)
+        :param rates: 单独指定某些key的qps, 例如 {"api.example.com": 2}
+        :param backoff_base: 没有 Retry-After 时的首次退避秒数, 连续被限流时翻倍
+        :param max_backoff: 退避秒数的上限
+        :param min_factor: 被限流后速率最低降到 qps 的比例
+        :param recover_step: 每次成功后速率比例的恢复量
+        :param recover_ratio: 该key最近的成功率不低于此值时才恢复速率
+        :param counter_capacity: 每个key的成功率统计窗口
+        """
+        if qps <= 0:
+            raise ValueError("qps must be greater than 0!")
+        if not 0 < min_factor <= 1:
+            raise ValueError("min_factor must be between 0 and 1!")
+        self.qps = qps
+        self.burst = burst
+        self.rates = rates or dict()
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.min_factor = min_factor
+        self.recover_step = recover_step
+        self.recover_ratio = recover_ratio
+        self.counter_capacity = counter_capacity
+        self._buckets = dict()
+
+    def _bucket(self, key: str) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            qps = self.rates.get(key, self.qps)
+            burst = self.burst if self.burst is not None else max(qps, 1.0)
+            bucket = self._buckets[key] = _Bucket(qps, burst, self.counter_capacity)
+        return bucket
+
+    def counter(self, key: str) -> SuccessRateCounter:
+        return self._bucket(key).counter
+
+    def rate(self, key: str) -> float:
+        return self._bucket(key).rate
+
+    async def acquire(self, key: str):
+        bucket = self._bucket(key)
+        now = monotonic()
+        bucket.refill(now)
+        # 先预定令牌再等待, 令牌可以为负数, 保证等待者按到达顺序依次放行
+        bucket.tokens -= 1
+        wait = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0.0
+        if wait > 0:
+            await asyncio.sleep(wait)
+        # 等待期间该key可能被限流, 需要等到暂停结束
+        while True:
+            blocked = bucket.blocked_until - monotonic()
+            if blocked <= 0:
+                return
+            await asyncio.sleep(blocked)
+
+    def feedback(self, key: str, status: int = None, retry_after: float = None, ok: bool = True):
+        """
+        :param key: key
+        :param status: 响应状态码, 没有响应时为None
+        :param retry_after: Retry-After 的秒数
+        :param ok: 请求是否成功
+        """
+        bucket = self._bucket(key)
+        if status in throttle_status:
+            bucket.counter.fail()
+            bucket.throttled_times += 1
+            if retry_after is None:
+                retry_after = min(self.max_backoff, self.backoff_base * 2 ** (bucket.throttled_times - 1))
+            now = monotonic()
+            bucket.refill(now)
+            bucket.factor = max(self.min_factor, bucket.factor / 2)
+            bucket.blocked_until = max(bucket.blocked_until, now + min(retry_after, self.max_backoff))
+            # 暂停结束后从空桶开始, 避免恢复时瞬间打出一个 burst
+            bucket.tokens = min(bucket.tokens, 0.0)
+        elif ok:
+            bucket.counter.success()
+            bucket.throttled_times = 0
+            if bucket.factor < 1.0 and bucket.counter.ratio() >= self.recover_ratio:
+                bucket.refill(monotonic())
+                bucket.factor = min(1.0, bucket.factor + self.recover_step)
+        else:
+            bucket.counter.fail()
+
+    def is_throttled(self, key: str) -> bool:
+        return self._bucket(key).blocked_until > monotonic()
@@ -1,33 +1,195 @@
 # @Author : taojinmin
 # @Time : 2023/4/4 12:36
+import math
 from collections import deque
+from time import monotonic
+from typing import Dict, List
 
 
 class SuccessRateCounter:
     """
-    ->in ｜...｜0｜1｜0｜0｜...｜ ->out
-    num in stat_q:
-        0 for success
-        1 for fail
+    成功率统计, 更新和读取都是 O(1):
+        按次数的窗口: ->in ｜...｜0｜1｜0｜0｜...｜ ->out, 0 for success, 1 for fail, 同时维护窗口内的失败数;
+        按时间的窗口(指定 window_seconds): 把窗口分成 slots 个时间槽, 每个槽记录成功/失败数, 过期的槽整体移出.
     """
     stat_q: deque = None
     capacity = None
 
-    def __init__(self, capacity: int = 100):
-        self.stat_q = deque()
+    def __init__(self, capacity: int = 100, window_seconds: float = None, slots: int = 10):
+        """
+        :param capacity: 按次数统计时的窗口大小
+        :param window_seconds: 指定时按最近 window_seconds 秒统计, capacity 不再生效
+        :param slots: 时间窗口的槽数, 越多过期越平滑
+        """
         self.capacity = capacity
+        self.window_seconds = window_seconds
+        self.stat_q = deque()
+        self._succ = 0
+        self._fail = 0
+        if window_seconds is not None:
+            if window_seconds <= 0 or slots < 1:
+                raise ValueError("window_seconds and slots must be greater than 0!")
+            self._slot_width = window_seconds / slots
+            # [槽编号, 成功数, 失败数]
+            self._slots = [[-1, 0, 0] for _ in range(slots)]
+
+    def _slot(self) -> list:
+        no = int(monotonic() / self._slot_width)
+        slot = self._slots[no % len(self._slots)]
+        if slot[0] != no:
+            self._succ -= slot[1]
+            self._fail -= slot[2]
+            slot[:] = [no, 0, 0]
+        return slot
+
+    def _expire(self):
+        # 读取前把所有过期的槽移出, 槽数固定, 仍是常数时间
+        horizon = int(monotonic() / self._slot_width) - len(self._slots)
+        for slot in self._slots:
+            if slot[0] <= horizon and (slot[1] or slot[2]):
+                self._succ -= slot[1]
+                self._fail -= slot[2]
+                slot[1] = slot[2] = 0
+
+    def _add(self, failed: int):
+        if self.window_seconds is not None:
+            self._slot()[1 + failed] += 1
+        else:
+            if len(self.stat_q) >= self.capacity:
+                if self.stat_q.pop():
+                    self._fail -= 1
+                else:
+                    self._succ -= 1
+            self.stat_q.appendleft(failed)
+        if failed:
+            self._fail += 1
+        else:
+            self._succ += 1
 
     def success(self):
-        if len(self.stat_q) >= self.capacity:
-            self.stat_q.pop()
-        self.stat_q.appendleft(0)
+        self._add(0)
 
     def fail(self):
-        if len(self.stat_q) >= self.capacity:
-            self.stat_q.pop()
-        self.stat_q.appendleft(1)
+        self._add(1)
+
+    def counts(self) -> tuple:
+        """
+        :return: 窗口内的 (成功数, 失败数)
+        """
+        if self.window_seconds is not None:
+            self._expire()
+        return self._succ, self._fail
+
+    def ratio(self) -> float:
+        succ, fail = self.counts()
+        if succ + fail > 0:
+            return succ / (succ + fail)
+        return 0.0
 
     def rate(self) -> str:
-        if len(self.stat_q) > 0:
-            return "%.2f%%" % (self.stat_q.count(0) * 100 / len(self.stat_q))
+        succ, fail = self.counts()
+        if succ + fail > 0:
+            return "%.2f%%" % (succ * 100 / (succ + fail))
         return "0%"
+
+
+class LatencyHistogram:
+    """
+    流式延迟直方图: 按对数刻度分桶(相邻桶边界相差 growth 倍), 记录是 O(1), 分位数的误差不超过 growth-1
+    """
+
+    def __init__(self, min_value: float = 0.001, max_value: float = 120.0, growth: float = 1.1):
+        """
+        :param min_value: 最小刻度(秒), 更小的值计入第一个桶
+        :param max_value: 最大刻度(秒), 更大的值计入最后一个桶
+        :param growth: 相邻桶边界的倍数
+        """
+        if growth <= 1 or not 0 < min_value < max_value:
+            raise ValueError("require growth > 1 and 0 < min_value < max_value!")
+        self.min_value = min_value
+        self.growth = growth
+        self._log_growth = math.log(growth)
+        self.buckets: List[int] = [0] * (int(math.log(max_value / min_value) / self._log_growth) + 2)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        if value <= self.min_value:
+            idx = 0
+        else:
+            idx = min(int(math.log(value / self.min_value) / self._log_growth) + 1, len(self.buckets) - 1)
+        self.buckets[idx] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p: float) -> float:
+        """
+        :param p: 0-100
+        :return: 分位数所在桶的上边界(秒), 没有数据时为0
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * p / 100))
+        seen = 0
+        for idx, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(self.min_value * self.growth ** idx, self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def summary(self) -> dict:
+        return {"count": self.count, "mean": self.mean(), "p50": self.percentile(50),
+                "p95": self.percentile(95), "p99": self.percentile(99), "max": self.max}
+
+    def reset(self):
+        self.buckets = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class RequestStats:
+    """
+    请求统计: 整体和按host的成功率与延迟分布
+    """
+
+    def __init__(self, capacity: int = 1000, window_seconds: float = None):
+        """
+        :param capacity: 按次数统计成功率的窗口
+        :param window_seconds: 指定时按时间窗口统计成功率
+        """
+        self.capacity = capacity
+        self.window_seconds = window_seconds
+        self.total = SuccessRateCounter(capacity, window_seconds)
+        self.latency = LatencyHistogram()
+        self.hosts: Dict[str, SuccessRateCounter] = dict()
+        self.host_latency: Dict[str, LatencyHistogram] = dict()
+
+    def record(self, host: str, ok: bool, latency: float = None):
+        counter = self.hosts.get(host)
+        if counter is None:
+            counter = self.hosts[host] = SuccessRateCounter(self.capacity, self.window_seconds)
+            self.host_latency[host] = LatencyHistogram()
+        if ok:
+            self.total.success()
+            counter.success()
+        else:
+            self.total.fail()
+            counter.fail()
+        if latency is not None:
+            self.latency.observe(latency)
+            self.host_latency[host].observe(latency)
+
+    def summary(self) -> dict:
+        return {
+            "rate": self.total.ratio(),
+            "latency": self.latency.summary(),
+            "hosts": {host: {"rate": counter.ratio(), "latency": self.host_latency[host].summary()}
+                      for host, counter in self.hosts.items()},
+        }
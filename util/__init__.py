@@ -2,4 +2,11 @@
 # @Time : 2023/2/6 18:32
 from iotoolkit.util.DefaultValue import DefaultValue
 from iotoolkit.util.LogKit import LogKit
-from iotoolkit.util.SuccessRateCounter import SuccessRateCounter
\ No newline at end of file
+from iotoolkit.util.SuccessRateCounter import SuccessRateCounter, LatencyHistogram, RequestStats
+from iotoolkit.util.DocId import DocIdStrategy, LegacyDocIdStrategy, get_id_strategy
+from iotoolkit.util.Checkpoint import CheckpointStore, FileCheckpointStore, SQLiteCheckpointStore
+from iotoolkit.util.ConcurrencyLimiter import AIMDLimiter
+from iotoolkit.util.RateLimiter import TokenBucketLimiter
+from iotoolkit.util.Metrics import MetricsRegistry, CallbackSink, JsonLinesSink, PrometheusServer, metrics
+from iotoolkit.util.ColumnBatch import ColumnBatch
+from iotoolkit.util.Codec import Codec, RawCodec, JsonCodec, OrjsonCodec, MsgpackCodec, get_codec, to_bytes